@@ -11,7 +11,10 @@ from .models import (
     Conclusao,
     Grupo,
     GrupoAdmin,
-    Comunidade
+    Comunidade,
+    RankingComunidade,
+    Esporte,
+    SinonimoEsporte,
 )
 
 
@@ -43,6 +46,19 @@ class PreferenciaAdmin(admin.ModelAdmin):
     search_fields = ("usuario__nome", "esportes")
 
 
+class SinonimoEsporteInline(admin.TabularInline):
+    model = SinonimoEsporte
+    extra = 1
+
+
+@admin.register(Esporte)
+class EsporteAdmin(admin.ModelAdmin):
+    # Depois de mudar sinônimos de esporte, rodar `manage.py sincronizar_esportes`
+    list_display = ("id_esporte", "nome")
+    search_fields = ("nome", "sinonimos__termo")
+    inlines = [SinonimoEsporteInline]
+
+
 @admin.register(Parceiro)
 class ParceiroAdmin(admin.ModelAdmin):
     list_display = ("id_parceiros", "usuario", "localizacao")
@@ -55,6 +71,12 @@ class RankingAdmin(admin.ModelAdmin):
     search_fields = ("usuario__nome",)
 
 
+@admin.register(RankingComunidade)
+class RankingComunidadeAdmin(admin.ModelAdmin):
+    list_display = ("id", "comunidade", "usuario", "pontuacao_total")
+    search_fields = ("comunidade__nome", "usuario__nome")
+
+
 @admin.register(Mensagem)
 class MensagemAdmin(admin.ModelAdmin):
     list_display = ("id_mensagem", "id_remetente", "id_destinatario", "hora")
@@ -94,4 +116,4 @@ from .models import Comunidade
 @admin.register(Comunidade)
 class ComunidadeAdmin(admin.ModelAdmin):
     filter_horizontal = ('membros',)
-    list_display = ('id', 'nome', 'admin', 'total_membros')
+    list_display = ('id', 'nome', 'esporte', 'admin', 'total_membros')
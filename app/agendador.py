@@ -0,0 +1,120 @@
+"""
+Agendador que junta (coalesce) os recálculos de ranking.
+
+Os signals só marcam os usuários afetados como pendentes, depois do commit
+da transação. Uma única thread de fundo por processo junta tudo o que ficou
+pendente e recalcula em lote, no máximo uma vez a cada
+RANKING_RECALCULO_INTERVALO segundos. Vários cliques na mesma janela (ou do
+mesmo usuário) viram um único recálculo, e a requisição HTTP não espera
+por ele.
+
+Com RANKING_RECALCULO = "sincrono" o recálculo acontece logo após o
+commit, sem thread (útil em testes e scripts).
+
+Pendências ainda não processadas se perdem se o processo morrer sem
+encerrar normalmente; o `manage.py reconstruir_ranking` noturno corrige
+qualquer diferença.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import ranking
+
+logger = logging.getLogger(__name__)
+
+
+class AgendadorRanking:
+    def __init__(self, intervalo=2.0, tamanho_lote=500):
+        self.intervalo = intervalo
+        self.tamanho_lote = tamanho_lote
+        self._pendentes = set()
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def marcar(self, usuario_ids):
+        """Marca usuários como pendentes e acorda o worker."""
+        with self._condicao:
+            self._pendentes.update(usuario_ids)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._executar, name="agendador-ranking", daemon=True
+                )
+                self._thread.start()
+            self._condicao.notify()
+
+    def _retirar_pendentes(self):
+        with self._condicao:
+            lote, self._pendentes = self._pendentes, set()
+        return lote
+
+    def processar(self):
+        """Recalcula tudo o que está pendente agora. Retorna quantos usuários."""
+        lote = self._retirar_pendentes()
+        ids = sorted(lote)
+        try:
+            for i in range(0, len(ids), self.tamanho_lote):
+                ranking.atualizar_pontuacao(ids[i:i + self.tamanho_lote])
+        except Exception:
+            logger.exception("Falha ao recalcular o ranking; tentando de novo no próximo ciclo")
+            with self._condicao:
+                self._pendentes.update(lote)
+            raise
+        finally:
+            close_old_connections()
+        return len(ids)
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+            # Janela de junção: o que chegar até aqui entra no mesmo lote,
+            # e limita a taxa a um lote por intervalo
+            time.sleep(self.intervalo)
+            try:
+                self.processar()
+            except Exception:
+                pass
+
+
+_agendador = None
+_agendador_lock = threading.Lock()
+
+
+def get_agendador():
+    global _agendador
+    with _agendador_lock:
+        if _agendador is None:
+            _agendador = AgendadorRanking(
+                intervalo=getattr(settings, "RANKING_RECALCULO_INTERVALO", 2.0),
+                tamanho_lote=getattr(settings, "RANKING_RECALCULO_LOTE", 500),
+            )
+            atexit.register(_esvaziar_ao_sair)
+    return _agendador
+
+
+def _esvaziar_ao_sair():
+    try:
+        _agendador.processar()
+    except Exception:
+        pass
+
+
+def agendar_recalculo(usuario_ids):
+    """
+    Agenda o recálculo dos usuários para depois do commit da transação
+    atual (imediatamente, se não houver transação aberta).
+    """
+    usuario_ids = set(usuario_ids)
+    if not usuario_ids:
+        return
+
+    if getattr(settings, "RANKING_RECALCULO", "thread") == "sincrono":
+        transaction.on_commit(lambda: ranking.atualizar_pontuacao(usuario_ids))
+    else:
+        transaction.on_commit(lambda: get_agendador().marcar(usuario_ids))
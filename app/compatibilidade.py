@@ -0,0 +1,257 @@
+"""
+Compatibilidade entre parceiros (sugestões da busca sem filtros de texto).
+
+Cada usuário vira uma linha de uma matriz numérica (NumPy), montada a
+partir da primeira preferência dele (a mesma que o perfil mostra), da
+data de nascimento e dos esportes do catálogo (EsporteUsuario):
+
+  - idade: quanto a idade de cada lado fica perto do `idade_parc` que o
+    outro pediu (1 = exata, 0 = COMPATIBILIDADE_TOLERANCIA_IDADE anos ou
+    mais de diferença; média dos lados que informaram);
+  - turno: 1 se os turnos são iguais;
+  - nivel: 1 - distância entre os níveis (Iniciante, Intermediário,
+    Avançado) / 2;
+  - esporte: fração dos esportes de quem busca que o outro pratica.
+
+Dado que falta de um dos lados vale 0,5 (neutro). A nota é a média dos
+componentes com os pesos de COMPATIBILIDADE_PESOS. `sexo` é o do próprio
+usuário, não uma preferência sobre o parceiro, então não entra na conta.
+
+Idade, nível e turno assumem poucos valores, então cada linha guarda só
+dois códigos pequenos: (idade, idade_parc) e (nivel, turno). Para quem
+busca monta-se uma tabela com a nota de cada código possível, e pontuar
+todos os candidatos vira duas consultas de tabela (np.take) e uma soma
+nas linhas de quem pratica os mesmos esportes; os K melhores saem de um
+argpartition. Com 500 mil usuários são dezenas de milissegundos.
+
+A matriz fica na memória do processo e é remontada depois de
+COMPATIBILIDADE_MATRIZ_TTL segundos, então perfis novos ou editados entram
+nas sugestões dos outros com esse atraso; o lado de quem busca é sempre
+lido na hora.
+"""
+import datetime
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import EsporteUsuario, Preferencia, Usuario
+
+NIVEIS = {"I": 0, "M": 1, "A": 2}
+TURNOS = {"M": 0, "T": 1, "N": 2}
+PESOS_PADRAO = {"idade": 1.0, "turno": 1.0, "nivel": 1.0, "esporte": 2.0}
+IDADES = 128  # idades 0..126; IDADES - 1 = não informada
+SEM_IDADE = IDADES - 1
+
+_matriz = None
+_trava = threading.Lock()  # protege a troca de _matriz
+_montando = threading.Lock()  # uma montagem por vez
+
+
+def _idade(nascimento, hoje):
+    if nascimento is None:
+        return SEM_IDADE
+    anos = hoje.year - nascimento.year - ((hoje.month, hoje.day) < (nascimento.month, nascimento.day))
+    return min(max(anos, 0), SEM_IDADE - 1)
+
+
+def _idade_parc(idade_parc):
+    return SEM_IDADE if idade_parc is None else min(max(idade_parc, 0), SEM_IDADE - 1)
+
+
+def _codigo_perfil(nivel, turno):
+    # 0 = não informado, 1..3 = o valor; 4 x 4 códigos
+    return (NIVEIS.get(nivel, -1) + 1) * 4 + TURNOS.get(turno, -1) + 1
+
+
+class Matriz:
+    """
+    Uma linha por usuário, em ordem de pk:
+      ids, codigo_idade (idade * IDADES + idade_parc), codigo_perfil
+      (ver _codigo_perfil) e os pares (linha, esporte) ordenados por
+      esporte, para achar os praticantes de um esporte por busca binária.
+    """
+
+    def __init__(self):
+        self.montada_em = time.monotonic()
+        self.lida_em = timezone.now()  # os dados são de até este instante
+        hoje = datetime.date.today()
+        self.ids = np.fromiter(
+            Usuario.objects.order_by("pk").values_list("pk", flat=True).iterator(chunk_size=10000),
+            dtype=np.int64,
+        )
+        n = len(self.ids)
+        idade = np.full(n, SEM_IDADE, dtype=np.int16)
+        idade_parc = np.full(n, SEM_IDADE, dtype=np.int16)
+        self.codigo_perfil = np.zeros(n, dtype=np.int8)
+
+        pks, idades = _colunas(
+            Usuario.objects.filter(idade__isnull=False).values_list("pk", "idade"),
+            lambda nascimento: _idade(nascimento, hoje),
+        )
+        linhas, achados = self.linhas(pks)
+        idade[linhas[achados]] = idades[achados]
+
+        # Só a primeira preferência de cada usuário (a de menor pk)
+        vistos = set()
+        primeiras = []
+        for usuario_id, nivel, turno, pedida in (
+            Preferencia.objects.order_by("usuario_id", "pk")
+            .values_list("usuario_id", "nivel", "turno", "idade_parc")
+            .iterator(chunk_size=10000)
+        ):
+            if usuario_id not in vistos:
+                vistos.add(usuario_id)
+                primeiras.append((usuario_id, _codigo_perfil(nivel, turno), _idade_parc(pedida)))
+        if primeiras:
+            pks, perfis, pedidas = (np.array(coluna, dtype=np.int64) for coluna in zip(*primeiras))
+            linhas, achados = self.linhas(pks)
+            self.codigo_perfil[linhas[achados]] = perfis[achados]
+            idade_parc[linhas[achados]] = pedidas[achados]
+        self.codigo_idade = idade * IDADES + idade_parc
+
+        pks, esportes = _colunas(EsporteUsuario.objects.values_list("usuario_id", "esporte_id"))
+        linhas, achados = self.linhas(pks)
+        linhas, esportes = linhas[achados], esportes[achados]
+        ordem = np.argsort(esportes, kind="stable")
+        self.esporte_ids = esportes[ordem]
+        self.esporte_linhas = linhas[ordem]
+
+    def linhas(self, pks):
+        """
+        (linhas, achados): a linha de cada um dos `pks` e se ele está na
+        matriz (usuários criados ou apagados durante a montagem não estão).
+        """
+        if not len(self.ids):
+            return np.zeros(len(pks), dtype=np.int64), np.zeros(len(pks), dtype=bool)
+        linhas = np.minimum(np.searchsorted(self.ids, pks), len(self.ids) - 1)
+        return linhas, self.ids[linhas] == pks
+
+    def praticantes(self, esporte_id):
+        """Linhas de quem pratica o esporte."""
+        inicio, fim = np.searchsorted(self.esporte_ids, [esporte_id, esporte_id + 1])
+        return self.esporte_linhas[inicio:fim]
+
+
+def _colunas(valores, converter=None):
+    """values_list de pares -> dois arrays int64 (convertendo o segundo valor)."""
+    pares = [
+        (a, converter(b) if converter else b)
+        for a, b in valores.iterator(chunk_size=10000)
+    ]
+    if not pares:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    a, b = zip(*pares)
+    return np.array(a, dtype=np.int64), np.array(b, dtype=np.int64)
+
+
+def matriz():
+    """
+    A matriz do processo, remontada se tiver mais de
+    COMPATIBILIDADE_MATRIZ_TTL segundos. A montagem roda fora de _trava:
+    enquanto uma thread remonta, as outras seguem com a matriz antiga (só
+    esperam quando ainda não há nenhuma) e a nova entra numa troca de
+    referência.
+    """
+    global _matriz
+    validade = getattr(settings, "COMPATIBILIDADE_MATRIZ_TTL", 300)
+    with _trava:
+        atual = _matriz
+    if atual is not None and time.monotonic() - atual.montada_em <= validade:
+        return atual
+    # Sem matriz, espera quem está montando; com uma vencida, não espera
+    if not _montando.acquire(blocking=atual is None):
+        return atual
+    try:
+        with _trava:
+            atual = _matriz
+        if atual is None or time.monotonic() - atual.montada_em > validade:
+            nova = Matriz()
+            with _trava:
+                _matriz = atual = nova
+        return atual
+    finally:
+        _montando.release()
+
+
+def _tabelas(usuario, pesos):
+    """
+    Nota já ponderada de cada codigo_idade e de cada codigo_perfil para
+    `usuario`, e o peso de cada esporte dele.
+    """
+    preferencia = usuario.preferencias.order_by("pk").first()
+    minha_idade = _idade(usuario.idade, datetime.date.today())
+    pedida = _idade_parc(preferencia.idade_parc if preferencia else None)
+    nivel = NIVEIS.get(preferencia.nivel, -1) if preferencia else -1
+    turno = TURNOS.get(preferencia.turno, -1) if preferencia else -1
+    esportes = set(usuario.esportes_praticados.values_list("esporte_id", flat=True))
+    tolerancia = getattr(settings, "COMPATIBILIDADE_TOLERANCIA_IDADE", 10)
+    total = sum(pesos.values()) or 1.0
+
+    # Idade: a do outro contra o que eu pedi e a minha contra o que ele pediu
+    valores = np.arange(IDADES)
+    conhecidos = valores != SEM_IDADE
+    ele_pedido = np.clip(1 - np.abs(valores - pedida) / tolerancia, 0, 1)
+    eu_pedido = np.clip(1 - np.abs(valores - minha_idade) / tolerancia, 0, 1)
+    lado1 = conhecidos & (pedida != SEM_IDADE)  # índice: idade do outro
+    lado2 = conhecidos & (minha_idade != SEM_IDADE)  # índice: idade_parc do outro
+    soma = np.where(lado1, ele_pedido, 0)[:, None] + np.where(lado2, eu_pedido, 0)[None, :]
+    lados = lado1[:, None].astype(int) + lado2[None, :]
+    idade = np.where(lados > 0, soma / np.maximum(lados, 1), 0.5)
+
+    # Nível e turno: códigos 0 (não informado) e 1..3
+    outros = np.arange(4) - 1
+    if nivel < 0:
+        nota_nivel = np.full(4, 0.5)
+    else:
+        nota_nivel = np.where(outros < 0, 0.5, 1 - np.abs(outros - nivel) / 2)
+    if turno < 0:
+        nota_turno = np.full(4, 0.5)
+    else:
+        nota_turno = np.where(outros < 0, 0.5, (outros == turno).astype(float))
+    perfil = pesos["nivel"] * nota_nivel[:, None] + pesos["turno"] * nota_turno[None, :]
+    if not esportes:
+        perfil = perfil + pesos["esporte"] * 0.5
+
+    return (
+        (pesos["idade"] * idade / total).ravel().astype(np.float32),
+        (perfil / total).ravel().astype(np.float32),
+        {esporte_id: pesos["esporte"] / len(esportes) / total for esporte_id in esportes},
+    )
+
+
+def notas(usuario, m=None):
+    """Nota (0 a 1) de cada linha da matriz para `usuario`; a dele próprio é -inf."""
+    m = m or matriz()
+    pesos = {**PESOS_PADRAO, **getattr(settings, "COMPATIBILIDADE_PESOS", {})}
+    por_idade, por_perfil, por_esporte = _tabelas(usuario, pesos)
+    resultado = por_idade.take(m.codigo_idade)
+    resultado += por_perfil.take(m.codigo_perfil)
+    for esporte_id, peso in por_esporte.items():
+        resultado[m.praticantes(esporte_id)] += peso
+    linhas, achados = m.linhas(np.array([usuario.pk]))
+    resultado[linhas[achados]] = -np.inf
+    return resultado
+
+
+def melhores(usuario, quantos, entre=None):
+    """
+    [(id do usuário, nota)] dos `quantos` mais compatíveis com `usuario`,
+    do mais para o menos compatível. `entre`: só estes ids de usuário.
+    """
+    m = matriz()
+    resultado = notas(usuario, m)
+    if entre is not None:
+        permitidos = np.full(len(m.ids), -np.inf, dtype=np.float32)
+        linhas, achados = m.linhas(np.fromiter(entre, dtype=np.int64))
+        permitidos[linhas[achados]] = 0
+        resultado += permitidos
+    validos = int(np.count_nonzero(np.isfinite(resultado)))
+    quantos = min(quantos, validos)
+    if quantos <= 0:
+        return []
+    topo = np.argpartition(-resultado, quantos - 1)[:quantos]
+    topo = topo[np.lexsort((m.ids[topo], -resultado[topo]))]
+    return [(int(m.ids[linha]), float(resultado[linha])) for linha in topo]
@@ -0,0 +1,578 @@
+"""
+Serviço das conversas do chat: diretas (Mensagem) e de grupo (MensagemGrupo).
+
+Cada envio atualiza dois ResumoConversa, um para cada lado: a prévia e a
+hora da última mensagem e, para quem recebeu, o contador de não lidas.
+A lista lateral do chat lê só esses resumos, numa consulta ordenada pelo
+índice (usuario, -ultima_hora), sem varrer o histórico de mensagens.
+
+registrar_envios() recebe uma lista para que gravações em lote usem o
+mesmo caminho que o signal de post_save (app/signals.py).
+reconstruir_resumos() (e `manage.py reconstruir_resumos_conversa`) refaz
+os resumos a partir da tabela de mensagens.
+
+Mensagens de grupo são gravadas uma vez só (nada de cópia por membro):
+o envio atualiza a prévia e o total_mensagens do Grupo, e cada membro tem
+um LeituraGrupo com quantas já leu. Não lidas = total - lidas.
+
+O histórico de uma conversa é lido de trás para frente em páginas por
+keyset (hora, id_mensagem): pagina_de_mensagens() devolve a página mais
+recente e um cursor para buscar as anteriores; mensagens_depois() faz o
+caminho inverso, para o chat ao vivo. Os dois sentidos da conversa têm a
+mesma Mensagem.conversa (chave_conversa), então cada página é uma única
+leitura de faixa no índice (conversa, -hora, -id_mensagem).
+
+Cada envio também grava no cache o cursor da última mensagem da conversa
+(marcar_novidade). Quem está esperando mensagens novas (long-polling)
+consulta o cache enquanto nada muda e o banco só quando o aviso muda ou
+a cada CHAT_ESPERA_CONFERENCIA segundos. Depois do commit a mensagem é
+publicada para os WebSockets conectados (app/tempo_real.py).
+
+buscar_mensagens() faz a busca textual no histórico de quem busca, pela
+coluna tsvector `busca` (gerada pelo banco, com índice GIN).
+"""
+import datetime
+from collections import Counter
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import particoes, tempo_real
+from .models import (
+    CONFIG_BUSCA,
+    Grupo,
+    LeituraGrupo,
+    Mensagem,
+    MensagemGrupo,
+    ResumoConversa,
+    chave_conversa,
+)
+
+TAMANHO_PREVIA = 200
+TAMANHO_PAGINA_MENSAGENS = 50
+
+
+# ======== Manutenção dos resumos ========
+
+def registrar_envios(mensagens):
+    """
+    Atualiza os resumos das duas pontas de cada mensagem. Várias mensagens
+    da mesma conversa viram uma única atualização por lado.
+    """
+    ultimas = {}  # (dono, contato) -> mensagem mais recente
+    recebidas = Counter()  # (dono, contato) -> quantas o dono recebeu
+    for msg in mensagens:
+        remetente, destinatario = msg.id_remetente_id, msg.id_destinatario_id
+        for chave in ((remetente, destinatario), (destinatario, remetente)):
+            atual = ultimas.get(chave)
+            if atual is None or (msg.hora, msg.pk) > (atual.hora, atual.pk):
+                ultimas[chave] = msg
+        if remetente != destinatario:
+            recebidas[(destinatario, remetente)] += 1
+
+    for (dono, contato), msg in ultimas.items():
+        _atualizar_resumo(dono, contato, msg, recebidas[(dono, contato)])
+        if dono <= contato:
+            marcar_novidade(chave_conversa(dono, contato), msg)
+
+    for msg in mensagens:
+        remetente, destinatario = msg.id_remetente_id, msg.id_destinatario_id
+        publicar_mensagem(
+            chave_conversa(remetente, destinatario),
+            {tempo_real.canal_usuario(remetente), tempo_real.canal_usuario(destinatario)},
+            mensagem_json(msg),
+        )
+
+
+def registrar_envios_grupo(mensagens):
+    """
+    Atualiza o resumo de cada grupo (prévia e total de mensagens), conta
+    as mensagens como lidas para quem mandou e avisa quem está esperando
+    (long-polling e WebSocket).
+    """
+    por_grupo = {}
+    for msg in mensagens:
+        por_grupo.setdefault(msg.id_grupo_id, []).append(msg)
+
+    for grupo_id, msgs in por_grupo.items():
+        ultima = max(msgs, key=lambda msg: (msg.hora, msg.pk))
+        grupo = Grupo.objects.filter(id_grupo=grupo_id)
+        grupo.update(total_mensagens=F("total_mensagens") + len(msgs))
+        grupo.filter(Q(ultima_hora__isnull=True) | Q(ultima_hora__lte=ultima.hora)).update(
+            ultima_mensagem=ultima.mensagem[:TAMANHO_PREVIA],
+            ultima_hora=ultima.hora,
+            id_ultima_mensagem=ultima.pk,
+        )
+        for remetente, enviadas in Counter(msg.id_remetente_id for msg in msgs).items():
+            LeituraGrupo.objects.filter(grupo_id=grupo_id, usuario_id=remetente).update(
+                mensagens_lidas=F("mensagens_lidas") + enviadas
+            )
+
+        chave = chave_grupo(grupo_id)
+        marcar_novidade(chave, ultima)
+        for msg in msgs:
+            publicar_mensagem(
+                chave, {tempo_real.canal_grupo(grupo_id)}, mensagem_json(msg, com_nome=True)
+            )
+
+
+def _atualizar_resumo(dono, contato, msg, novas, tentativa=0):
+    resumo = ResumoConversa.objects.filter(usuario_id=dono, contato_id=contato)
+    campos = {
+        "ultima_mensagem": msg.mensagem[:TAMANHO_PREVIA],
+        "ultima_hora": msg.hora,
+        "id_ultima_mensagem": msg.pk,
+    }
+
+    # Caminho comum: uma única atualização (prévia + contador atômico)
+    if resumo.filter(ultima_hora__lte=msg.hora).update(
+        nao_lidas=F("nao_lidas") + novas, **campos
+    ):
+        return
+    # Já existe um resumo mais novo (mensagem gravada fora de ordem): só conta
+    if resumo.update(nao_lidas=F("nao_lidas") + novas):
+        return
+
+    try:
+        with transaction.atomic():
+            ResumoConversa.objects.create(
+                usuario_id=dono, contato_id=contato, nao_lidas=novas, **campos
+            )
+    except IntegrityError:
+        # Outro envio criou o resumo ao mesmo tempo: agora ele existe
+        if tentativa:
+            raise
+        _atualizar_resumo(dono, contato, msg, novas, tentativa=1)
+
+
+# As não lidas são contadores: somam com F() a cada envio e voltam para 0
+# quando o usuário vê a conversa, sem contar mensagens. O marcador lida_ate
+# guarda até qual mensagem ele viu (ids crescem com a hora).
+
+def marcar_como_lida(usuario_id, contato_id, ate=None):
+    """
+    Marca a conversa de `usuario_id` com `contato_id` como lida até a
+    mensagem `ate` (ou até a última). Nunca volta o marcador para trás.
+    """
+    resumo = ResumoConversa.objects.filter(usuario_id=usuario_id, contato_id=contato_id)
+    if ate is None:
+        resumo.update(nao_lidas=0, lida_ate=F("id_ultima_mensagem"))
+        return
+    resumo = resumo.filter(Q(lida_ate__isnull=True) | Q(lida_ate__lt=ate))
+
+    # Caso comum: `ate` é a última mensagem da conversa
+    if resumo.filter(
+        Q(id_ultima_mensagem__isnull=True) | Q(id_ultima_mensagem__lte=ate)
+    ).update(nao_lidas=0, lida_ate=ate):
+        return
+    # Chegaram outras depois de `ate`: continuam não lidas (faixa curta no índice)
+    depois = Mensagem.objects.filter(
+        conversa=chave_conversa(usuario_id, contato_id),
+        id_remetente_id=contato_id,
+        id_mensagem__gt=ate,
+    ).order_by().values("conversa").annotate(total=Count("pk")).values("total")
+    resumo.update(nao_lidas=Coalesce(Subquery(depois), Value(0)), lida_ate=ate)
+
+
+def marcar_grupo_como_lido(usuario_id, grupo_id, ate=None):
+    """Como marcar_como_lida(), para o marcador do membro no grupo."""
+    grupo = Grupo.objects.filter(id_grupo=grupo_id)
+    total = grupo.values("total_mensagens")
+    leitura = LeituraGrupo.objects.filter(grupo_id=grupo_id, usuario_id=usuario_id)
+
+    if ate is None:
+        # O total é lido na própria atualização, sem janela para perder envios
+        atualizados = leitura.update(
+            mensagens_lidas=Subquery(total), lida_ate=Subquery(grupo.values("id_ultima_mensagem"))
+        )
+    else:
+        leitura = leitura.filter(Q(lida_ate__isnull=True) | Q(lida_ate__lt=ate))
+        depois = MensagemGrupo.objects.filter(
+            id_grupo_id=grupo_id, id_mensagem__gt=ate
+        ).order_by().values("id_grupo").annotate(total=Count("pk")).values("total")
+        atualizados = leitura.update(
+            mensagens_lidas=Subquery(total) - Coalesce(Subquery(depois), Value(0)),
+            lida_ate=ate,
+        )
+        if not atualizados and LeituraGrupo.objects.filter(
+            grupo_id=grupo_id, usuario_id=usuario_id
+        ).exists():
+            return  # o marcador já estava adiante
+
+    if not atualizados:
+        info = grupo.values("total_mensagens", "id_ultima_mensagem").first() or {}
+        LeituraGrupo.objects.bulk_create(
+            [LeituraGrupo(
+                grupo_id=grupo_id,
+                usuario_id=usuario_id,
+                mensagens_lidas=info.get("total_mensagens", 0),
+                lida_ate=info.get("id_ultima_mensagem") if ate is None else ate,
+            )],
+            ignore_conflicts=True,
+        )
+
+
+def iniciar_leituras(grupo_id, usuario_ids):
+    """Novos membros começam com o histórico já existente contado como lido."""
+    info = Grupo.objects.filter(id_grupo=grupo_id).values(
+        "total_mensagens", "id_ultima_mensagem"
+    ).first() or {}
+    LeituraGrupo.objects.bulk_create(
+        [
+            LeituraGrupo(
+                grupo_id=grupo_id,
+                usuario_id=uid,
+                mensagens_lidas=info.get("total_mensagens", 0),
+                lida_ate=info.get("id_ultima_mensagem"),
+            )
+            for uid in usuario_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def reconstruir_resumos(tamanho_lote=1000):
+    """
+    Refaz a prévia e a hora de todos os resumos a partir de `mensagens`,
+    com upsert em lote. As não lidas de resumos novos começam em 0 (o
+    histórico não guarda o que já foi lido). Retorna quantos resumos.
+    """
+    # Última mensagem de cada conversa. Os ids são crescentes com a hora
+    # (auto_now_add), então o maior id é a última.
+    ids = sorted(
+        Mensagem.objects
+        .order_by()
+        .values("conversa")
+        .annotate(ultima=Max("id_mensagem"))
+        .values_list("ultima", flat=True)
+    )
+    total = 0
+    for i in range(0, len(ids), tamanho_lote):
+        mensagens = Mensagem.objects.only(
+            "id_mensagem", "id_remetente", "id_destinatario", "mensagem", "hora"
+        ).in_bulk(ids[i:i + tamanho_lote])
+        resumos = []
+        for msg in mensagens.values():
+            for dono, contato in (
+                (msg.id_remetente_id, msg.id_destinatario_id),
+                (msg.id_destinatario_id, msg.id_remetente_id),
+            ):
+                resumos.append(ResumoConversa(
+                    usuario_id=dono,
+                    contato_id=contato,
+                    ultima_mensagem=msg.mensagem[:TAMANHO_PREVIA],
+                    ultima_hora=msg.hora,
+                    id_ultima_mensagem=msg.pk,
+                ))
+                if dono == contato:
+                    break
+        ResumoConversa.objects.bulk_create(
+            resumos,
+            update_conflicts=True,
+            unique_fields=["usuario", "contato"],
+            update_fields=["ultima_mensagem", "ultima_hora", "id_ultima_mensagem"],
+        )
+        total += len(resumos)
+    return total
+
+
+# ======== Lista lateral do chat ========
+
+def conversas_da_lateral(usuario, contato_ativo=None, grupo_ativo=None):
+    """
+    Itens da lista lateral do chat, da conversa mais recente para a mais
+    antiga: uma consulta nos resumos das conversas diretas e uma nos grupos
+    (com total de membros e não lidas do usuário já calculados).
+    """
+    conversas = []
+    resumos = (
+        ResumoConversa.objects
+        .filter(usuario=usuario)
+        .select_related("contato")
+        .order_by("-ultima_hora")
+    )
+    for resumo in resumos:
+        contato = resumo.contato
+        conversas.append({
+            'id': contato.id_usuario,
+            'nome': contato.nome,
+            'foto_perfil': contato.foto_perfil,
+            'last_message': resumo.ultima_mensagem or "Inicie a conversa",
+            'nao_lidas': resumo.nao_lidas,
+            'is_group': False,
+            'is_active': contato.id_usuario == contato_ativo,
+            'hora': resumo.ultima_hora,
+            'chave': chave_conversa(usuario.id_usuario, contato.id_usuario),
+        })
+
+    # Filtra por subconsulta: contar em usuario.grupos reaproveitaria o
+    # join do filtro e daria sempre 1
+    lidas = LeituraGrupo.objects.filter(
+        grupo=OuterRef("pk"), usuario=usuario
+    ).values("mensagens_lidas")
+    grupos = (
+        Grupo.objects
+        .filter(id_grupo__in=usuario.grupos.values("id_grupo"))
+        .annotate(
+            total_membros=Count("membros"),
+            lidas=Coalesce(Subquery(lidas), Value(0)),
+        )
+    )
+    for grupo in grupos:
+        conversas.append({
+            'id': grupo.id_grupo,
+            'nome': grupo.nome,
+            'foto_perfil': None,  # Grupos usam ícone
+            'last_message': grupo.ultima_mensagem or f"Membros: {grupo.total_membros}",
+            'nao_lidas': max(grupo.total_mensagens - grupo.lidas, 0),
+            'is_group': True,
+            'is_active': grupo.id_grupo == grupo_ativo,
+            'hora': grupo.ultima_hora or grupo.criado_em,
+            'chave': chave_grupo(grupo.id_grupo),
+        })
+
+    conversas.sort(key=lambda conversa: conversa['hora'], reverse=True)
+    return conversas
+
+
+# ======== Histórico paginado ========
+
+_EPOCA = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def codificar_cursor(mensagem):
+    """Cursor de uma mensagem: "microssegundos_id" (seguro em query string)."""
+    return _cursor(mensagem.hora, mensagem.pk)
+
+
+def _cursor(hora, mensagem_id):
+    micros = (hora - _EPOCA) // datetime.timedelta(microseconds=1)
+    return f"{micros}_{mensagem_id}"
+
+
+def decodificar_cursor(texto):
+    """Inverso de codificar_cursor(); None se vazio, ValueError se inválido."""
+    if not texto:
+        return None
+    micros, _, mensagem_id = texto.partition("_")
+    return _EPOCA + datetime.timedelta(microseconds=int(micros)), int(mensagem_id)
+
+
+def pagina_de_mensagens(usuario_id, contato_id, antes=None, tamanho=TAMANHO_PAGINA_MENSAGENS):
+    """
+    As `tamanho` mensagens mais recentes da conversa (anteriores ao cursor
+    `antes`, se houver), em ordem cronológica, e o cursor para a página
+    anterior (None quando chegou ao começo).
+
+    Uma leitura de faixa em mensagem_chave_hora_idx. Quando a conversa
+    acaba antes de completar a página e ainda há meses dela no arquivo frio,
+    o cursor continua valendo; uma página pedida com cursor (a rolagem para
+    cima) pede a volta ao banco do mês arquivado mais recente anterior ao
+    cursor (app/particoes.py), que acontece fora da requisição. Enquanto
+    ele não chega, a página vem vazia com o mesmo cursor: peça de novo.
+    """
+    chave = chave_conversa(usuario_id, contato_id)
+    consulta = Mensagem.objects.filter(conversa=chave)
+    return _pagina(consulta, "mensagens", chave, antes, tamanho)
+
+
+def pagina_de_mensagens_grupo(grupo_id, antes=None, tamanho=TAMANHO_PAGINA_MENSAGENS):
+    """Como pagina_de_mensagens(), para o grupo: uma leitura de faixa em mensagem_grupo_hora_idx."""
+    consulta = MensagemGrupo.objects.filter(id_grupo_id=grupo_id).select_related("id_remetente")
+    return _pagina(consulta, "mensagens_grupo", chave_grupo(grupo_id), antes, tamanho)
+
+
+def _pagina(consulta, tabela, chave, antes, tamanho):
+    if antes is not None:
+        hora, mensagem_id = antes
+        consulta = consulta.filter(Q(hora__lt=hora) | Q(hora=hora, id_mensagem__lt=mensagem_id))
+    consulta = consulta.order_by("-hora", "-id_mensagem")[:tamanho + 1]
+    mensagens = list(consulta)
+    # Nunca na abertura do chat; a restauração não roda na requisição
+    # (só no modo "sincrono", e aí a leitura é refeita)
+    if len(mensagens) <= tamanho and antes is not None:
+        if particoes.pedir_restauracao(tabela, chave, antes=antes[0]):
+            mensagens = list(consulta.all())
+    tem_anteriores = len(mensagens) > tamanho
+    mensagens = mensagens[:tamanho]
+    mensagens.reverse()
+    if mensagens:
+        inicio = (mensagens[0].hora, mensagens[0].pk)
+    else:
+        inicio = antes or (timezone.now(), 0)
+    if not tem_anteriores and not particoes.tem_arquivo(tabela, chave, antes=inicio[0]):
+        return mensagens, None
+    return mensagens, _cursor(*inicio)
+
+
+def mensagens_depois(usuario_id, contato_id, depois, limite=TAMANHO_PAGINA_MENSAGENS):
+    """
+    Mensagens da conversa posteriores ao cursor `depois`, em ordem
+    cronológica (no máximo `limite`). Espelho de pagina_de_mensagens().
+    """
+    hora, mensagem_id = depois
+    return list(
+        Mensagem.objects
+        .filter(conversa=chave_conversa(usuario_id, contato_id))
+        .filter(Q(hora__gt=hora) | Q(hora=hora, id_mensagem__gt=mensagem_id))
+        .order_by("hora", "id_mensagem")[:limite]
+    )
+
+
+def mensagens_grupo_depois(grupo_id, depois, limite=TAMANHO_PAGINA_MENSAGENS):
+    """Mensagens do grupo posteriores ao cursor `depois`, em ordem cronológica."""
+    hora, mensagem_id = depois
+    return list(
+        MensagemGrupo.objects
+        .filter(id_grupo_id=grupo_id)
+        .filter(Q(hora__gt=hora) | Q(hora=hora, id_mensagem__gt=mensagem_id))
+        .select_related("id_remetente")
+        .order_by("hora", "id_mensagem")[:limite]
+    )
+
+
+def mensagem_json(mensagem, com_nome=False):
+    dados = {
+        "id": mensagem.pk,
+        "remetente_id": mensagem.id_remetente_id,
+        "mensagem": mensagem.mensagem,
+        "hora": mensagem.hora.isoformat(),
+        "cursor": codificar_cursor(mensagem),
+    }
+    if com_nome:
+        dados["remetente_nome"] = mensagem.id_remetente.nome
+    return dados
+
+
+# ======== Busca no histórico ========
+
+TAMANHO_PAGINA_BUSCA = 20
+# Delimitadores do trecho vindo do ts_headline. São caracteres de controle,
+# que não aparecem no texto digitado: o trecho é escapado inteiro e só
+# depois eles viram <mark>.
+_INICIO_DESTAQUE = "\x02"
+_FIM_DESTAQUE = "\x03"
+
+
+def buscar_mensagens(usuario, termo, pagina=1, tamanho=TAMANHO_PAGINA_BUSCA):
+    """
+    Mensagens das conversas diretas e dos grupos do usuário que casam com
+    `termo` (sintaxe de buscador: "frase exata", -palavra, or), da mais
+    relevante para a menos relevante e, no empate, da mais nova para a mais
+    antiga.
+
+    Retorna (resultados, tem_proxima). Cada resultado é um dict com
+    "tipo" ("u" ou "g"), "mensagem", "relevancia" e "trecho" (HTML seguro,
+    com os termos encontrados em <mark>).
+    """
+    consulta = SearchQuery(termo, config=CONFIG_BUSCA, search_type="websearch")
+    relevancia = SearchRank(F("busca"), consulta)
+
+    # Primeiro só ids e relevância (os dois índices GIN), juntando as duas
+    # tabelas; o trecho destacado, que é caro, só para a página pedida.
+    diretas = (
+        Mensagem.objects
+        .filter(Q(id_remetente=usuario) | Q(id_destinatario=usuario), busca=consulta)
+        .annotate(tipo=Value("u", output_field=CharField()), relevancia=relevancia)
+        .values_list("tipo", "id_mensagem", "relevancia", "hora")
+    )
+    de_grupos = (
+        MensagemGrupo.objects
+        .filter(id_grupo__in=usuario.grupos.values("id_grupo"), busca=consulta)
+        .annotate(tipo=Value("g", output_field=CharField()), relevancia=relevancia)
+        .values_list("tipo", "id_mensagem", "relevancia", "hora")
+    )
+    inicio = (pagina - 1) * tamanho
+    linhas = list(
+        diretas.union(de_grupos, all=True)
+        .order_by("-relevancia", "-hora")[inicio:inicio + tamanho + 1]
+    )
+    tem_proxima = len(linhas) > tamanho
+    linhas = linhas[:tamanho]
+
+    destaque = SearchHeadline(
+        "mensagem",
+        consulta,
+        config=CONFIG_BUSCA,
+        start_sel=_INICIO_DESTAQUE,
+        stop_sel=_FIM_DESTAQUE,
+        max_words=25,
+        min_words=8,
+        max_fragments=2,
+        fragment_delimiter=" … ",
+    )
+    ids = {"u": [], "g": []}
+    for tipo, mensagem_id, _, _ in linhas:
+        ids[tipo].append(mensagem_id)
+    mensagens = {
+        "u": Mensagem.objects.select_related("id_remetente", "id_destinatario")
+        .annotate(trecho=destaque).in_bulk(ids["u"]),
+        "g": MensagemGrupo.objects.select_related("id_remetente", "id_grupo")
+        .annotate(trecho=destaque).in_bulk(ids["g"]),
+    }
+
+    resultados = []
+    for tipo, mensagem_id, valor, _ in linhas:
+        mensagem = mensagens[tipo].get(mensagem_id)
+        if mensagem is None:
+            continue  # apagada entre as duas consultas
+        resultados.append({
+            "tipo": tipo,
+            "mensagem": mensagem,
+            "relevancia": valor,
+            "trecho": _destacar(mensagem.trecho),
+        })
+    return resultados, tem_proxima
+
+
+def _destacar(trecho):
+    return mark_safe(
+        escape(trecho)
+        .replace(_INICIO_DESTAQUE, "<mark>")
+        .replace(_FIM_DESTAQUE, "</mark>")
+    )
+
+
+# ======== Aviso de mensagens novas ========
+# O cache guarda, por conversa, o cursor da última mensagem. É só uma
+# dica: com um cache compartilhado (Redis/Memcached) ele muda a cada envio;
+# com o cache local (LocMem) cada processo só vê os envios que ele mesmo
+# gravou, e mensagens gravadas por outro processo só aparecem na
+# conferência do banco que a espera faz a cada CHAT_ESPERA_CONFERENCIA
+# segundos. Sem a chave (expirada) a espera consulta o banco a cada intervalo.
+
+CACHE_NOVIDADE_TIMEOUT = 60 * 60 * 24
+
+
+def chave_grupo(grupo_id):
+    return f"g{grupo_id}"
+
+
+def marcar_novidade(chave, mensagem):
+    """Grava o cursor só depois do commit: quem acordar com ele já acha a mensagem no banco."""
+    cursor = codificar_cursor(mensagem)
+    transaction.on_commit(
+        lambda: cache.set(f"chat:ultima:{chave}", cursor, CACHE_NOVIDADE_TIMEOUT)
+    )
+
+
+async def ultima_novidade(chave):
+    return await cache.aget(f"chat:ultima:{chave}")
+
+
+def publicar_mensagem(chave, canais, dados):
+    """Publica a mensagem nos canais de tempo real, só depois do commit."""
+    evento = {"conversa": chave, "mensagem": dados}
+
+    def publicar():
+        pubsub = tempo_real.get_pubsub()
+        for canal in canais:
+            pubsub.publicar(canal, evento)
+
+    transaction.on_commit(publicar)
@@ -0,0 +1,129 @@
+"""
+Catálogo de esportes: Esporte, SinonimoEsporte e EsporteUsuario.
+
+O usuário continua escrevendo os esportes em texto livre
+(Preferencia.esportes, ex.: "Futebol, corridas de rua e vôlei"). A cada
+gravação de preferência o texto é separado em termos e cada termo é
+normalizado (minúsculas, sem acento, espaços simples) e procurado nos
+sinônimos: primeiro exato, depois com as palavras no singular
+("corridas de rua" -> "corrida de rua") e por fim o sinônimo mais
+parecido (difflib, pelo menos ESPORTES_SEMELHANCA_MINIMA), para erros de
+digitação. Termo que não casa com nada vira um Esporte novo, com ele
+mesmo de sinônimo, para continuar achável.
+
+Os esportes de cada usuário ficam em EsporteUsuario, com índice
+(esporte, usuario): filtrar parceiros por esporte é uma busca exata nesse
+índice, e "corrida" não acha mais quem só faz "corrida de rua".
+
+Se um sinônimo mudar de esporte no admin, `manage.py sincronizar_esportes`
+refaz os esportes de todos os usuários.
+"""
+import difflib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Esporte, EsporteUsuario, Preferencia, SinonimoEsporte
+
+_SEPARADORES = re.compile(r"\s*(?:[,;/|+\n]|\s-\s|\be\b)\s*")
+
+
+def normalizar(texto):
+    """"  Vôlei  de Praia" -> "volei de praia"."""
+    sem_acento = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", sem_acento.lower()).split())
+
+
+def separar(texto):
+    """"Futebol, corrida e vôlei" -> ["Futebol", "corrida", "vôlei"]."""
+    return [termo.strip() for termo in _SEPARADORES.split(texto or "") if normalizar(termo)]
+
+
+def _singular(termo):
+    return " ".join(
+        palavra[:-1] if len(palavra) > 3 and palavra.endswith("s") else palavra
+        for palavra in termo.split()
+    )
+
+
+class Catalogo:
+    """
+    Casa termos com esportes, lembrando os já vistos: um por requisição ou
+    por lote, para não repetir consultas do mesmo termo.
+    """
+
+    def __init__(self):
+        self._ids = {}  # termo normalizado -> id do esporte (ou None)
+        self._sinonimos = None  # todos, carregados só se precisar aproximar
+
+    def resolver(self, texto, criar=False):
+        """
+        Ids dos esportes citados em `texto`. Com `criar`, termos que não casam
+        com nenhum sinônimo viram esportes novos; sem, são ignorados.
+        """
+        ids = set()
+        for original in separar(texto):
+            termo = normalizar(original)[:60]
+            if termo not in self._ids:
+                self._ids[termo] = self._procurar(termo)
+            if self._ids[termo] is None and criar:
+                self._ids[termo] = _criar(original, termo)
+            if self._ids[termo] is not None:
+                ids.add(self._ids[termo])
+        return ids
+
+    def _procurar(self, termo):
+        candidatos = list(dict.fromkeys([termo, _singular(termo)]))
+        encontrados = dict(
+            SinonimoEsporte.objects.filter(termo__in=candidatos).values_list("termo", "esporte_id")
+        )
+        for candidato in candidatos:
+            if candidato in encontrados:
+                return encontrados[candidato]
+        # Erro de digitação: o sinônimo mais parecido, se for parecido o bastante
+        if self._sinonimos is None:
+            self._sinonimos = dict(SinonimoEsporte.objects.values_list("termo", "esporte_id"))
+        parecidos = difflib.get_close_matches(
+            termo, self._sinonimos, n=1,
+            cutoff=getattr(settings, "ESPORTES_SEMELHANCA_MINIMA", 0.85),
+        )
+        return self._sinonimos[parecidos[0]] if parecidos else None
+
+
+def _criar(original, termo):
+    nome = " ".join(original.split())[:60]
+    nome = nome[:1].upper() + nome[1:]
+    try:
+        with transaction.atomic():
+            esporte, _ = Esporte.objects.get_or_create(nome=nome)
+            SinonimoEsporte.objects.create(termo=termo, esporte=esporte)
+    except IntegrityError:
+        # Outra requisição criou o mesmo sinônimo ao mesmo tempo
+        return SinonimoEsporte.objects.get(termo=termo).esporte_id
+    return esporte.pk
+
+
+def sincronizar(usuario_ids, catalogo=None):
+    """Refaz os EsporteUsuario dos usuários a partir das preferências deles."""
+    usuario_ids = set(usuario_ids)
+    catalogo = catalogo or Catalogo()
+    textos = {}
+    for usuario_id, esportes in (
+        Preferencia.objects.filter(usuario_id__in=usuario_ids).values_list("usuario_id", "esportes")
+    ):
+        textos.setdefault(usuario_id, []).append(esportes)
+    pares = [
+        EsporteUsuario(usuario_id=usuario_id, esporte_id=esporte_id)
+        for usuario_id, lista in textos.items()
+        for esporte_id in catalogo.resolver(",".join(lista), criar=True)
+    ]
+    with transaction.atomic():
+        EsporteUsuario.objects.filter(usuario_id__in=usuario_ids).delete()
+        EsporteUsuario.objects.bulk_create(pares, ignore_conflicts=True)
+
+
+def usuarios_que_praticam(esporte_ids):
+    """Subconsulta com os ids dos usuários que praticam algum dos esportes."""
+    return EsporteUsuario.objects.filter(esporte_id__in=esporte_ids).values("usuario_id")
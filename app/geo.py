@@ -0,0 +1,238 @@
+"""
+Localização de parceiros e grupos: coordenadas, geohash e busca por raio.
+
+`localizacao` continua sendo texto livre ("Recife", "Campinas - SP",
+"Boa Viagem, Recife/PE"). Ao salvar um Parceiro ou Grupo, o texto é
+procurado no gazetteer GEO_GAZETEER, um CSV offline de municípios
+(nome,uf,latitude,longitude; o que vem no repositório tem as capitais e
+as maiores cidades, e pode ser trocado pela lista completa do IBGE no
+mesmo formato). A cidade encontrada dá a latitude, a longitude e o
+geohash gravados na linha. Nada de PostGIS nem de rede: o resto é SQL
+comum e Python.
+
+Busca por raio: o geohash de um ponto é um prefixo de todos os geohashes
+da célula em volta dele, então escolhe-se o maior prefixo cuja célula é
+pelo menos do tamanho do raio e lê-se a célula do centro e as 8
+vizinhas (`geohash LIKE 'prefixo%'`, pelo índice _like do campo). Só
+essas linhas têm a distância calculada (haversine em SQL) e comparada
+com o raio.
+
+Mais próximos: raios crescentes a partir de GEO_RAIO_INICIAL até achar
+`quantos` linhas (ou chegar a GEO_RAIO_MAXIMO) e, dentro dele, ordem de
+distância. Quem não tem coordenadas (texto que não é cidade conhecida)
+não aparece em buscas por distância.
+
+`manage.py geocodificar_locais` preenche as coordenadas das linhas antigas.
+"""
+import csv
+import difflib
+import functools
+import math
+import re
+
+from django.conf import settings
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+from .esportes import normalizar
+
+RAIO_TERRA_KM = 6371.0
+PRECISAO = 9  # caracteres do geohash gravado (célula de ~5 m)
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_UFS = {
+    "ac", "al", "ap", "am", "ba", "ce", "df", "es", "go", "ma", "mt", "ms", "mg", "pa",
+    "pb", "pr", "pe", "pi", "rj", "rn", "rs", "ro", "rr", "sc", "sp", "se", "to",
+}
+_PARTES = re.compile(r"[,;/()\n]|\s[-–]\s")
+
+
+# ======== Geohash ========
+
+def geohash(latitude, longitude, precisao=PRECISAO):
+    faixa_lat, faixa_lon = [-90.0, 90.0], [-180.0, 180.0]
+    caracteres, bits, valor, usar_lon = [], 0, 0, True
+    while len(caracteres) < precisao:
+        faixa, coordenada = (faixa_lon, longitude) if usar_lon else (faixa_lat, latitude)
+        meio = (faixa[0] + faixa[1]) / 2
+        valor <<= 1
+        if coordenada >= meio:
+            valor |= 1
+            faixa[0] = meio
+        else:
+            faixa[1] = meio
+        usar_lon = not usar_lon
+        bits += 1
+        if bits == 5:
+            caracteres.append(_BASE32[valor])
+            bits, valor = 0, 0
+    return "".join(caracteres)
+
+
+def tamanho_celula(precisao):
+    """(altura, largura) em graus de uma célula de geohash com `precisao` caracteres."""
+    bits = 5 * precisao
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def celulas_do_raio(latitude, longitude, raio_km):
+    """
+    Prefixos de geohash (célula do centro e vizinhas) que cobrem o círculo.
+    Vazio se o raio for grande demais para valer a pena filtrar.
+    """
+    # Perto dos polos um grau de longitude é quase nada; no Brasil, sobra
+    km_por_grau_lon = 111.32 * max(math.cos(math.radians(abs(latitude) + raio_km / 111.32)), 0.01)
+    for precisao in range(PRECISAO, 0, -1):
+        altura, largura = tamanho_celula(precisao)
+        if altura * 110.57 >= raio_km and largura * km_por_grau_lon >= raio_km:
+            break
+    else:
+        return []
+    return sorted({
+        geohash(latitude + dy * altura, ((longitude + dx * largura + 180) % 360) - 180, precisao)
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+        if -90 <= latitude + dy * altura <= 90
+    })
+
+
+# ======== Distância ========
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Haversine, em Python (para comparar com o cálculo do banco)."""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 2 * RAIO_TERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def expressao_distancia(origem):
+    """Haversine em SQL entre `origem` (lat, lon) e as colunas latitude/longitude."""
+    latitude, longitude = origem
+    lat = F("latitude")
+    lon = F("longitude")
+    a = (
+        Power(Sin(Radians(lat - Value(latitude)) / 2), 2)
+        + Value(math.cos(math.radians(latitude)))
+        * Cos(Radians(lat))
+        * Power(Sin(Radians(lon - Value(longitude)) / 2), 2)
+    )
+    return Value(2 * RAIO_TERRA_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+def com_distancia(queryset, origem):
+    """Anota `distancia` (km) e tira as linhas sem coordenadas."""
+    return queryset.filter(latitude__isnull=False).annotate(distancia=expressao_distancia(origem))
+
+
+def no_raio(queryset, origem, raio_km):
+    """Linhas a até `raio_km` de `origem`, com `distancia` anotada."""
+    celulas = celulas_do_raio(*origem, raio_km)
+    if celulas:
+        cobre = Q()
+        for celula in celulas:
+            cobre |= Q(geohash__startswith=celula)
+        queryset = queryset.filter(cobre)
+    return com_distancia(queryset, origem).filter(distancia__lte=raio_km)
+
+
+def raio_para(queryset, origem, quantos):
+    """
+    Menor raio (GEO_RAIO_INICIAL, x4, x16... até GEO_RAIO_MAXIMO) com pelo
+    menos `quantos` linhas de `queryset`.
+    """
+    raio = getattr(settings, "GEO_RAIO_INICIAL", 5)
+    maximo = getattr(settings, "GEO_RAIO_MAXIMO", 5000)
+    while raio < maximo:
+        if no_raio(queryset, origem, raio)[:quantos].count() >= quantos:
+            return raio
+        raio *= 4
+    return maximo
+
+
+def mais_proximos(queryset, origem, quantos):
+    """As `quantos` linhas mais perto de `origem`, da mais perto para a mais longe."""
+    raio = raio_para(queryset, origem, quantos)
+    return no_raio(queryset, origem, raio).order_by("distancia")[:quantos]
+
+
+# ======== Gazetteer ========
+
+@functools.lru_cache(maxsize=1)
+def _municipios():
+    """nome normalizado -> [(uf, latitude, longitude)], na ordem do arquivo."""
+    municipios = {}
+    with open(settings.GEO_GAZETEER, encoding="utf-8", newline="") as arquivo:
+        for linha in csv.DictReader(arquivo):
+            municipios.setdefault(normalizar(linha["nome"]), []).append(
+                (linha["uf"].strip().lower(), float(linha["latitude"]), float(linha["longitude"]))
+            )
+    return municipios
+
+
+def _escolher(opcoes, uf):
+    for opcao_uf, latitude, longitude in opcoes:
+        if uf is None or opcao_uf == uf:
+            return latitude, longitude
+    return None
+
+
+def geocodificar(texto):
+    """
+    (latitude, longitude) da cidade citada em `texto`, ou None.
+    Aceita "Cidade", "Cidade - UF", "Cidade/UF", "Bairro, Cidade"... e erros
+    de digitação leves no nome da cidade.
+    """
+    municipios = _municipios()
+    partes = [normalizar(parte) for parte in _PARTES.split(texto or "")]
+    partes = [parte for parte in partes if parte]
+    if not partes:
+        return None
+    # A UF pode vir sozinha ("Recife, PE") ou no fim ("Campinas SP")
+    uf = None
+    nomes = []
+    for parte in partes:
+        if parte in _UFS:
+            uf = parte
+            continue
+        palavras = parte.split()
+        if len(palavras) > 1 and palavras[-1] in _UFS and parte not in municipios:
+            uf = palavras[-1]
+            parte = " ".join(palavras[:-1])
+        nomes.append(parte)
+    # O texto todo primeiro, depois cada parte da mais geral (fim) para a mais específica
+    candidatos = list(dict.fromkeys([" ".join(nomes), *reversed(nomes)]))
+    for nome in candidatos:
+        if nome in municipios:
+            coordenadas = _escolher(municipios[nome], uf) or _escolher(municipios[nome], None)
+            if coordenadas:
+                return coordenadas
+    for nome in candidatos:
+        parecidos = difflib.get_close_matches(
+            nome, municipios, n=1, cutoff=getattr(settings, "GEO_SEMELHANCA_MINIMA", 0.85)
+        )
+        if parecidos:
+            opcoes = municipios[parecidos[0]]
+            return _escolher(opcoes, uf) or _escolher(opcoes, None)
+    return None
+
+
+def localizar(instancia):
+    """Preenche latitude, longitude e geohash de um Parceiro/Grupo a partir de `localizacao`."""
+    coordenadas = geocodificar(instancia.localizacao)
+    if coordenadas is None:
+        instancia.latitude = instancia.longitude = None
+        instancia.geohash = ""
+    else:
+        instancia.latitude, instancia.longitude = coordenadas
+        instancia.geohash = geohash(*coordenadas)
+
+
+def origem_do_usuario(usuario):
+    """Coordenadas do usuário (do primeiro parceiro dele com localização conhecida)."""
+    return (
+        usuario.parceiros.filter(latitude__isnull=False)
+        .order_by("pk")
+        .values_list("latitude", "longitude")
+        .first()
+    )
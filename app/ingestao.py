@@ -0,0 +1,205 @@
+"""
+Gravação em lote (write-behind) das mensagens do chat.
+
+Com CHAT_INGESTAO = "lote", cada envio entra numa fila do processo e quem
+enviou espera. Uma thread grava a fila com um bulk_create por lote, numa
+única transação, quando junta CHAT_INGESTAO_LOTE mensagens ou quando a
+mais antiga já esperou CHAT_INGESTAO_ESPERA segundos: um commit (e um
+fsync no banco) para muitas mensagens. Cada envio só é liberado depois do
+commit, então a resposta ao cliente sempre quer dizer mensagem gravada.
+Se o processo cair antes, ninguém recebeu confirmação do que se perdeu.
+
+A fila é única e FIFO e cada lote é gravado na ordem de chegada (ids e
+horas crescentes), então as mensagens de cada conversa ficam na ordem em
+que o servidor as recebeu. Resumos, aviso de novidade e WebSocket são os
+mesmos do signal de post_save (app/signals.py), chamados com o lote todo,
+já que bulk_create não dispara post_save.
+
+Com "direta" (padrão) cada envio é um save() na própria requisição, numa
+transação com os resumos do signal: ou grava tudo, ou nada.
+
+O ganho vem de envios simultâneos no mesmo processo: servidor WSGI com
+threads, ou chamadores assíncronos (aenviar). Num servidor ASGI as views
+síncronas rodam uma de cada vez e não chegam a formar lote.
+`manage.py medir_envios` compara os dois modos e simula uma queda.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturoTimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import conversas
+from .models import Mensagem, MensagemGrupo, chave_conversa
+
+logger = logging.getLogger(__name__)
+
+
+class EnvioPendente(Exception):
+    """
+    O commit não veio em CHAT_INGESTAO_TIMEOUT segundos. A mensagem continua
+    na fila e ainda pode ser gravada: não é erro nem confirmação.
+    """
+
+
+class IngestaoMensagens:
+    def __init__(self, tamanho_lote=200, espera=0.005):
+        self.tamanho_lote = tamanho_lote
+        self.espera = espera
+        self._fila = []  # [(mensagem, future, chegada)]
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def colocar(self, mensagem):
+        """Põe a mensagem (ainda não salva) na fila. Retorna um Future resolvido no commit."""
+        if isinstance(mensagem, Mensagem) and not mensagem.conversa:
+            mensagem.conversa = chave_conversa(mensagem.id_remetente_id, mensagem.id_destinatario_id)
+        futuro = Future()
+        with self._condicao:
+            self._fila.append((mensagem, futuro, time.monotonic()))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._executar, name="ingestao-mensagens", daemon=True
+                )
+                self._thread.start()
+            self._condicao.notify()
+        return futuro
+
+    def _retirar_lote(self):
+        """Espera o lote encher ou a mais antiga vencer e tira até tamanho_lote da fila."""
+        with self._condicao:
+            while not self._fila:
+                self._condicao.wait()
+            while len(self._fila) < self.tamanho_lote:
+                restante = self._fila[0][2] + self.espera - time.monotonic()
+                if restante <= 0:
+                    break
+                self._condicao.wait(restante)
+            lote = self._fila[:self.tamanho_lote]
+            del self._fila[:self.tamanho_lote]
+        return lote
+
+    def gravar(self, lote):
+        """Grava o lote numa transação e libera cada envio (com a mensagem ou o erro)."""
+        mensagens = [mensagem for mensagem, _, _ in lote]
+        try:
+            with transaction.atomic():
+                _gravar_em_lote(mensagens)
+        except Exception:
+            # Uma mensagem ruim (ex.: destinatário apagado) não derruba as outras
+            logger.exception("Falha ao gravar lote de %d mensagens; gravando uma a uma", len(lote))
+            # A conexão da thread fica aberta entre lotes; se ela caiu, reconecta
+            close_old_connections()
+            for mensagem, futuro, _ in lote:
+                try:
+                    mensagem.pk = None
+                    with transaction.atomic():
+                        mensagem.save()
+                except Exception as erro:
+                    futuro.set_exception(erro)
+                else:
+                    futuro.set_result(mensagem)
+            return
+        for mensagem, futuro, _ in lote:
+            futuro.set_result(mensagem)
+
+    def esvaziar(self):
+        """Grava tudo o que está na fila agora (usado ao encerrar o processo)."""
+        with self._condicao:
+            fila, self._fila = self._fila, []
+        for i in range(0, len(fila), self.tamanho_lote):
+            self.gravar(fila[i:i + self.tamanho_lote])
+
+    def _executar(self):
+        while True:
+            lote = self._retirar_lote()
+            try:
+                self.gravar(lote)
+            except Exception:
+                logger.exception("Falha inesperada na ingestão de mensagens")
+                for _, futuro, _ in lote:
+                    if not futuro.done():
+                        futuro.set_exception(RuntimeError("Mensagem não gravada"))
+
+
+def _gravar_em_lote(mensagens):
+    diretas = [msg for msg in mensagens if isinstance(msg, Mensagem)]
+    de_grupo = [msg for msg in mensagens if isinstance(msg, MensagemGrupo)]
+    if diretas:
+        Mensagem.objects.bulk_create(diretas)
+        conversas.registrar_envios(diretas)
+    if de_grupo:
+        MensagemGrupo.objects.bulk_create(de_grupo)
+        conversas.registrar_envios_grupo(de_grupo)
+
+
+_ingestao = None
+_ingestao_lock = threading.Lock()
+
+
+def get_ingestao():
+    global _ingestao
+    with _ingestao_lock:
+        if _ingestao is None:
+            _ingestao = IngestaoMensagens(
+                tamanho_lote=getattr(settings, "CHAT_INGESTAO_LOTE", 200),
+                espera=getattr(settings, "CHAT_INGESTAO_ESPERA", 0.005),
+            )
+            atexit.register(_esvaziar_ao_sair)
+    return _ingestao
+
+
+def _esvaziar_ao_sair():
+    try:
+        _ingestao.esvaziar()
+    except Exception:
+        pass
+
+
+def _em_lote():
+    return getattr(settings, "CHAT_INGESTAO", "direta") == "lote"
+
+
+def _gravar_direto(mensagem):
+    # O post_save (resumos) entra na mesma transação: se ele falhar, a
+    # mensagem também não fica gravada e o reenvio do cliente não duplica
+    with transaction.atomic():
+        mensagem.save()
+    return mensagem
+
+
+def enviar(mensagem):
+    """
+    Grava `mensagem` (Mensagem ou MensagemGrupo ainda não salva) conforme
+    CHAT_INGESTAO e só retorna depois do commit. Erros da gravação sobem
+    para quem chamou; sem resposta do lote a tempo, EnvioPendente.
+    """
+    if not _em_lote():
+        return _gravar_direto(mensagem)
+    try:
+        return get_ingestao().colocar(mensagem).result(
+            timeout=getattr(settings, "CHAT_INGESTAO_TIMEOUT", 10)
+        )
+    except FuturoTimeoutError:
+        raise EnvioPendente() from None
+
+
+async def aenviar(mensagem):
+    """Como enviar(), para código assíncrono: espera o commit sem ocupar uma thread."""
+    if not _em_lote():
+        return await sync_to_async(_gravar_direto)(mensagem)
+    futuro = get_ingestao().colocar(mensagem)
+    try:
+        # shield: desistir de esperar não cancela a gravação
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(futuro)),
+            timeout=getattr(settings, "CHAT_INGESTAO_TIMEOUT", 10),
+        )
+    except asyncio.TimeoutError:
+        raise EnvioPendente() from None
@@ -0,0 +1,103 @@
+"""
+Limite de requisições por usuário (token bucket guardado no cache).
+
+Cada usuário tem, por escopo (um por view: "conversa", "meta"...), um
+balde com até `rajada` fichas que se recarrega à taxa configurada
+("30/m" = 30 por minuto). Cada requisição limitada gasta uma ficha; sem ficha, a view nem
+roda e a resposta é 429 com Retry-After. Assim um script não consegue
+encher a tabela de mensagens nem disparar recálculos de ranking sem parar.
+
+Os limites ficam em LIMITES_REQUISICOES (escopo -> (taxa, rajada)) e
+podem ser trocados sem mexer nas views. O estado mora no cache padrão:
+com cache local cada processo conta separado; com um cache compartilhado
+(Redis/Memcached) o limite vale para todos os processos, mas só de forma
+aproximada (ver consumir()).
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+_PERIODOS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_trava = threading.Lock()
+
+
+def interpretar_taxa(taxa):
+    """"30/m" -> 0.5 (fichas por segundo)."""
+    quantidade, _, periodo = taxa.partition("/")
+    return int(quantidade) / _PERIODOS[periodo.strip().lower()[:1]]
+
+
+def consumir(escopo, identidade, taxa, rajada):
+    """
+    Tenta gastar uma ficha do balde de `identidade` em `escopo`.
+    Retorna 0 se pôde, ou quantos segundos faltam para a próxima ficha.
+
+    O balde é lido (get) e regravado (set) sob _trava, que só serializa
+    as threads deste processo. Entre processos com cache compartilhado não
+    há atomicidade: requisições simultâneas em processos diferentes podem
+    ler o mesmo balde e gastar a mesma ficha, então no pior caso passam
+    até uma requisição a mais por processo a cada corrida. Para um limite
+    anti-abuso isso basta; não use para cotas exatas.
+    """
+    por_segundo = interpretar_taxa(taxa)
+    chave = f"limite:{escopo}:{identidade}"
+    # Tempo de relógio (não monotônico): o balde pode ser lido por outro processo
+    agora = time.time()
+    with _trava:
+        fichas, instante = cache.get(chave) or (rajada, agora)
+        fichas = min(rajada, fichas + max(agora - instante, 0) * por_segundo)
+        if fichas >= 1:
+            fichas -= 1
+            espera = 0
+        else:
+            espera = (1 - fichas) / por_segundo
+        # Depois de encher o balde de novo, a chave já não faz diferença
+        cache.set(chave, (fichas, agora), timeout=math.ceil(rajada / por_segundo) + 1)
+    return espera
+
+
+def _identidade(request):
+    if request.user.is_authenticated:
+        return f"u{request.user.pk}"
+    return f"ip{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _resposta_429(request, espera):
+    segundos = max(1, math.ceil(espera))
+    mensagem = f"Muitas requisições. Tente de novo em {segundos}s."
+    quer_json = (
+        request.headers.get("x-requested-with") == "XMLHttpRequest"
+        or "application/json" in request.headers.get("accept", "")
+    )
+    if quer_json:
+        resposta = JsonResponse({"erro": mensagem, "tente_em": segundos}, status=429)
+    else:
+        resposta = HttpResponse(mensagem, status=429, content_type="text/plain; charset=utf-8")
+    resposta["Retry-After"] = str(segundos)
+    return resposta
+
+
+def limitar(escopo, taxa="30/m", rajada=10, metodos=("POST",)):
+    """
+    Decorator de view: limita as requisições `metodos` de cada usuário em
+    `escopo`. LIMITES_REQUISICOES[escopo] = (taxa, rajada), se existir,
+    vale no lugar dos padrões do decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def _view(request, *args, **kwargs):
+            if request.method in metodos:
+                taxa_atual, rajada_atual = getattr(settings, "LIMITES_REQUISICOES", {}).get(
+                    escopo, (taxa, rajada)
+                )
+                espera = consumir(escopo, _identidade(request), taxa_atual, rajada_atual)
+                if espera:
+                    return _resposta_429(request, espera)
+            return view(request, *args, **kwargs)
+        return _view
+    return decorator
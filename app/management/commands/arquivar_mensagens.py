@@ -0,0 +1,83 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import particoes
+
+
+def _mes(texto):
+    try:
+        return datetime.datetime.strptime(texto, "%Y-%m").date()
+    except ValueError:
+        raise CommandError(f"Mês inválido: {texto!r} (use AAAA-MM)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mantém as partições mensais das mensagens: cria as dos próximos meses e "
+        "move para arquivos .csv.gz os meses mais antigos que MENSAGENS_MESES_QUENTES. "
+        "Com --restaurar, traz um mês arquivado de volta para o banco. "
+        "Pensado para rodar todo dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--meses", type=int, default=None,
+            help="Meses mantidos no banco (padrão: MENSAGENS_MESES_QUENTES).",
+        )
+        parser.add_argument(
+            "--diretorio", default=None,
+            help="Onde gravar os arquivos (padrão: MENSAGENS_ARQUIVO_DIR).",
+        )
+        parser.add_argument(
+            "--restaurar", metavar="AAAA-MM", default=None,
+            help="Restaura o mês arquivado em vez de arquivar.",
+        )
+        parser.add_argument(
+            "--tabela", choices=sorted(particoes.TABELAS), default=None,
+            help="Só esta tabela (padrão: mensagens e mensagens_grupo).",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Só mostra o que seria arquivado.",
+        )
+
+    def handle(self, *args, **options):
+        tabelas = [options["tabela"]] if options["tabela"] else list(particoes.TABELAS)
+        for tabela in tabelas:
+            if not particoes.particionada(tabela):
+                raise CommandError(f"A tabela {tabela} não é particionada (rode as migrações).")
+
+        if options["restaurar"]:
+            mes = _mes(options["restaurar"])
+            for tabela in tabelas:
+                try:
+                    restauradas = particoes.restaurar(tabela, mes)
+                except particoes.ArquivoMensagens.DoesNotExist:
+                    self.stdout.write(f"{tabela} {mes:%Y-%m}: não está arquivado")
+                    continue
+                self.stdout.write(f"{tabela} {mes:%Y-%m}: {restauradas} mensagens restauradas")
+            return
+
+        inicio = time.monotonic()
+        if not options["dry_run"]:
+            for nome in particoes.garantir_particoes():
+                self.stdout.write(f"Partição criada: {nome}")
+
+        arquivadas = 0
+        meses = 0
+        for tabela in tabelas:
+            for mes in particoes.meses_para_arquivar(tabela, options["meses"]):
+                if options["dry_run"]:
+                    self.stdout.write(f"{tabela} {mes:%Y-%m}: seria arquivado")
+                    continue
+                linhas = particoes.arquivar(tabela, mes, options["diretorio"])
+                self.stdout.write(f"{tabela} {mes:%Y-%m}: {linhas} mensagens arquivadas")
+                arquivadas += linhas
+                meses += 1
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{meses} meses ({arquivadas} mensagens) arquivados em {duracao:.2f}s"
+        ))
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app import compatibilidade, processos, recomendacoes
+from app.models import Usuario
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula as recomendações de parceiros desatualizadas (marcadas por "
+        "mudanças de preferência/parceiro, nunca calculadas ou com mais de "
+        "RECOMENDACOES_VALIDADE_HORAS), em lotes distribuídos num pool de "
+        "processos. Pensado para rodar periodicamente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=500,
+            help="Faixa de ids de usuário por tarefa (padrão: 500).",
+        )
+        parser.add_argument(
+            "--processos", type=int, default=os.cpu_count() or 1,
+            help="Processos do pool (padrão: número de CPUs).",
+        )
+        parser.add_argument(
+            "--todos", action="store_true",
+            help="Recalcula todos os usuários, não só os desatualizados.",
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        quantos = max(options["processos"], 1)
+        lote = max(options["lote"], 1)
+        maior = Usuario.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        # Montada antes do pool: com fork os processos herdam a matriz pronta
+        # (com spawn/forkserver cada um monta a sua)
+        compatibilidade.matriz()
+        # Cada processo abre a própria conexão e acha os desatualizados da
+        # sua faixa de pks; daqui em diante o pai não usa o banco
+        connections.close_all()
+
+        total = 0
+        pendentes = set()
+        with ProcessPoolExecutor(max_workers=quantos, initializer=processos.iniciar_processo) as pool:
+            # As faixas entram aos poucos: no máximo duas por processo na fila
+            for faixa in range(0, maior, lote):
+                if len(pendentes) >= 2 * quantos:
+                    prontas, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                    total += sum(futuro.result() for futuro in prontas)
+                pendentes.add(pool.submit(
+                    recomendacoes.atualizar_faixa, faixa, faixa + lote, options["todos"]
+                ))
+            total += sum(futuro.result() for futuro in pendentes)
+
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomendações de {total} usuários atualizadas em {duracao:.2f}s "
+            f"({quantos} processos)"
+        ))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import geo
+from app.models import Grupo, Parceiro
+
+
+class Command(BaseCommand):
+    help = (
+        "Preenche latitude, longitude e geohash de parceiros e grupos a partir "
+        "da localização em texto, pelo gazetteer offline (GEO_GAZETEER). Rodar "
+        "uma vez depois da migração, ou com --todos depois de trocar o gazetteer; "
+        "gravar um parceiro ou grupo já mantém as coordenadas em dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=1000,
+            help="Quantidade de linhas por lote (padrão: 1000).",
+        )
+        parser.add_argument(
+            "--todos", action="store_true",
+            help="Refaz também as linhas que já têm coordenadas.",
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        for modelo in (Parceiro, Grupo):
+            linhas = modelo.objects.exclude(localizacao="")
+            if not options["todos"]:
+                linhas = linhas.filter(geohash="")
+            total = localizadas = 0
+            ultimo = 0
+            while True:
+                lote = list(
+                    linhas.filter(pk__gt=ultimo)
+                    .order_by("pk")
+                    .only("pk", "localizacao", "latitude", "longitude", "geohash")[:options["lote"]]
+                )
+                if not lote:
+                    break
+                for instancia in lote:
+                    geo.localizar(instancia)
+                modelo.objects.bulk_update(lote, ["latitude", "longitude", "geohash"])
+                total += len(lote)
+                localizadas += sum(1 for instancia in lote if instancia.geohash)
+                ultimo = lote[-1].pk
+            self.stdout.write(
+                f"{modelo._meta.verbose_name_plural}: {localizadas} de {total} localizados"
+            )
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(f"Coordenadas atualizadas em {duracao:.2f}s"))
@@ -0,0 +1,210 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from app.ingestao import IngestaoMensagens
+from app.models import Mensagem, Usuario
+
+PREFIXO = "medir_envios_"
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede envios de mensagens por segundo numa rajada de threads, gravando "
+        "um a um (CHAT_INGESTAO = \"direta\") e em lote (\"lote\"). Com "
+        "--simular-queda, mata um processo no meio da rajada em lote e confere "
+        "que toda mensagem confirmada ficou gravada. Cria e apaga os próprios usuários."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--envios", type=int, default=2000,
+            help="Mensagens por modo (padrão: 2000).",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=32,
+            help="Envios simultâneos (padrão: 32).",
+        )
+        parser.add_argument(
+            "--conversas", type=int, default=4,
+            help="Conversas que recebem a rajada (padrão: 4).",
+        )
+        parser.add_argument(
+            "--lote", type=int, default=None,
+            help="Mensagens por lote (padrão: CHAT_INGESTAO_LOTE).",
+        )
+        parser.add_argument(
+            "--simular-queda", action="store_true",
+            help="Derruba um processo no meio da rajada e confere o que foi confirmado.",
+        )
+        # Uso interno: o processo que é derrubado
+        parser.add_argument("--filho-queda", default=None, help=argparse.SUPPRESS)
+        parser.add_argument("--cair-apos", type=int, default=None, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        self.tamanho_lote = options["lote"] or getattr(settings, "CHAT_INGESTAO_LOTE", 200)
+        if options["filho_queda"]:
+            usuarios = [int(uid) for uid in options["filho_queda"].split(",")]
+            self._filho_queda(usuarios, options)
+            return
+
+        if options["conversas"] < 1 or options["threads"] < 1:
+            raise CommandError("--conversas e --threads precisam ser pelo menos 1.")
+        usuarios = [
+            Usuario.objects.create_user(nome=f"{PREFIXO}{os.getpid()}_{i}")
+            for i in range(options["conversas"] + 1)
+        ]
+        try:
+            if options["simular_queda"]:
+                self._simular_queda(usuarios, options)
+            else:
+                self._comparar(usuarios, options)
+        finally:
+            Usuario.objects.filter(pk__in=[u.pk for u in usuarios]).delete()
+
+    # ======== Rajada ========
+
+    def _rajada(self, usuarios, total, threads, gravar, ao_confirmar=None):
+        """Dispara `total` envios em `threads` threads; retorna os segundos gastos."""
+        remetente, destinatarios = usuarios[0], usuarios[1:]
+        por_thread = [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+        inicio_rajada = threading.Barrier(threads + 1)
+
+        def trabalhar(t):
+            inicio_rajada.wait()
+            try:
+                for i in range(por_thread[t]):
+                    destinatario = destinatarios[(t + i) % len(destinatarios)]
+                    mensagem = gravar(Mensagem(
+                        id_remetente=remetente,
+                        id_destinatario=destinatario,
+                        mensagem=f"t{t} n{i}",
+                    ))
+                    if ao_confirmar:
+                        ao_confirmar(mensagem)
+            finally:
+                connection.close()
+
+        trabalhadores = [threading.Thread(target=trabalhar, args=(t,)) for t in range(threads)]
+        for trabalhador in trabalhadores:
+            trabalhador.start()
+        inicio_rajada.wait()
+        inicio = time.monotonic()
+        for trabalhador in trabalhadores:
+            trabalhador.join()
+        return time.monotonic() - inicio
+
+    def _conferir_ordem(self, usuarios):
+        """Em cada conversa, a ordem por (hora, id) tem que ser a mesma dos ids."""
+        fora_de_ordem = 0
+        for destinatario in usuarios[1:]:
+            ids = list(
+                Mensagem.objects
+                .filter(id_remetente=usuarios[0], id_destinatario=destinatario)
+                .order_by("hora", "id_mensagem")
+                .values_list("id_mensagem", flat=True)
+            )
+            fora_de_ordem += sum(1 for a, b in zip(ids, ids[1:]) if b < a)
+        return fora_de_ordem
+
+    def _comparar(self, usuarios, options):
+        total, threads = options["envios"], options["threads"]
+
+        def um_a_um(mensagem):
+            mensagem.save()
+            return mensagem
+
+        duracao_direta = self._rajada(usuarios, total, threads, um_a_um)
+        Mensagem.objects.filter(id_remetente=usuarios[0]).delete()
+
+        ingestao = IngestaoMensagens(
+            tamanho_lote=self.tamanho_lote,
+            espera=getattr(settings, "CHAT_INGESTAO_ESPERA", 0.005),
+        )
+        duracao_lote = self._rajada(
+            usuarios, total, threads, lambda mensagem: ingestao.colocar(mensagem).result()
+        )
+        gravadas = Mensagem.objects.filter(id_remetente=usuarios[0]).count()
+        fora_de_ordem = self._conferir_ordem(usuarios)
+
+        por_segundo_direta = total / duracao_direta
+        por_segundo_lote = total / duracao_lote
+        self.stdout.write(f"direta: {total} envios em {duracao_direta:.2f}s ({por_segundo_direta:.0f}/s)")
+        self.stdout.write(
+            f"lote ({self.tamanho_lote}): {total} envios em {duracao_lote:.2f}s ({por_segundo_lote:.0f}/s)"
+        )
+        if gravadas != total or fora_de_ordem:
+            raise CommandError(
+                f"Em lote: {gravadas} de {total} gravadas, {fora_de_ordem} fora de ordem."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{por_segundo_lote / por_segundo_direta:.1f}x mais envios por segundo em lote"
+        ))
+
+    # ======== Queda ========
+
+    def _simular_queda(self, usuarios, options):
+        total = options["envios"]
+        cair_apos = total // 2
+        comando = [
+            sys.executable, "manage.py", "medir_envios",
+            "--filho-queda", ",".join(str(u.pk) for u in usuarios),
+            "--cair-apos", str(cair_apos),
+            "--envios", str(total),
+            "--threads", str(options["threads"]),
+            "--lote", str(self.tamanho_lote),
+        ]
+        processo = subprocess.run(
+            comando, cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300
+        )
+        confirmadas = {
+            int(linha.split()[1]) for linha in processo.stdout.splitlines() if linha.startswith("ok ")
+        }
+        if processo.returncode != 9:
+            raise CommandError(f"O processo não caiu como esperado:\n{processo.stderr}")
+
+        gravadas = set(
+            Mensagem.objects.filter(id_remetente=usuarios[0]).values_list("id_mensagem", flat=True)
+        )
+        perdidas = confirmadas - gravadas
+        self.stdout.write(
+            f"Processo derrubado após {len(confirmadas)} confirmações: "
+            f"{len(gravadas)} mensagens gravadas, {len(gravadas - confirmadas)} gravadas "
+            f"sem confirmação (o cliente reenviaria), {len(perdidas)} confirmadas e perdidas"
+        )
+        fora_de_ordem = self._conferir_ordem(usuarios)
+        if perdidas or fora_de_ordem:
+            raise CommandError(
+                f"{len(perdidas)} mensagens confirmadas não estão no banco; "
+                f"{fora_de_ordem} fora de ordem."
+            )
+        self.stdout.write(self.style.SUCCESS("Nenhuma mensagem confirmada se perdeu"))
+
+    def _filho_queda(self, usuario_ids, options):
+        usuarios = list(Usuario.objects.filter(pk__in=usuario_ids).order_by("pk"))
+        ingestao = IngestaoMensagens(tamanho_lote=self.tamanho_lote)
+        confirmadas = 0
+        trava = threading.Lock()
+
+        def ao_confirmar(mensagem):
+            nonlocal confirmadas
+            with trava:
+                sys.stdout.write(f"ok {mensagem.pk}\n")
+                sys.stdout.flush()
+                confirmadas += 1
+                if confirmadas >= options["cair_apos"]:
+                    # Sem atexit nem flush da fila: o que estava no meio do caminho se perde
+                    os._exit(9)
+
+        self._rajada(
+            usuarios, options["envios"], options["threads"],
+            lambda mensagem: ingestao.colocar(mensagem).result(),
+            ao_confirmar,
+        )
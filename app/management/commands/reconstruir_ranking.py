@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import ranking
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstrói os placares (Ranking global, por esporte e RankingComunidade) "
+        "a partir das regras de pontuação, em lotes de usuários e com upsert em lote. "
+        "Pensado para rodar todo dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=1000,
+            help="Quantidade de usuários por lote (padrão: 1000).",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Só mostra as diferenças, sem gravar nada.",
+        )
+        parser.add_argument(
+            "--mostrar", type=int, default=20,
+            help="Máximo de diferenças listadas no --dry-run (padrão: 20).",
+        )
+
+    def handle(self, *args, **options):
+        tamanho_lote = options["lote"]
+        dry_run = options["dry_run"]
+        limite = options["mostrar"]
+
+        inicio = time.monotonic()
+        processados = 0
+        alterados = 0
+
+        for ids in ranking.lotes_de_usuarios(tamanho_lote):
+            mudancas = ranking.diferencas(ids)
+            processados += len(ids)
+            alterados += len(mudancas)
+
+            if dry_run:
+                for (tipo, chave, usuario_id), (antes, depois) in sorted(
+                    mudancas.items(), key=lambda item: (item[0][2], item[0][0], str(item[0][1]))
+                ):
+                    if limite <= 0:
+                        break
+                    quadro = f"{tipo} {chave}" if chave != "" else tipo
+                    antes_txt = "-" if antes is None else antes
+                    depois_txt = "-" if depois is None else depois
+                    self.stdout.write(
+                        f"[{quadro}] usuario {usuario_id}: {antes_txt} -> {depois_txt}"
+                    )
+                    limite -= 1
+            else:
+                ranking.gravar(mudancas)
+
+        if not dry_run:
+            # Como recalcular_ranking_completo: tira os períodos fora da retenção
+            apagados = ranking.compactar_periodos()
+            self.stdout.write(f"{apagados} contadores de períodos antigos apagados")
+
+        duracao = time.monotonic() - inicio
+        usuarios_s = processados / duracao if duracao > 0 else processados
+        linhas_s = alterados / duracao if duracao > 0 else alterados
+        acao = "a alterar" if dry_run else "alteradas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{processados} usuários processados, {alterados} linhas de placar {acao} "
+            f"em {duracao:.2f}s ({usuarios_s:.0f} usuários/s, {linhas_s:.0f} linhas/s)"
+        ))
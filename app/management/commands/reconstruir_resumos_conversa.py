@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import conversas
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstrói os resumos de conversa (última mensagem e hora de cada "
+        "conversa direta) a partir da tabela de mensagens, com upsert em lote. "
+        "Rodar uma vez depois de criar a tabela; depois disso os envios mantêm tudo em dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=1000,
+            help="Quantidade de conversas por lote (padrão: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        total = conversas.reconstruir_resumos(options["lote"])
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} resumos de conversa gravados em {duracao:.2f}s"
+        ))
@@ -0,0 +1,39 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import ranking
+
+
+class Command(BaseCommand):
+    help = (
+        "Grava a foto do dia do placar global no histórico de cada usuário "
+        "(posição e pontos) e apaga o que saiu de RANKING_HISTORICO_DIAS. "
+        "Pensado para rodar uma vez por dia, depois do reconstruir_ranking."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dia",
+            help="Dia da foto no formato AAAA-MM-DD (padrão: hoje).",
+        )
+        parser.add_argument(
+            "--lote", type=int, default=1000,
+            help="Quantidade de usuários por lote (padrão: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        dia = None
+        if options["dia"]:
+            try:
+                dia = datetime.date.fromisoformat(options["dia"])
+            except ValueError:
+                raise CommandError(f"Dia inválido: {options['dia']!r} (use AAAA-MM-DD)")
+
+        inicio = time.monotonic()
+        total = ranking.registrar_historico(dia, tamanho_lote=options["lote"])
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Histórico de {total} usuários registrado em {duracao:.2f}s"
+        ))
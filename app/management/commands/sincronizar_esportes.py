@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import esportes
+from app.models import Usuario
+
+
+class Command(BaseCommand):
+    help = (
+        "Refaz os esportes de cada usuário (EsporteUsuario) a partir do texto "
+        "das preferências, usando o catálogo atual de esportes e sinônimos. "
+        "Rodar depois de mudar sinônimos no admin; gravar uma preferência já "
+        "mantém o usuário em dia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote", type=int, default=1000,
+            help="Quantidade de usuários por lote (padrão: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        catalogo = esportes.Catalogo()
+        total = 0
+        ultimo = 0
+        while True:
+            ids = list(
+                Usuario.objects.filter(pk__gt=ultimo)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:options["lote"]]
+            )
+            if not ids:
+                break
+            esportes.sincronizar(ids, catalogo)
+            total += len(ids)
+            ultimo = ids[-1]
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Esportes de {total} usuários sincronizados em {duracao:.2f}s"
+        ))
@@ -10,9 +10,21 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
-        migrations.AlterField(
-            model_name='preferencia',
-            name='idade_parc',
-            field=models.DateField(blank=True, null=True),
+        # O Postgres não converte integer em date sozinho: sem o USING esta
+        # migração falhava num banco novo (a 0003 volta para integer do mesmo jeito)
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='ALTER TABLE preferencias ALTER COLUMN "idade_parc" TYPE date USING (NULL::date);',
+                    reverse_sql='ALTER TABLE preferencias ALTER COLUMN "idade_parc" TYPE integer USING (NULL::integer);',
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='preferencia',
+                    name='idade_parc',
+                    field=models.DateField(blank=True, null=True),
+                ),
+            ],
         ),
     ]
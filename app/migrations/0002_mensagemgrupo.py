@@ -12,18 +12,24 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
-        migrations.CreateModel(
-            name='MensagemGrupo',
-            fields=[
-                ('id_mensagem', models.AutoField(primary_key=True, serialize=False)),
-                ('mensagem', models.TextField()),
-                ('hora', models.DateTimeField(auto_now_add=True)),
-                ('id_grupo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens', to='app.grupo')),
-                ('id_remetente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens_grupo_enviadas', to=settings.AUTH_USER_MODEL)),
+        # A 0001_initial (regerada depois) já cria a tabela mensagens_grupo.
+        # Aqui só o estado: senão um banco novo não passa desta migração
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='MensagemGrupo',
+                    fields=[
+                        ('id_mensagem', models.AutoField(primary_key=True, serialize=False)),
+                        ('mensagem', models.TextField()),
+                        ('hora', models.DateTimeField(auto_now_add=True)),
+                        ('id_grupo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens', to='app.grupo')),
+                        ('id_remetente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mensagens_grupo_enviadas', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'mensagens_grupo',
+                        'ordering': ['hora'],
+                    },
+                ),
             ],
-            options={
-                'db_table': 'mensagens_grupo',
-                'ordering': ['hora'],
-            },
         ),
     ]
@@ -10,14 +10,20 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
-        migrations.AddField(
-            model_name='usuario',
-            name='foto_perfil',
-            field=models.ImageField(blank=True, default='profile_pics/default-avatar.png', null=True, upload_to='profile_pics/'),
-        ),
-        migrations.AlterField(
-            model_name='usuario',
-            name='email',
-            field=models.EmailField(blank=True, max_length=254, null=True, unique=True),
+        # A 0001_initial (regerada depois) já cria foto_perfil e o email único.
+        # Aqui só o estado: senão um banco novo não passa desta migração
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='usuario',
+                    name='foto_perfil',
+                    field=models.ImageField(blank=True, default='profile_pics/default-avatar.png', null=True, upload_to='profile_pics/'),
+                ),
+                migrations.AlterField(
+                    model_name='usuario',
+                    name='email',
+                    field=models.EmailField(blank=True, max_length=254, null=True, unique=True),
+                ),
+            ],
         ),
     ]
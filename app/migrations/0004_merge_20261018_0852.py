@@ -0,0 +1,16 @@
+# Generated by Django 5.2 on 2026-10-18 11:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_alter_preferencia_idade_parc_alter_preferencia_nivel_and_more'),
+        ('app', '0002_mensagemgrupo'),
+        ('app', '0002_usuario_foto_perfil_alter_usuario_email'),
+        ('app', '0003_alter_preferencia_idade_parc'),
+    ]
+
+    operations = [
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_merge_20261018_0852'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ranking',
+            constraint=models.UniqueConstraint(fields=('usuario', 'esporte_prat'), name='ranking_usuario_esporte_unico'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_ranking_usuario_esporte_unico'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ranking',
+            index=models.Index(fields=['esporte_prat', '-pontuacao_total', 'usuario'], name='ranking_placar_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_ranking_placar_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comunidade',
+            name='esporte',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+    ]
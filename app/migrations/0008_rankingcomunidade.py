@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 11:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_comunidade_esporte'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingComunidade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pontuacao_total', models.IntegerField(default=0)),
+                ('comunidade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranking', to='app.comunidade')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings_comunidade', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'ranking_comunidade',
+                'indexes': [models.Index(fields=['comunidade', '-pontuacao_total', 'usuario'], name='ranking_comunidade_placar_idx')],
+                'constraints': [models.UniqueConstraint(fields=('comunidade', 'usuario'), name='ranking_comunidade_usuario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Transforma o M2M automático MetaComunidade.usuarios_cumpriram em um
+    through explícito (MetaCumprida) sem recriar a tabela, e acrescenta a
+    hora do cumprimento. Linhas antigas ficam com cumprida_em = NULL.
+    """
+
+    dependencies = [
+        ('app', '0008_rankingcomunidade'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # A tabela app_metacomunidade_usuarios_cumpriram já existe
+            database_operations=[],
+            state_operations=[
+                migrations.CreateModel(
+                    name='MetaCumprida',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('metacomunidade', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.metacomunidade')),
+                        ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'app_metacomunidade_usuarios_cumpriram',
+                        'unique_together': {('metacomunidade', 'usuario')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='metacomunidade',
+                    name='usuarios_cumpriram',
+                    field=models.ManyToManyField(blank=True, through='app.MetaCumprida', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='metacumprida',
+            name='cumprida_em',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='metacumprida',
+            name='cumprida_em',
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='metacumprida',
+            index=models.Index(fields=['usuario', 'cumprida_em'], name='meta_cumprida_usuario_data_idx'),
+        ),
+    ]
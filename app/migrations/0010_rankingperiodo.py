@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_metacumprida'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingPeriodo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('semana', 'Semanal'), ('mes', 'Mensal')], max_length=10)),
+                ('inicio', models.DateField()),
+                ('pontuacao_total', models.IntegerField(default=0)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings_periodo', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'ranking_periodo',
+                'indexes': [models.Index(fields=['periodo', 'inicio', '-pontuacao_total', 'usuario'], name='ranking_periodo_placar_idx')],
+                'constraints': [models.UniqueConstraint(fields=('periodo', 'inicio', 'usuario'), name='ranking_periodo_usuario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_rankingperiodo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricoRanking',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='historico_ranking', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('inicio', models.DateField()),
+                ('posicoes', models.JSONField(default=list)),
+                ('pontos', models.JSONField(default=list)),
+            ],
+            options={
+                'db_table': 'ranking_historico',
+            },
+        ),
+    ]
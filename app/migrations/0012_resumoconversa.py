@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 12:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_historicoranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoConversa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultima_mensagem', models.CharField(blank=True, max_length=200)),
+                ('ultima_hora', models.DateTimeField()),
+                ('nao_lidas', models.PositiveIntegerField(default=0)),
+                ('contato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_conversa', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'resumos_conversa',
+                'indexes': [models.Index(fields=['usuario', '-ultima_hora'], name='resumo_conversa_recentes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'contato'), name='resumo_conversa_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_resumoconversa'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensagem',
+            index=models.Index(fields=['id_remetente', 'id_destinatario', '-hora', '-id_mensagem'], name='mensagem_conversa_hora_idx'),
+        ),
+    ]
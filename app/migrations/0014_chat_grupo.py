@@ -0,0 +1,103 @@
+# Generated by Django 5.2 on 2026-10-18 12:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Substr
+
+TAMANHO_LOTE = 5000
+TAMANHO_PREVIA = 200  # max_length de Grupo.ultima_mensagem
+
+
+def preencher_resumos_e_leituras(apps, schema_editor):
+    """
+    Resumo dos grupos que já têm mensagens (total, prévia e hora da última)
+    e um LeituraGrupo por membro, com o histórico contado como lido, como
+    conversas.iniciar_leituras() faz para quem entra depois. Sem o
+    marcador, quem manda no grupo veria as próprias mensagens como não
+    lidas (o envio só soma em marcadores que já existem).
+    """
+    Grupo = apps.get_model("app", "Grupo")
+    MensagemGrupo = apps.get_model("app", "MensagemGrupo")
+    LeituraGrupo = apps.get_model("app", "LeituraGrupo")
+    Membro = Grupo._meta.get_field("membros").remote_field.through
+    db = schema_editor.connection.alias
+
+    total = MensagemGrupo.objects.using(db).filter(id_grupo=OuterRef("pk")).order_by().values(
+        "id_grupo"
+    ).annotate(total=Count("pk")).values("total")
+    ultima = MensagemGrupo.objects.using(db).filter(id_grupo=OuterRef("pk")).order_by(
+        "-hora", "-id_mensagem"
+    )
+    Grupo.objects.using(db).filter(pk__in=MensagemGrupo.objects.using(db).values("id_grupo")).update(
+        total_mensagens=Subquery(total),
+        ultima_mensagem=Subquery(ultima.values(previa=Substr("mensagem", 1, TAMANHO_PREVIA))[:1]),
+        ultima_hora=Subquery(ultima.values("hora")[:1]),
+    )
+
+    totais = dict(Grupo.objects.using(db).values_list("pk", "total_mensagens"))
+    membros = Membro.objects.using(db).order_by("pk").values_list("grupo_id", "usuario_id")
+    lote = []
+    for grupo_id, usuario_id in membros.iterator(chunk_size=TAMANHO_LOTE):
+        lote.append(LeituraGrupo(
+            grupo_id=grupo_id, usuario_id=usuario_id, mensagens_lidas=totais[grupo_id]
+        ))
+        if len(lote) == TAMANHO_LOTE:
+            LeituraGrupo.objects.using(db).bulk_create(lote, ignore_conflicts=True)
+            lote = []
+    LeituraGrupo.objects.using(db).bulk_create(lote, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_mensagem_conversa_hora_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeituraGrupo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mensagens_lidas', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'leituras_grupo',
+            },
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='total_mensagens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='ultima_hora',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='grupo',
+            name='ultima_mensagem',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='mensagemgrupo',
+            index=models.Index(fields=['id_grupo', '-hora', '-id_mensagem'], name='mensagem_grupo_hora_idx'),
+        ),
+        migrations.AddField(
+            model_name='leituragrupo',
+            name='grupo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leituras', to='app.grupo'),
+        ),
+        migrations.AddField(
+            model_name='leituragrupo',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leituras_grupo', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='leituragrupo',
+            constraint=models.UniqueConstraint(fields=('grupo', 'usuario'), name='leitura_grupo_unica'),
+        ),
+        migrations.RunPython(preencher_resumos_e_leituras, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_chat_grupo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grupo',
+            name='id_ultima_mensagem',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='leituragrupo',
+            name='lida_ate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resumoconversa',
+            name='id_ultima_mensagem',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resumoconversa',
+            name='lida_ate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,71 @@
+from django.db import migrations, models, transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+TAMANHO_LOTE = 5000
+
+
+def preencher_conversa(apps, schema_editor):
+    """
+    Preenche Mensagem.conversa ("u{menor}-{maior}") em lotes por faixa de
+    id, um UPDATE e um commit por lote, para não segurar a tabela inteira
+    numa transação só.
+    """
+    Mensagem = apps.get_model("app", "Mensagem")
+    db = schema_editor.connection.alias
+    chave = Concat(
+        Value("u"),
+        Cast(Least("id_remetente", "id_destinatario"), CharField()),
+        Value("-"),
+        Cast(Greatest("id_remetente", "id_destinatario"), CharField()),
+    )
+    ultimo = Mensagem.objects.using(db).order_by("-id_mensagem").values_list(
+        "id_mensagem", flat=True
+    ).first() or 0
+    for inicio in range(0, ultimo + 1, TAMANHO_LOTE):
+        with transaction.atomic(using=db):
+            Mensagem.objects.using(db).filter(
+                id_mensagem__gte=inicio,
+                id_mensagem__lt=inicio + TAMANHO_LOTE,
+                conversa__isnull=True,
+            ).update(conversa=chave)
+
+
+class Migration(migrations.Migration):
+    """
+    Chave canônica da conversa em Mensagem, para ler o histórico dos dois
+    sentidos numa única faixa do índice (conversa, -hora, -id_mensagem) em
+    vez de um OR entre remetente e destinatário.
+
+    Não atômica: a coluna entra anulável, é preenchida em lotes (cada um
+    com seu commit) e só depois vira NOT NULL e ganha o índice. O índice
+    antigo por (remetente, destinatario) deixa de ser usado e sai.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0015_marcadores_leitura'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagem',
+            name='conversa',
+            field=models.CharField(editable=False, max_length=24, null=True),
+        ),
+        migrations.RunPython(preencher_conversa, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mensagem',
+            name='conversa',
+            field=models.CharField(editable=False, max_length=24),
+        ),
+        migrations.RemoveIndex(
+            model_name='mensagem',
+            name='mensagem_conversa_hora_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mensagem',
+            index=models.Index(fields=['conversa', '-hora', '-id_mensagem'], name='mensagem_chave_hora_idx'),
+        ),
+    ]
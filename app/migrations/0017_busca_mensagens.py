@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 12:23
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Coluna tsvector gerada (to_tsvector('portuguese', mensagem)) e índice
+    GIN nas duas tabelas de mensagens. O PostgreSQL mantém a coluna a cada
+    INSERT/UPDATE; ao criá-la ele reescreve a tabela uma vez, então rode
+    fora do horário de pico em bases grandes.
+    """
+
+    dependencies = [
+        ('app', '0016_mensagem_conversa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagem',
+            name='busca',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('mensagem', config='portuguese'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddField(
+            model_name='mensagemgrupo',
+            name='busca',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('mensagem', config='portuguese'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='mensagem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca'], name='mensagem_busca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mensagemgrupo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca'], name='mensagem_grupo_busca_idx'),
+        ),
+    ]
@@ -0,0 +1,181 @@
+# Generated by Django 5.2 on 2026-10-18 12:28
+
+import datetime
+
+from django.db import migrations, models, transaction
+
+TABELAS = ("mensagens", "mensagens_grupo")
+MESES_ADIANTE = 3
+TAMANHO_LOTE = 5000
+
+
+def _mes(data):
+    data = data.astimezone(datetime.timezone.utc)
+    return datetime.date(data.year, data.month, 1)
+
+
+def _somar_meses(mes, meses):
+    total = mes.year * 12 + mes.month - 1 + meses
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def _limite(mes):
+    return datetime.datetime(mes.year, mes.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _trocar_tabela(conexao, tabela):
+    """
+    Renomeia `tabela` para `{tabela}_antiga` e cria no lugar a tabela
+    particionada por mês, com as mesmas colunas, índices, FKs e sequência.
+    Daqui em diante as gravações já caem na tabela nova. Roda dentro da
+    transação de particionar(), com `tabela` já travada.
+    """
+    q = conexao.ops.quote_name
+    antiga = f"{tabela}_antiga"
+    with conexao.cursor() as cursor:
+        # Definições atuais, para recriar com os mesmos nomes
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid), x.indisprimary "
+            "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = %s::regclass",
+            [tabela],
+        )
+        indices = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [tabela],
+        )
+        chaves_estrangeiras = cursor.fetchall()
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id_mensagem')", [tabela])
+        (sequencia,) = cursor.fetchone()
+        cursor.execute(f"SELECT last_value, is_called FROM {sequencia}")
+        ultimo, chamado = cursor.fetchone()
+        cursor.execute(f"SELECT min(hora), max(id_mensagem) FROM {q(tabela)}")
+        mais_antiga, maior_id = cursor.fetchone()
+        if maior_id is not None and (maior_id > ultimo or not chamado and maior_id == ultimo):
+            # Ids gravados fora da sequência: a nova começa depois deles
+            ultimo, chamado = maior_id, True
+
+        cursor.execute(f"ALTER TABLE {q(tabela)} RENAME TO {q(antiga)}")
+        for nome, _, _ in indices:
+            cursor.execute(f"ALTER INDEX {q(nome)} RENAME TO {q(nome[:56] + '_antigo')}")
+        # Solta a sequência da identidade (o PostgreSQL 16 não aceita
+        # IDENTITY em tabela particionada): a nova usa uma sequência comum
+        cursor.execute(f"ALTER TABLE {q(antiga)} ALTER COLUMN id_mensagem DROP IDENTITY IF EXISTS")
+
+        cursor.execute(
+            f"CREATE TABLE {q(tabela)} (LIKE {q(antiga)} INCLUDING DEFAULTS "
+            "INCLUDING GENERATED INCLUDING STORAGE) PARTITION BY RANGE (hora)"
+        )
+        nova_sequencia = f"{tabela}_id_mensagem_seq"
+        cursor.execute(f"CREATE SEQUENCE {q(nova_sequencia)} OWNED BY {q(tabela)}.id_mensagem")
+        cursor.execute("SELECT setval(%s, %s, %s)", [nova_sequencia, ultimo, chamado])
+        cursor.execute(
+            f"ALTER TABLE {q(tabela)} ALTER COLUMN id_mensagem "
+            f"SET DEFAULT nextval('{nova_sequencia}'::regclass)"
+        )
+        # A chave primária de uma tabela particionada precisa incluir a hora;
+        # o id continua único porque vem da sequência
+        cursor.execute(
+            f"ALTER TABLE {q(tabela)} ADD CONSTRAINT {q(tabela + '_pkey')} "
+            "PRIMARY KEY (id_mensagem, hora)"
+        )
+        for nome, definicao, primaria in indices:
+            if not primaria:
+                # A definição ainda aponta para `tabela`, agora a particionada
+                cursor.execute(definicao)
+        for nome, definicao in chaves_estrangeiras:
+            cursor.execute(f"ALTER TABLE {q(tabela)} ADD CONSTRAINT {q(nome)} {definicao}")
+
+        atual = _mes(datetime.datetime.now(datetime.timezone.utc))
+        mes = _mes(mais_antiga) if mais_antiga else atual
+        while mes <= _somar_meses(atual, MESES_ADIANTE):
+            proximo = _somar_meses(mes, 1)
+            cursor.execute(
+                f"CREATE TABLE {q(f'{tabela}_{mes:%Y_%m}')} PARTITION OF {q(tabela)} "
+                "FOR VALUES FROM (%s) TO (%s)",
+                [_limite(mes), _limite(proximo)],
+            )
+            mes = proximo
+        cursor.execute(f"CREATE TABLE {q(tabela + '_padrao')} PARTITION OF {q(tabela)} DEFAULT")
+
+
+def _copiar_em_lotes(conexao, tabela):
+    q = conexao.ops.quote_name
+    antiga = f"{tabela}_antiga"
+    with conexao.cursor() as cursor:
+        cursor.execute(
+            "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass "
+            "AND attnum > 0 AND NOT attisdropped AND attgenerated = '' ORDER BY attnum",
+            [antiga],
+        )
+        colunas = ", ".join(q(nome) for (nome,) in cursor.fetchall())
+        cursor.execute(f"SELECT min(id_mensagem), max(id_mensagem) FROM {q(antiga)}")
+        primeiro, ultimo = cursor.fetchone()
+    if primeiro is None:
+        return
+    for inicio in range(primeiro, ultimo + 1, TAMANHO_LOTE):
+        with transaction.atomic(using=conexao.alias), conexao.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {q(tabela)} ({colunas}) SELECT {colunas} FROM {q(antiga)} "
+                "WHERE id_mensagem >= %s AND id_mensagem < %s",
+                [inicio, inicio + TAMANHO_LOTE],
+            )
+
+
+def particionar(apps, schema_editor):
+    conexao = schema_editor.connection
+    if conexao.vendor != "postgresql":
+        return
+    for tabela in TABELAS:
+        with transaction.atomic(using=conexao.alias):
+            # Antes de qualquer leitura: com a tabela travada nenhum INSERT
+            # em andamento tira um id da sequência depois que ela é copiada
+            with conexao.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {conexao.ops.quote_name(tabela)} IN ACCESS EXCLUSIVE MODE")
+            _trocar_tabela(conexao, tabela)
+        _copiar_em_lotes(conexao, tabela)
+        with conexao.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {conexao.ops.quote_name(tabela + '_antiga')}")
+
+
+class Migration(migrations.Migration):
+    """
+    Particiona `mensagens` e `mensagens_grupo` por mês (PARTITION BY RANGE
+    em `hora`), com uma partição por mês desde a mensagem mais antiga até
+    MESES_ADIANTE meses à frente e uma partição padrão. Só PostgreSQL.
+
+    Não atômica: a troca de tabela é uma transação curta; o histórico é
+    copiado depois, em lotes por id (um commit por lote), enquanto as
+    mensagens novas já vão para a tabela nova. Para o Django nada muda
+    (o estado dos modelos é o mesmo); a partir daqui as partições são
+    mantidas por `manage.py arquivar_mensagens` (app/particoes.py).
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0017_busca_mensagens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoMensagens',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabela', models.CharField(max_length=40)),
+                ('mes', models.DateField()),
+                ('arquivo', models.CharField(max_length=255)),
+                ('linhas', models.PositiveIntegerField()),
+                ('conversas', models.JSONField(default=list)),
+                ('arquivado_em', models.DateTimeField(auto_now_add=True)),
+                ('restaurado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'arquivos_mensagens',
+                'constraints': [models.UniqueConstraint(fields=('tabela', 'mes'), name='arquivo_mensagens_unico')],
+            },
+        ),
+        migrations.RunPython(particionar, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 12:36
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Habilita o pg_trgm e cria os índices GiST de trigramas usados pela busca
+    de parceiros (app/parceiros.py). Não atômica: os índices são criados com
+    CREATE INDEX CONCURRENTLY, sem travar as gravações nas tabelas.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0018_particoes_mensagens'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='parceiro',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['localizacao'], name='parceiro_local_trgm_idx', opclasses=['gist_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='preferencia',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['esportes'], name='preferencia_esportes_trgm_idx', opclasses=['gist_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='usuario',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['nome'], name='usuario_nome_trgm_idx', opclasses=['gist_trgm_ops']),
+        ),
+    ]
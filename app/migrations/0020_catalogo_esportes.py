@@ -0,0 +1,208 @@
+# Generated by Django 5.2 on 2026-10-18 12:39
+
+import difflib
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+TAMANHO_LOTE = 2000
+SEMELHANCA_MINIMA = 0.85
+
+# Catálogo inicial: (nome, outros jeitos de escrever, já normalizados)
+CATALOGO = [
+    ("Futebol", ["futbol", "soccer", "fut", "pelada", "futebol de campo"]),
+    ("Futsal", ["futebol de salao"]),
+    ("Society", ["futebol society", "fut7", "futebol 7"]),
+    ("Vôlei", ["voleibol", "volleyball", "volley"]),
+    ("Vôlei de praia", ["volei de areia", "beach volley"]),
+    ("Futevôlei", ["futvolei"]),
+    ("Basquete", ["basquetebol", "basketball", "basket", "basquet"]),
+    ("Handebol", ["handball", "handbol"]),
+    ("Corrida", ["running", "cooper", "correr"]),
+    ("Corrida de rua", ["maratona", "meia maratona"]),
+    ("Caminhada", ["caminhar", "walking"]),
+    ("Trilha", ["trekking", "hiking", "trilhas"]),
+    ("Natação", ["nadar", "swimming"]),
+    ("Ciclismo", ["bike", "bicicleta", "pedal", "mountain bike", "mtb"]),
+    ("Tênis", ["tennis"]),
+    ("Tênis de mesa", ["ping pong", "pingue pongue", "table tennis"]),
+    ("Beach tennis", ["beach tenis"]),
+    ("Padel", ["paddle"]),
+    ("Musculação", ["academia", "gym", "treino de forca", "maromba"]),
+    ("Crossfit", ["cross fit", "treino funcional", "funcional"]),
+    ("Yoga", ["ioga"]),
+    ("Pilates", []),
+    ("Dança", ["danca", "zumba"]),
+    ("Skate", ["skateboard"]),
+    ("Surfe", ["surf"]),
+    ("Escalada", ["boulder", "climbing"]),
+    ("Jiu-jitsu", ["jiu jitsu", "jiujitsu", "bjj"]),
+    ("Judô", ["judo"]),
+    ("Boxe", ["boxing", "box"]),
+    ("Muay thai", ["muaythai", "muay tai"]),
+    ("Artes marciais", ["luta", "lutas", "mma"]),
+    ("Remo", ["canoagem", "stand up paddle", "sup"]),
+    ("Xadrez", ["chess"]),
+]
+
+_SEPARADORES = re.compile(r"\s*(?:[,;/|+\n]|\s-\s|\be\b)\s*")
+
+
+# Cópias de app/esportes.py: a migração não depende do código que ainda vai mudar
+def _normalizar(texto):
+    sem_acento = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", sem_acento.lower()).split())
+
+
+def _singular(termo):
+    return " ".join(
+        palavra[:-1] if len(palavra) > 3 and palavra.endswith("s") else palavra
+        for palavra in termo.split()
+    )
+
+
+def popular_catalogo(apps, schema_editor):
+    Esporte = apps.get_model("app", "Esporte")
+    SinonimoEsporte = apps.get_model("app", "SinonimoEsporte")
+    with transaction.atomic(using=schema_editor.connection.alias):
+        for nome, outros in CATALOGO:
+            esporte = Esporte.objects.create(nome=nome)
+            SinonimoEsporte.objects.bulk_create([
+                SinonimoEsporte(termo=termo, esporte=esporte)
+                for termo in dict.fromkeys([_normalizar(nome), *outros])
+            ])
+
+
+def separar_esportes(apps, schema_editor):
+    """Lê Preferencia.esportes em lotes e preenche EsporteUsuario (e o catálogo)."""
+    Esporte = apps.get_model("app", "Esporte")
+    SinonimoEsporte = apps.get_model("app", "SinonimoEsporte")
+    EsporteUsuario = apps.get_model("app", "EsporteUsuario")
+    Preferencia = apps.get_model("app", "Preferencia")
+    sinonimos = dict(SinonimoEsporte.objects.values_list("termo", "esporte_id"))
+    conhecidos = {}  # termo normalizado -> esporte_id, inclusive os aproximados
+
+    def esporte_de(original):
+        termo = _normalizar(original)[:60]
+        if termo in conhecidos:
+            return conhecidos[termo]
+        for candidato in (termo, _singular(termo)):
+            if candidato in sinonimos:
+                conhecidos[termo] = sinonimos[candidato]
+                return conhecidos[termo]
+        parecidos = difflib.get_close_matches(termo, sinonimos, n=1, cutoff=SEMELHANCA_MINIMA)
+        if parecidos:
+            conhecidos[termo] = sinonimos[parecidos[0]]
+        else:
+            nome = " ".join(original.split())[:60]
+            esporte, _ = Esporte.objects.get_or_create(nome=nome[:1].upper() + nome[1:])
+            SinonimoEsporte.objects.create(termo=termo, esporte=esporte)
+            sinonimos[termo] = conhecidos[termo] = esporte.pk
+        return conhecidos[termo]
+
+    ultimo = 0
+    while True:
+        lote = list(
+            Preferencia.objects.filter(id_preferencia__gt=ultimo)
+            .exclude(esportes="")
+            .order_by("id_preferencia")
+            .values_list("id_preferencia", "usuario_id", "esportes")[:TAMANHO_LOTE]
+        )
+        if not lote:
+            return
+        with transaction.atomic(using=schema_editor.connection.alias):
+            pares = {
+                (usuario_id, esporte_de(original))
+                for _, usuario_id, texto in lote
+                for original in _SEPARADORES.split(texto)
+                if _normalizar(original)
+            }
+            EsporteUsuario.objects.bulk_create(
+                [EsporteUsuario(usuario_id=usuario_id, esporte_id=esporte_id) for usuario_id, esporte_id in pares],
+                ignore_conflicts=True,
+            )
+        ultimo = lote[-1][0]
+
+
+class Migration(migrations.Migration):
+    """
+    Catálogo de esportes (ver app/esportes.py): cria Esporte, SinonimoEsporte
+    e EsporteUsuario, popula o catálogo inicial (CATALOGO) e separa o texto
+    livre de cada Preferencia.esportes em EsporteUsuario. Termos que não
+    casam com o catálogo viram esportes novos.
+
+    O índice de trigramas de esportes sai: a busca de parceiros passa a
+    filtrar por EsporteUsuario. Não atômica: as preferências são lidas em
+    lotes de TAMANHO_LOTE, um commit por lote.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('app', '0019_busca_trigramas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Esporte',
+            fields=[
+                ('id_esporte', models.AutoField(primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=60, unique=True)),
+            ],
+            options={
+                'db_table': 'esportes',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EsporteUsuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'db_table': 'esportes_usuarios',
+            },
+        ),
+        migrations.CreateModel(
+            name='SinonimoEsporte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termo', models.CharField(max_length=60, unique=True)),
+            ],
+            options={
+                'db_table': 'esportes_sinonimos',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='preferencia',
+            name='preferencia_esportes_trgm_idx',
+        ),
+        migrations.AddField(
+            model_name='esporteusuario',
+            name='esporte',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='praticantes', to='app.esporte'),
+        ),
+        migrations.AddField(
+            model_name='esporteusuario',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='esportes_praticados', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='sinonimoesporte',
+            name='esporte',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sinonimos', to='app.esporte'),
+        ),
+        migrations.AddIndex(
+            model_name='esporteusuario',
+            index=models.Index(fields=['esporte', 'usuario'], name='esporte_usuario_busca_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='esporteusuario',
+            constraint=models.UniqueConstraint(fields=('usuario', 'esporte'), name='esporte_usuario_unico'),
+        ),
+        migrations.RunPython(popular_catalogo, migrations.RunPython.noop),
+        migrations.RunPython(separar_esportes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_coordenadas_locais'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoRecomendacoes',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estado_recomendacoes', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('atualizada_em', models.DateTimeField(blank=True, null=True)),
+                ('marcada_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'recomendacoes_estado',
+            },
+        ),
+        migrations.CreateModel(
+            name='Recomendacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicao', models.PositiveSmallIntegerField()),
+                ('nota', models.FloatField()),
+                ('parceiro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recomendacoes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'recomendacoes',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'posicao'), name='recomendacao_posicao_unica')],
+            },
+        ),
+    ]
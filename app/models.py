@@ -8,10 +8,15 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.utils import timezone
 from django.conf import settings
 from django.db import models
 
+# Dicionário do PostgreSQL usado na busca textual das mensagens
+CONFIG_BUSCA = "portuguese"
+
 
 class UsuarioManager(BaseUserManager):
     def create_user(self, nome, password=None, email=None, **extra_fields):
@@ -64,6 +69,10 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
 
     class Meta:
         db_table = "usuarios"
+        indexes = [
+            # Busca de parceiros por trigramas (app/parceiros.py)
+            GistIndex(fields=["nome"], name="usuario_nome_trgm_idx", opclasses=["gist_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.nome
@@ -106,13 +115,68 @@ class Parceiro(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="parceiros")
     preferencia = models.ForeignKey(Preferencia, on_delete=models.SET_NULL, null=True, blank=True)
     localizacao = models.CharField(max_length=255, blank=True)
+    # Coordenadas da cidade de `localizacao` (app/geo.py), preenchidas ao salvar
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
 
     class Meta:
         db_table = "parceiros"
+        indexes = [
+            GistIndex(fields=["localizacao"], name="parceiro_local_trgm_idx", opclasses=["gist_trgm_ops"]),
+        ]
 
     def __str__(self):
         return f"Parceiro {self.id_parceiros} - {self.usuario.nome}"
 
+
+class Esporte(models.Model):
+    """
+    Catálogo de esportes. O texto livre de Preferencia.esportes é separado e
+    casado com os sinônimos (ver app/esportes.py); o resultado fica em
+    EsporteUsuario, que é por onde a busca de parceiros filtra.
+    """
+    id_esporte = models.AutoField(primary_key=True)
+    nome = models.CharField(max_length=60, unique=True)
+
+    class Meta:
+        db_table = "esportes"
+        ordering = ["nome"]
+
+    def __str__(self):
+        return self.nome
+
+
+class SinonimoEsporte(models.Model):
+    """Um jeito de escrever o esporte, já normalizado (minúsculo e sem acento)."""
+    termo = models.CharField(max_length=60, unique=True)
+    esporte = models.ForeignKey(Esporte, on_delete=models.CASCADE, related_name="sinonimos")
+
+    class Meta:
+        db_table = "esportes_sinonimos"
+
+    def __str__(self):
+        return f"{self.termo} → {self.esporte.nome}"
+
+
+class EsporteUsuario(models.Model):
+    """Esporte que o usuário pratica, tirado das preferências dele."""
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="esportes_praticados")
+    esporte = models.ForeignKey(Esporte, on_delete=models.CASCADE, related_name="praticantes")
+
+    class Meta:
+        db_table = "esportes_usuarios"
+        constraints = [
+            models.UniqueConstraint(fields=["usuario", "esporte"], name="esporte_usuario_unico"),
+        ]
+        indexes = [
+            # Busca de parceiros: quem pratica o esporte X
+            models.Index(fields=["esporte", "usuario"], name="esporte_usuario_busca_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.nome} - {self.esporte.nome}"
+
 class Ranking(models.Model):
     id_ranking = models.AutoField(primary_key=True)
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="rankings")
@@ -121,20 +185,70 @@ class Ranking(models.Model):
 
     class Meta:
         db_table = "ranking"
+        constraints = [
+            # Uma linha por usuário e esporte ("" = ranking global);
+            # permite o upsert em lote do reconstruir_ranking
+            models.UniqueConstraint(
+                fields=["usuario", "esporte_prat"], name="ranking_usuario_esporte_unico"
+            ),
+        ]
+        indexes = [
+            # Placar: filtra por esporte e percorre por pontos (posição e top-N)
+            models.Index(
+                fields=["esporte_prat", "-pontuacao_total", "usuario"], name="ranking_placar_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.usuario.nome} - {self.pontuacao_total}"
 
+class MensagensManager(models.Manager):
+    """Não carrega o vetor da busca (`busca`), que só serve dentro do banco."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer("busca")
+
+
+def chave_conversa(usuario_id, contato_id):
+    """Chave da conversa entre dois usuários, a mesma nos dois sentidos: "u{menor}-{maior}"."""
+    return f"u{min(usuario_id, contato_id)}-{max(usuario_id, contato_id)}"
+
+
 class Mensagem(models.Model):
     id_mensagem = models.AutoField(primary_key=True)
     id_remetente = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="mensagens_enviadas")
     id_destinatario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="mensagens_recebidas")
+    # chave_conversa(remetente, destinatario), preenchida no save(). Gravações
+    # com bulk_create precisam preencher à mão.
+    conversa = models.CharField(max_length=24, editable=False)
     mensagem = models.TextField()
     hora = models.DateTimeField(auto_now_add=True)
+    # Vetor da busca textual, calculado pelo próprio banco a cada gravação
+    # (inclusive bulk_create)
+    busca = models.GeneratedField(
+        expression=SearchVector("mensagem", config=CONFIG_BUSCA),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = MensagensManager()
 
     class Meta:
         db_table = "mensagens"
         ordering = ["hora"]
+        indexes = [
+            # Histórico da conversa (os dois sentidos) por keyset (hora, id), do mais novo para trás
+            models.Index(
+                fields=["conversa", "-hora", "-id_mensagem"],
+                name="mensagem_chave_hora_idx",
+            ),
+            GinIndex(fields=["busca"], name="mensagem_busca_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.conversa:
+            self.conversa = chave_conversa(self.id_remetente_id, self.id_destinatario_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"De {self.id_remetente.nome} para {self.id_destinatario.nome} - {self.hora}"
@@ -144,8 +258,19 @@ class Grupo(models.Model):
     nome = models.CharField(max_length=200)
     descricao = models.TextField(blank=True)
     localizacao = models.CharField(max_length=255, blank=True)
+    # Coordenadas da cidade de `localizacao` (app/geo.py), preenchidas ao salvar
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     criado_em = models.DateTimeField(auto_now_add=True)
     membros = models.ManyToManyField(Usuario, related_name="grupos", blank=True)
+    # Resumo do chat do grupo, mantido a cada envio (app/conversas.py).
+    # As mensagens ficam uma vez só em MensagemGrupo; as não lidas de cada
+    # membro são total_mensagens - LeituraGrupo.mensagens_lidas.
+    ultima_mensagem = models.CharField(max_length=200, blank=True)  # prévia
+    ultima_hora = models.DateTimeField(null=True, blank=True)
+    id_ultima_mensagem = models.PositiveIntegerField(null=True, blank=True)
+    total_mensagens = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = "grupos"
@@ -159,14 +284,46 @@ class MensagemGrupo(models.Model):
     id_remetente = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="mensagens_grupo_enviadas")
     mensagem = models.TextField()
     hora = models.DateTimeField(auto_now_add=True)
+    busca = models.GeneratedField(
+        expression=SearchVector("mensagem", config=CONFIG_BUSCA),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = MensagensManager()
 
     class Meta:
         db_table = "mensagens_grupo"
         ordering = ["hora"]
+        indexes = [
+            # Histórico do grupo por keyset (hora, id), do mais novo para trás
+            models.Index(
+                fields=["id_grupo", "-hora", "-id_mensagem"],
+                name="mensagem_grupo_hora_idx",
+            ),
+            GinIndex(fields=["busca"], name="mensagem_grupo_busca_idx"),
+        ]
 
     def __str__(self):
         return f"Em {self.id_grupo.nome} de {self.id_remetente.nome} - {self.hora}"
 
+class LeituraGrupo(models.Model):
+    """Marcador de leitura de um membro no chat do grupo: quantas mensagens ele já viu."""
+    grupo = models.ForeignKey(Grupo, on_delete=models.CASCADE, related_name="leituras")
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="leituras_grupo")
+    mensagens_lidas = models.PositiveIntegerField(default=0)
+    # Marcador de leitura: id da última mensagem do grupo que o membro já viu
+    lida_ate = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = "leituras_grupo"
+        constraints = [
+            models.UniqueConstraint(fields=["grupo", "usuario"], name="leitura_grupo_unica"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.nome} leu {self.mensagens_lidas} em {self.grupo.nome}"
+
 class GrupoAdmin(models.Model):
     id = models.AutoField(primary_key=True)
     grupo = models.ForeignKey(Grupo, on_delete=models.CASCADE, related_name="admins")
@@ -209,6 +366,8 @@ class Conclusao(models.Model):
 class Comunidade(models.Model):
     nome = models.CharField(max_length=100)
     cor = models.CharField(max_length=20, default="#0066ff")
+    # esporte praticado na comunidade (usado nas regras de pontuação)
+    esporte = models.CharField(max_length=150, blank=True)
 
     # administrador da comunidade
     admin = models.ForeignKey(
@@ -233,8 +392,201 @@ class Comunidade(models.Model):
 class MetaComunidade(models.Model):
     comunidade = models.ForeignKey(Comunidade, on_delete=models.CASCADE)
     titulo = models.CharField(max_length=100)
-    usuarios_cumpriram = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True)
+    usuarios_cumpriram = models.ManyToManyField(
+        settings.AUTH_USER_MODEL, blank=True, through="MetaCumprida"
+    )
 
     def __str__(self):
         return self.titulo
 
+class MetaCumprida(models.Model):
+    """Linha do M2M MetaComunidade.usuarios_cumpriram, com a hora em que a meta foi cumprida."""
+    metacomunidade = models.ForeignKey(MetaComunidade, on_delete=models.CASCADE)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # null = cumprida antes de o horário ser registrado (só conta no placar geral)
+    cumprida_em = models.DateTimeField(default=timezone.now, null=True)
+
+    class Meta:
+        db_table = "app_metacomunidade_usuarios_cumpriram"
+        unique_together = ("metacomunidade", "usuario")
+        indexes = [
+            models.Index(fields=["usuario", "cumprida_em"], name="meta_cumprida_usuario_data_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario} cumpriu {self.metacomunidade} em {self.cumprida_em}"
+
+
+class RankingComunidade(models.Model):
+    """Placar materializado de uma comunidade (mantido por app/ranking.py)."""
+    comunidade = models.ForeignKey(Comunidade, on_delete=models.CASCADE, related_name="ranking")
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="rankings_comunidade")
+    pontuacao_total = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "ranking_comunidade"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["comunidade", "usuario"], name="ranking_comunidade_usuario_unico"
+            ),
+        ]
+        indexes = [
+            # Top-N e páginas do placar da comunidade numa leitura de faixa
+            models.Index(
+                fields=["comunidade", "-pontuacao_total", "usuario"],
+                name="ranking_comunidade_placar_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.comunidade.nome}: {self.usuario.nome} - {self.pontuacao_total}"
+
+
+class RankingPeriodo(models.Model):
+    """
+    Placar pré-agregado por período (semana ou mês), um contador por
+    usuário e período. Períodos fora da retenção são apagados (ver app/ranking.py).
+    """
+    PERIODO_CHOICES = [
+        ("semana", "Semanal"),
+        ("mes", "Mensal"),
+    ]
+
+    periodo = models.CharField(max_length=10, choices=PERIODO_CHOICES)
+    inicio = models.DateField()  # segunda-feira da semana ou dia 1 do mês
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="rankings_periodo")
+    pontuacao_total = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "ranking_periodo"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["periodo", "inicio", "usuario"], name="ranking_periodo_usuario_unico"
+            ),
+        ]
+        indexes = [
+            # "Top 100 da semana" numa leitura de faixa
+            models.Index(
+                fields=["periodo", "inicio", "-pontuacao_total", "usuario"],
+                name="ranking_periodo_placar_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_periodo_display()} {self.inicio}: {self.usuario.nome} - {self.pontuacao_total}"
+
+
+class HistoricoRanking(models.Model):
+    """
+    Histórico diário do placar global de um usuário, compactado numa única
+    linha: posicoes[i] e pontos[i] são a foto do dia `inicio + i`
+    (None = sem foto naquele dia). Gravado por `manage.py registrar_historico_ranking`.
+    """
+    usuario = models.OneToOneField(
+        Usuario, on_delete=models.CASCADE, primary_key=True, related_name="historico_ranking"
+    )
+    inicio = models.DateField()  # dia da primeira posição das listas
+    posicoes = models.JSONField(default=list)
+    pontos = models.JSONField(default=list)
+
+    class Meta:
+        db_table = "ranking_historico"
+
+    def __str__(self):
+        return f"Histórico de {self.usuario.nome} desde {self.inicio} ({len(self.posicoes)} dias)"
+
+
+class ResumoConversa(models.Model):
+    """
+    Resumo de uma conversa direta do ponto de vista de `usuario`: última
+    mensagem trocada com `contato`, quando foi e quantas ele ainda não leu.
+    Mantido a cada envio (ver app/conversas.py); é o que a lista lateral do chat lê.
+    """
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="resumos_conversa")
+    contato = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="+")
+    ultima_mensagem = models.CharField(max_length=200, blank=True)  # prévia
+    ultima_hora = models.DateTimeField()
+    id_ultima_mensagem = models.PositiveIntegerField(null=True, blank=True)
+    nao_lidas = models.PositiveIntegerField(default=0)
+    # Marcador de leitura: id da última mensagem que o usuário já viu
+    lida_ate = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = "resumos_conversa"
+        constraints = [
+            models.UniqueConstraint(fields=["usuario", "contato"], name="resumo_conversa_unico"),
+        ]
+        indexes = [
+            # Lista lateral: conversas do usuário da mais recente para a mais antiga
+            models.Index(fields=["usuario", "-ultima_hora"], name="resumo_conversa_recentes_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.nome} ↔ {self.contato.nome} ({self.nao_lidas} não lidas)"
+
+
+class ArquivoMensagens(models.Model):
+    """
+    Um mês de `tabela` (mensagens ou mensagens_grupo) tirado do banco para um
+    arquivo .csv.gz em MENSAGENS_ARQUIVO_DIR (ver app/particoes.py).
+    `conversas` lista as chaves das conversas ("u1-2", "g3") que têm
+    mensagens no arquivo, para restaurar só quando alguém chega nelas.
+    """
+    tabela = models.CharField(max_length=40)
+    mes = models.DateField()  # primeiro dia do mês
+    arquivo = models.CharField(max_length=255)
+    linhas = models.PositiveIntegerField()
+    conversas = models.JSONField(default=list)
+    arquivado_em = models.DateTimeField(auto_now_add=True)
+    # Preenchido quando o mês volta para o banco; o arquivo continua valendo
+    restaurado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "arquivos_mensagens"
+        constraints = [
+            models.UniqueConstraint(fields=["tabela", "mes"], name="arquivo_mensagens_unico"),
+        ]
+
+    def __str__(self):
+        return f"{self.tabela} {self.mes:%Y-%m} ({self.linhas} mensagens)"
+
+
+class Recomendacao(models.Model):
+    """
+    Um dos parceiros sugeridos para `usuario`, na `posicao` dada pela
+    compatibilidade (app/compatibilidade.py). Recalculado por
+    app/recomendacoes.py; a lista padrão da busca só lê estas linhas.
+    """
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="recomendacoes")
+    parceiro = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="+")
+    posicao = models.PositiveSmallIntegerField()
+    nota = models.FloatField()
+
+    class Meta:
+        db_table = "recomendacoes"
+        constraints = [
+            # Também é o índice da leitura: sugestões do usuário em ordem
+            models.UniqueConstraint(fields=["usuario", "posicao"], name="recomendacao_posicao_unica"),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.nome} → {self.parceiro.nome} ({self.posicao}º)"
+
+
+class EstadoRecomendacoes(models.Model):
+    """
+    Quando as recomendações de `usuario` foram calculadas e quando algo que
+    muda o resultado (preferência ou parceiro dele, ou de alguém da lista
+    dele) aconteceu. Desatualizadas = marcada_em depois de atualizada_em.
+    """
+    usuario = models.OneToOneField(
+        Usuario, on_delete=models.CASCADE, primary_key=True, related_name="estado_recomendacoes"
+    )
+    atualizada_em = models.DateTimeField(null=True, blank=True)
+    marcada_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "recomendacoes_estado"
+
+    def __str__(self):
+        return f"Recomendações de {self.usuario.nome} ({self.atualizada_em})"
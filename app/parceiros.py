@@ -0,0 +1,224 @@
+"""
+Busca de parceiros (tela buscar_parceiros).
+
+`esporte` é casado com o catálogo (app/esportes.py: sinônimos, plural e
+erros de digitação) e vira um filtro exato pelo índice (esporte, usuario)
+de EsporteUsuario. `termo` procura no nome e também nos esportes, se o
+termo for um esporte do catálogo.
+
+Nome e localização são texto livre: no PostgreSQL são comparados por
+trigramas (extensão pg_trgm), com `coluna %> texto` (word_similarity pelo
+menos BUSCA_PARCEIROS_LIMIAR), que tolera erros de digitação ("Recfe"
+acha "Recife") e maiúsculas/minúsculas.
+
+As duas colunas têm índice GiST gist_trgm_ops, que além de filtrar devolve
+as linhas já em ordem de semelhança (`coluna <->> texto`). Isso importa
+para termos comuns: um GIN acharia rápido os milhares de parceiros de
+"São Paulo", mas todos teriam que ser lidos e pontuados para ordenar.
+Aqui o filtro principal (termo, senão localização) lê só os
+BUSCA_PARCEIROS_CANDIDATOS mais parecidos que passam nos outros filtros,
+e só esses são pontuados: relevância = soma das semelhanças de cada
+filtro (1 para esporte que bate). Cada filtro é um `id IN (...)`, sem
+JOIN que duplique linhas, então também não há DISTINCT.
+
+Em outros bancos nome e localização caem no icontains, ordenado por nome.
+
+Busca por distância (`origem` e `raio`): app/geo.py, pelas coordenadas
+gravadas em cada Parceiro.
+
+Sem texto nem distância (a tela aberta, ou só o filtro de esporte), o
+resultado são os parceiros mais compatíveis com quem busca (idade, turno,
+nível e esportes; ver app/compatibilidade.py). Sem filtro nenhum, é a
+lista pré-calculada de app/recomendacoes.py.
+"""
+import functools
+import operator
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    F,
+    FloatField,
+    Func,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    When,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Coalesce, Greatest
+
+from . import compatibilidade, esportes, geo, recomendacoes
+from .models import EsporteUsuario, Parceiro, Preferencia, Usuario
+
+
+class DistanciaTrigrama(Func):
+    """`coluna <->> texto` = 1 - word_similarity(texto, coluna). O índice GiST ordena por ela."""
+
+    arg_joiner = " <->> "
+    template = "(%(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, coluna, texto):
+        super().__init__(F(coluna), Value(texto))
+
+
+def _que_batem(modelo, coluna, texto):
+    return modelo.objects.filter(**{f"{coluna}__trigram_word_similar": texto})
+
+
+def _candidatos(linhas, campo, filtros, quantos):
+    """Até `quantos` ids de usuário (`campo`) de `linhas`, só de quem passa em `filtros`."""
+    for filtro in filtros:
+        linhas = linhas.filter(**{f"{campo}__in": filtro})
+    return linhas.values_list(campo, flat=True)[:quantos]
+
+
+def _semelhanca(modelo, coluna, texto):
+    """Maior semelhança de `texto` com `coluna` entre as linhas do usuário (0 se nenhuma)."""
+    return Coalesce(
+        Subquery(
+            modelo.objects.filter(usuario=OuterRef("pk"))
+            .annotate(semelhanca=TrigramWordSimilarity(texto, coluna))
+            .order_by("-semelhanca")
+            .values("semelhanca")[:1]
+        ),
+        Value(0.0),
+    )
+
+
+def _detalhes():
+    # Uma consulta para as preferências e uma para os parceiros de todos os cards
+    return [
+        Prefetch("preferencias", queryset=Preferencia.objects.order_by("pk")),
+        Prefetch("parceiros", queryset=Parceiro.objects.order_by("pk")),
+    ]
+
+
+def _com_detalhes(usuarios):
+    return usuarios.prefetch_related(*_detalhes())
+
+
+def _mais_compativeis(usuario, usuarios, filtros, limite):
+    if not filtros:
+        sugeridos = recomendacoes.sugeridos(usuario, limite)
+        prefetch_related_objects(sugeridos, *_detalhes())
+        return sugeridos
+    for filtro in filtros:
+        usuarios = usuarios.filter(pk__in=filtro)
+    notas = compatibilidade.melhores(usuario, limite, usuarios.values_list("pk", flat=True))
+    encontrados = _com_detalhes(Usuario.objects.all()).in_bulk([pk for pk, _ in notas])
+    resultado = []
+    for pk, nota in notas:
+        if pk in encontrados:  # apagado depois da matriz montada
+            encontrados[pk].compatibilidade = nota
+            resultado.append(encontrados[pk])
+    return resultado
+
+
+def buscar(usuario, termo="", esporte="", localizacao="", limite=None, origem=None, raio=None):
+    """
+    Até `limite` (padrão: BUSCA_PARCEIROS_LIMITE) usuários, menos `usuario`,
+    que batem com os filtros informados, do mais para o menos parecido.
+    Sem termo, localização nem `origem`, em ordem de compatibilidade.
+
+    Com `origem` (latitude, longitude), a localização em texto não filtra:
+    ficam só os parceiros a até `raio` km (sem raio, os mais próximos; ver
+    app/geo.py), e a distância desempata (ou ordena, se não houver termo).
+    """
+    limite = limite or getattr(settings, "BUSCA_PARCEIROS_LIMITE", 50)
+    termo, esporte, localizacao = (texto.strip() for texto in (termo or "", esporte or "", localizacao or ""))
+    usuarios = Usuario.objects.exclude(pk=usuario.pk)
+    catalogo = esportes.Catalogo()
+
+    filtros = []  # ids de usuário que todo resultado tem que ter
+    if esporte:
+        ids_esporte = catalogo.resolver(esporte)
+        if not ids_esporte:
+            return []
+        filtros.append(esportes.usuarios_que_praticam(ids_esporte))
+    # Se o termo for um esporte, quem o pratica também entra
+    ids_termo = catalogo.resolver(termo) if termo else set()
+    praticantes = esportes.usuarios_que_praticam(ids_termo) if ids_termo else None
+
+    ordem_distancia = []
+    if origem is not None:
+        localizacao = ""
+        if raio is None:
+            perto = Parceiro.objects.exclude(usuario=usuario)
+            for filtro in filtros:
+                perto = perto.filter(usuario_id__in=filtro)
+            raio = geo.raio_para(perto, origem, limite)
+        filtros.append(geo.no_raio(Parceiro.objects.all(), origem, raio).values("usuario_id"))
+        usuarios = usuarios.annotate(distancia=Subquery(
+            geo.com_distancia(Parceiro.objects.filter(usuario=OuterRef("pk")), origem)
+            .order_by("distancia")
+            .values("distancia")[:1]
+        ))
+        ordem_distancia = ["distancia"]
+
+    if not (termo or localizacao or ordem_distancia):
+        return _mais_compativeis(usuario, usuarios, filtros, limite)
+
+    if connection.vendor != "postgresql" or not (termo or localizacao):
+        # Sem pg_trgm (ou sem texto para comparar): icontains, em ordem de nome
+        for filtro in filtros:
+            usuarios = usuarios.filter(pk__in=filtro)
+        if termo:
+            condicao = Q(nome__icontains=termo)
+            if praticantes is not None:
+                condicao |= Q(pk__in=praticantes)
+            usuarios = usuarios.filter(condicao)
+        if localizacao:
+            usuarios = usuarios.filter(
+                pk__in=Parceiro.objects.filter(localizacao__icontains=localizacao).values("usuario_id")
+            )
+        return list(_com_detalhes(usuarios.order_by(*ordem_distancia, "nome"))[:limite])
+
+    candidatos = max(limite, getattr(settings, "BUSCA_PARCEIROS_CANDIDATOS", 500))
+    relevancia = []
+    if termo:
+        # Os outros filtros entram na leitura ordenada do principal: os
+        # candidatos são os mais parecidos entre os que já batem com tudo
+        if localizacao:
+            filtros.append(_que_batem(Parceiro, "localizacao", localizacao).values("usuario_id"))
+        fontes = [_candidatos(
+            _que_batem(Usuario, "nome", termo).order_by(DistanciaTrigrama("nome", termo)),
+            "pk", filtros, candidatos,
+        )]
+        nome_ou_esporte = TrigramWordSimilarity(termo, "nome")
+        if praticantes is not None:
+            fontes.append(_candidatos(
+                EsporteUsuario.objects.filter(esporte_id__in=ids_termo), "usuario_id", filtros, candidatos
+            ))
+            nome_ou_esporte = Greatest(
+                nome_ou_esporte,
+                Case(When(pk__in=praticantes, then=Value(1.0)), default=Value(0.0)),
+            )
+        relevancia.append(nome_ou_esporte)
+    else:
+        fontes = [_candidatos(
+            _que_batem(Parceiro, "localizacao", localizacao)
+            .order_by(DistanciaTrigrama("localizacao", localizacao)),
+            "usuario_id", filtros, candidatos,
+        )]
+    if localizacao:
+        relevancia.append(_semelhanca(Parceiro, "localizacao", localizacao))
+
+    usuarios = (
+        usuarios.filter(pk__in=fontes[0].union(*fontes[1:]) if len(fontes) > 1 else fontes[0])
+        .annotate(relevancia=functools.reduce(operator.add, relevancia))
+        .order_by("-relevancia", *ordem_distancia, "nome")
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Vale só para esta transação (o `%>` usa o limiar da sessão)
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                [str(getattr(settings, "BUSCA_PARCEIROS_LIMIAR", 0.5))],
+            )
+        return list(_com_detalhes(usuarios)[:limite])
@@ -0,0 +1,438 @@
+"""
+Particionamento mensal das tabelas de mensagens e arquivo frio.
+
+`mensagens` e `mensagens_grupo` são particionadas por faixa de `hora`
+(PARTITION BY RANGE, migração 0018), uma partição por mês:
+mensagens_2026_10, mensagens_grupo_2026_10... O histórico do chat lê pelo
+keyset (hora, id), então só toca as partições dos meses que mostra, e cada
+partição tem seus próprios índices e seu próprio vacuum, que não crescem
+com o histórico inteiro. A partição padrão (mensagens_padrao) pega o que
+cair fora dos meses criados; criar_particao() move essas linhas quando o
+mês ganha a sua.
+
+`manage.py arquivar_mensagens` (pensado para rodar todo dia):
+- cria as partições dos próximos MENSAGENS_PARTICOES_ADIANTE meses;
+- grava cada mês mais antigo que MENSAGENS_MESES_QUENTES num .csv.gz em
+  MENSAGENS_ARQUIVO_DIR, registra em ArquivoMensagens e só então solta a
+  partição (DETACH + DROP), tudo na mesma transação;
+- solta de novo os meses restaurados há mais de MENSAGENS_RESTAURADOS_DIAS.
+
+restaurar() devolve um mês ao banco a partir do arquivo. O histórico do
+chat chama pedir_restauracao() quando a rolagem para cima chega ao fim do
+que está no banco e ainda há arquivo com mensagens daquela conversa: o mês
+mais recente anterior ao cursor volta numa thread de fundo
+(RestauradorMensagens), fora da requisição, e o chat pede a mesma página de
+novo até ele chegar. A busca textual só vê o que está no banco.
+
+Quais meses arquivados têm cada conversa (o manifesto) fica no cache, para
+a rolagem não consultar ArquivoMensagens a cada página. arquivar() e
+restaurar() trocam a versão do cache depois do commit; num cache local de
+outro processo o manifesto antigo vale até MENSAGENS_MANIFESTO_TIMEOUT.
+"""
+import datetime
+import gzip
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import ArquivoMensagens
+
+# tabela -> expressão SQL da chave da conversa de cada linha
+# (a mesma de conversas.chave_conversa / conversas.chave_grupo)
+TABELAS = {
+    "mensagens": "conversa",
+    "mensagens_grupo": "'g' || id_grupo_id",
+}
+
+_NOME_MES = re.compile(r"^(\d{4})_(\d{2})$")
+
+logger = logging.getLogger(__name__)
+
+
+# ======== Meses ========
+
+def inicio_do_mes(data):
+    return datetime.date(data.year, data.month, 1)
+
+
+def somar_meses(mes, meses):
+    total = mes.year * 12 + mes.month - 1 + meses
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def _limites(mes):
+    """Faixa [início, fim) do mês em UTC, como nas partições."""
+    inicio = datetime.datetime(mes.year, mes.month, 1, tzinfo=datetime.timezone.utc)
+    fim = somar_meses(mes, 1)
+    return inicio, datetime.datetime(fim.year, fim.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def nome_particao(tabela, mes):
+    return f"{tabela}_{mes:%Y_%m}"
+
+
+# ======== Catálogo ========
+
+def _q(nome):
+    return connection.ops.quote_name(nome)
+
+
+def particionada(tabela):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [tabela])
+        return cursor.fetchone()[0] == "p"
+
+
+def meses_no_banco(tabela):
+    """Meses que têm partição em `tabela`, em ordem (sem a partição padrão)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [tabela],
+        )
+        nomes = [nome for (nome,) in cursor.fetchall()]
+    meses = []
+    for nome in nomes:
+        encontrado = _NOME_MES.match(nome[len(tabela) + 1:])
+        if nome.startswith(tabela + "_") and encontrado:
+            meses.append(datetime.date(int(encontrado[1]), int(encontrado[2]), 1))
+    return sorted(meses)
+
+
+def _colunas(tabela):
+    """Colunas gravadas de verdade (as geradas, como `busca`, o banco recalcula)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass "
+            "AND attnum > 0 AND NOT attisdropped AND attgenerated = '' ORDER BY attnum",
+            [tabela],
+        )
+        return [nome for (nome,) in cursor.fetchall()]
+
+
+def _chaves_estrangeiras(tabela):
+    """[(coluna, tabela referenciada, coluna referenciada)] das FKs de `tabela`."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT a.attname, r.relname, ra.attname "
+            "FROM pg_constraint c "
+            "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1] "
+            "JOIN pg_class r ON r.oid = c.confrelid "
+            "JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1] "
+            "WHERE c.conrelid = %s::regclass AND c.contype = 'f'",
+            [tabela],
+        )
+        return cursor.fetchall()
+
+
+def _travar(cursor, tabela):
+    # Uma manutenção por tabela de cada vez (comando e restaurações sob demanda)
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"particoes:{tabela}"])
+
+
+# ======== Partições ========
+
+def criar_particao(tabela, mes):
+    """
+    Cria a partição do mês, se ainda não existe, trazendo para ela as
+    linhas do mês que tenham caído na partição padrão. Retorna se criou.
+    """
+    nome = nome_particao(tabela, mes)
+    inicio, fim = _limites(mes)
+    colunas = ", ".join(_q(coluna) for coluna in _colunas(tabela))
+    with transaction.atomic(), connection.cursor() as cursor:
+        _travar(cursor, tabela)
+        cursor.execute("SELECT to_regclass(%s)", [nome])
+        if cursor.fetchone()[0] is not None:
+            return False
+        padrao = _q(f"{tabela}_padrao")
+        cursor.execute(
+            f"CREATE TABLE {_q(nome)} (LIKE {_q(tabela)} INCLUDING DEFAULTS INCLUDING GENERATED)"
+        )
+        cursor.execute(
+            f"INSERT INTO {_q(nome)} ({colunas}) SELECT {colunas} FROM {padrao} "
+            "WHERE hora >= %s AND hora < %s",
+            [inicio, fim],
+        )
+        cursor.execute(f"DELETE FROM {padrao} WHERE hora >= %s AND hora < %s", [inicio, fim])
+        # Os índices da tabela mãe são criados na partição pelo ATTACH
+        cursor.execute(
+            f"ALTER TABLE {_q(tabela)} ATTACH PARTITION {_q(nome)} FOR VALUES FROM (%s) TO (%s)",
+            [inicio, fim],
+        )
+    return True
+
+
+def garantir_particoes(adiante=None, hoje=None):
+    """Cria as partições do mês atual e dos `adiante` seguintes. Retorna as criadas."""
+    if adiante is None:
+        adiante = getattr(settings, "MENSAGENS_PARTICOES_ADIANTE", 3)
+    atual = inicio_do_mes(hoje or timezone.now().date())
+    criadas = []
+    for tabela in TABELAS:
+        for i in range(adiante + 1):
+            mes = somar_meses(atual, i)
+            if criar_particao(tabela, mes):
+                criadas.append(nome_particao(tabela, mes))
+    return criadas
+
+
+def meses_para_arquivar(tabela, meses_quentes=None, hoje=None):
+    """
+    Meses de `tabela` ainda no banco e mais antigos que `meses_quentes`.
+    Meses restaurados só voltam para o arquivo depois de
+    MENSAGENS_RESTAURADOS_DIAS.
+    """
+    if meses_quentes is None:
+        meses_quentes = getattr(settings, "MENSAGENS_MESES_QUENTES", 12)
+    agora = timezone.now()
+    limite = somar_meses(inicio_do_mes(hoje or agora.date()), -meses_quentes)
+    dias = getattr(settings, "MENSAGENS_RESTAURADOS_DIAS", 30)
+    recentes = set(
+        ArquivoMensagens.objects.filter(
+            tabela=tabela, restaurado_em__gte=agora - datetime.timedelta(days=dias)
+        ).values_list("mes", flat=True)
+    )
+    return [mes for mes in meses_no_banco(tabela) if mes < limite and mes not in recentes]
+
+
+# ======== Arquivo frio ========
+
+def _diretorio():
+    return getattr(settings, "MENSAGENS_ARQUIVO_DIR", os.path.join(settings.BASE_DIR, "arquivo_mensagens"))
+
+
+def _copiar_para_arquivo(cursor, sql, arquivo):
+    bruto = cursor.cursor
+    if hasattr(bruto, "copy_expert"):  # psycopg2
+        bruto.copy_expert(sql, arquivo)
+    else:  # psycopg 3
+        with bruto.copy(sql) as copia:
+            for dados in copia:
+                arquivo.write(dados)
+
+
+def _copiar_do_arquivo(cursor, sql, arquivo):
+    bruto = cursor.cursor
+    if hasattr(bruto, "copy_expert"):
+        bruto.copy_expert(sql, arquivo)
+    else:
+        with bruto.copy(sql) as copia:
+            while dados := arquivo.read(1 << 16):
+                copia.write(dados)
+
+
+def arquivar(tabela, mes, diretorio=None):
+    """
+    Grava o mês num .csv.gz, registra em ArquivoMensagens e remove a
+    partição do banco. O arquivo é gravado (e sincronizado no disco) antes
+    do DROP, na mesma transação: se algo falhar, a partição continua lá.
+    Retorna quantas mensagens foram arquivadas.
+    """
+    nome = nome_particao(tabela, mes)
+    diretorio = diretorio or _diretorio()
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f"{nome}.csv.gz")
+    colunas = ", ".join(_q(coluna) for coluna in _colunas(tabela))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _travar(cursor, tabela)
+        # Ninguém grava no mês enquanto ele é copiado
+        cursor.execute(f"LOCK TABLE {_q(nome)} IN SHARE MODE")
+        cursor.execute(f"SELECT count(*) FROM {_q(nome)}")
+        linhas = cursor.fetchone()[0]
+        cursor.execute(f"SELECT DISTINCT {TABELAS[tabela]} FROM {_q(nome)}")
+        chaves = sorted(chave for (chave,) in cursor.fetchall())
+
+        temporario = caminho + ".tmp"
+        with open(temporario, "wb") as bruto:
+            with gzip.GzipFile(fileobj=bruto, mode="wb") as arquivo:
+                _copiar_para_arquivo(
+                    cursor,
+                    f"COPY (SELECT {colunas} FROM {_q(nome)} ORDER BY id_mensagem) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER)",
+                    arquivo,
+                )
+            bruto.flush()
+            os.fsync(bruto.fileno())
+        os.replace(temporario, caminho)
+
+        ArquivoMensagens.objects.update_or_create(
+            tabela=tabela,
+            mes=mes,
+            defaults={
+                "arquivo": caminho,
+                "linhas": linhas,
+                "conversas": chaves,
+                "arquivado_em": timezone.now(),
+                "restaurado_em": None,
+            },
+        )
+        cursor.execute(f"ALTER TABLE {_q(tabela)} DETACH PARTITION {_q(nome)}")
+        cursor.execute(f"DROP TABLE {_q(nome)}")
+        transaction.on_commit(invalidar_manifesto)
+    return linhas
+
+
+def restaurar(tabela, mes):
+    """
+    Devolve ao banco um mês arquivado. Mensagens de usuários ou grupos
+    apagados depois do arquivamento ficam de fora. Retorna quantas
+    mensagens voltaram (0 se o mês já estava restaurado).
+    """
+    nome = nome_particao(tabela, mes)
+    colunas = ", ".join(_q(coluna) for coluna in _colunas(tabela))
+    existentes = " ".join(
+        f"AND EXISTS (SELECT 1 FROM {_q(referenciada)} r WHERE r.{_q(coluna_ref)} = t.{_q(coluna)})"
+        for coluna, referenciada, coluna_ref in _chaves_estrangeiras(tabela)
+    )
+
+    with transaction.atomic():
+        registro = ArquivoMensagens.objects.select_for_update().get(tabela=tabela, mes=mes)
+        if registro.restaurado_em is not None:
+            return 0
+        criar_particao(tabela, mes)
+        with connection.cursor() as cursor:
+            _travar(cursor, tabela)
+            # Pode ser o segundo mês restaurado na mesma transação
+            cursor.execute("DROP TABLE IF EXISTS restaurar_mensagens")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE restaurar_mensagens (LIKE {_q(tabela)}) ON COMMIT DROP"
+            )
+            with gzip.open(registro.arquivo, "rb") as arquivo:
+                _copiar_do_arquivo(
+                    cursor,
+                    f"COPY restaurar_mensagens ({colunas}) FROM STDIN WITH (FORMAT csv, HEADER)",
+                    arquivo,
+                )
+            cursor.execute(
+                f"INSERT INTO {_q(nome)} ({colunas}) SELECT {colunas} FROM restaurar_mensagens t "
+                f"WHERE TRUE {existentes} ON CONFLICT DO NOTHING"
+            )
+            restauradas = cursor.rowcount
+        registro.restaurado_em = timezone.now()
+        registro.save(update_fields=["restaurado_em"])
+        transaction.on_commit(invalidar_manifesto)
+    return restauradas
+
+
+# ======== Restauração sob demanda ========
+
+CACHE_VERSAO = "particoes:versao"
+CACHE_TIMEOUT = 300
+
+
+def invalidar_manifesto():
+    try:
+        cache.incr(CACHE_VERSAO)
+    except ValueError:
+        cache.set(CACHE_VERSAO, 1, None)
+
+
+def meses_arquivados(tabela, chave):
+    """Meses arquivados (e não restaurados) com mensagens da conversa, do mais novo ao mais antigo."""
+    versao = cache.get_or_set(CACHE_VERSAO, 1, None)
+    timeout = getattr(settings, "MENSAGENS_MANIFESTO_TIMEOUT", CACHE_TIMEOUT)
+    return cache.get_or_set(
+        f"particoes:arquivo:{versao}:{tabela}:{chave}",
+        lambda: list(
+            ArquivoMensagens.objects.filter(
+                tabela=tabela, restaurado_em__isnull=True, conversas__contains=[chave]
+            ).order_by("-mes").values_list("mes", flat=True)
+        ),
+        timeout,
+    )
+
+
+def _mes_arquivado(tabela, chave, antes):
+    """O mês arquivado mais recente da conversa que possa ter mensagens anteriores a `antes`."""
+    limite = antes.astimezone(datetime.timezone.utc).date() if antes is not None else None
+    for mes in meses_arquivados(tabela, chave):
+        if limite is None or mes <= limite:
+            return mes
+    return None
+
+
+def tem_arquivo(tabela, chave, antes=None):
+    """Se há mês arquivado (e não restaurado) com mensagens da conversa anteriores a `antes`."""
+    return _mes_arquivado(tabela, chave, antes) is not None
+
+
+class RestauradorMensagens:
+    """
+    Thread de fundo que devolve ao banco os meses pedidos pelo chat, um de
+    cada vez. Pedidos repetidos do mesmo mês viram uma restauração só.
+    """
+
+    def __init__(self):
+        self._pendentes = set()  # (tabela, mes)
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def marcar(self, meses):
+        with self._condicao:
+            self._pendentes.update(meses)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._executar, name="restaurador-mensagens", daemon=True
+                )
+                self._thread.start()
+            self._condicao.notify()
+
+    def processar(self):
+        """Restaura o que está pendente agora. Retorna quantos meses."""
+        with self._condicao:
+            pendentes, self._pendentes = self._pendentes, set()
+        try:
+            for tabela, mes in sorted(pendentes):
+                try:
+                    restaurar(tabela, mes)
+                except Exception:
+                    # O chat pede de novo na próxima rolagem
+                    logger.exception("Falha ao restaurar %s", nome_particao(tabela, mes))
+        finally:
+            close_old_connections()
+        return len(pendentes)
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+            self.processar()
+
+
+_restaurador = None
+_restaurador_lock = threading.Lock()
+
+
+def get_restaurador():
+    global _restaurador
+    with _restaurador_lock:
+        if _restaurador is None:
+            _restaurador = RestauradorMensagens()
+    return _restaurador
+
+
+def pedir_restauracao(tabela, chave, antes=None):
+    """
+    Pede a volta ao banco do mês arquivado mais recente da conversa `chave`
+    ("u1-2", "g3") que possa ter mensagens anteriores a `antes`. Com
+    MENSAGENS_RESTAURACAO = "sincrono" restaura na hora (testes e scripts);
+    senão só agenda no RestauradorMensagens. Retorna se o mês já voltou.
+    """
+    mes = _mes_arquivado(tabela, chave, antes)
+    if mes is None:
+        return False
+    if getattr(settings, "MENSAGENS_RESTAURACAO", "thread") == "sincrono":
+        restaurar(tabela, mes)
+        return True
+    get_restaurador().marcar({(tabela, mes)})
+    return False
@@ -0,0 +1,14 @@
+"""
+Initializer dos pools de processos dos comandos (atualizar_recomendacoes).
+
+Não importa modelos nem serviços do app: com spawn/forkserver o processo
+novo importa este módulo para achar o initializer antes de o Django estar
+configurado, e importar app.models nesse momento falharia.
+"""
+import django
+
+
+def iniciar_processo():
+    # Com fork já vem configurado (setup() de novo não faz nada); com
+    # spawn/forkserver monta o Django a partir de DJANGO_SETTINGS_MODULE
+    django.setup()
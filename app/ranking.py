@@ -0,0 +1,767 @@
+"""
+Serviço único de pontuação do ranking.
+
+A pontuação de um usuário é a soma das regras de RANKING_REGRAS
+(settings). Cada regra é uma classe com pontuar(usuario_ids), que faz uma
+única agregação para o lote de usuários. Usuário sem linha em Ranking
+equivale a 0 pontos.
+
+Os pontos ficam materializados em quatro tipos de placar (ver Quadro):
+  - global: Ranking com esporte_prat = "";
+  - por esporte: Ranking com esporte_prat = esporte da comunidade;
+  - por comunidade: RankingComunidade;
+  - por semana/mês: RankingPeriodo, um contador por usuário e período,
+    só para os períodos dentro de RANKING_PERIODOS_RETIDOS.
+
+O caminho normal é incremental: os signals em app/signals.py marcam os
+usuários afetados por cada mudança e o agendador (app/agendador.py) chama
+atualizar_pontuacao() só para eles, juntando as mudanças em lote.
+recalcular_ranking_completo() (e o comando `manage.py reconstruir_ranking`)
+refaz tudo em lotes e usa exatamente a mesma conta, então os dois caminhos
+sempre chegam no mesmo resultado.
+
+As telas leem os placares gravados; em_cache() guarda o resultado pronto
+até a próxima gravação de pontos no mesmo cache. Com um cache compartilhado
+(Redis/Memcached) isso vale para todos os processos; com o LocMem padrão
+cada processo tem o seu, e os outros podem mostrar uma página até
+RANKING_CACHE_TIMEOUT segundos mais velha que o placar gravado.
+
+Uma vez por dia registrar_historico() tira uma foto do placar global em
+HistoricoRanking (uma linha por usuário, com listas de posições e pontos),
+de onde saem a série de um usuário e a variação de posição ("+3 na semana").
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DateField, DateTimeField, F, Q
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import (
+    Conclusao,
+    HistoricoRanking,
+    MetaCumprida,
+    Ranking,
+    RankingComunidade,
+    RankingPeriodo,
+    Usuario,
+)
+
+PONTOS_POR_META = 10
+
+# Empates: "competicao" numera 1, 2, 2, 4 e "denso" numera 1, 2, 2, 3
+MODOS_EMPATE = ("competicao", "denso")
+
+# Placares por tempo: função que trunca a data e quantos períodos manter
+PERIODOS = {
+    "semana": TruncWeek,
+    "mes": TruncMonth,
+}
+RETENCAO_PADRAO = {"semana": 8, "mes": 12}
+
+
+# ======== Períodos ========
+
+def inicio_periodo(periodo, data=None):
+    """Segunda-feira da semana ou dia 1 do mês de `data` (padrão: hoje)."""
+    data = data or timezone.localdate()
+    if periodo == "semana":
+        return data - datetime.timedelta(days=data.weekday())
+    return data.replace(day=1)
+
+
+def inicio_retencao(periodo):
+    """Início do período mais antigo que ainda é mantido."""
+    retencao = getattr(settings, "RANKING_PERIODOS_RETIDOS", RETENCAO_PADRAO)[periodo]
+    inicio = inicio_periodo(periodo)
+    if periodo == "semana":
+        return inicio - datetime.timedelta(weeks=retencao - 1)
+    for _ in range(retencao - 1):
+        inicio = inicio_periodo("mes", inicio - datetime.timedelta(days=1))
+    return inicio
+
+
+# ======== Regras de pontuação ========
+
+class RegraPontuacao:
+    """
+    Base das regras. Cada regra conta "eventos" (linhas de fonte()) de
+    cada usuário e dá `pontos` por evento.
+
+    pontuar(usuario_ids) retorna {id_usuario: pontos} só para quem pontuou.
+    Com agrupar_por retorna {(id_usuario, chave): pontos}, onde a chave é o
+    esporte, a comunidade ou o início da semana/mês do evento. Regras cuja
+    fonte não tem esse agrupamento (ex.: Conclusao não tem comunidade)
+    retornam {}.
+    """
+
+    campo_usuario = "usuario_id"
+    # Campo com a data do evento, usado nos placares por período
+    campo_data = None
+    # Agrupamentos extras que a fonte oferece: {nome: expressão}
+    agrupamentos = {}
+
+    def __init__(self, pontos):
+        self.pontos = pontos
+
+    def fonte(self):
+        raise NotImplementedError
+
+    def valor(self, linha):
+        """Pontos por evento de uma linha agrupada."""
+        return self.pontos
+
+    def campos_extras(self):
+        """Campos extras de que valor() precisa."""
+        return {}
+
+    def _agrupamento(self, agrupar_por):
+        if agrupar_por in PERIODOS:
+            if not self.campo_data:
+                return None
+            return PERIODOS[agrupar_por](self.campo_data, output_field=DateField())
+        return self.agrupamentos.get(agrupar_por)
+
+    def pontuar(self, usuario_ids, agrupar_por=None):
+        eventos = self.fonte().filter(**{f"{self.campo_usuario}__in": usuario_ids})
+        campos = {"uid": F(self.campo_usuario), **self.campos_extras()}
+        if agrupar_por:
+            chave = self._agrupamento(agrupar_por)
+            if chave is None:
+                return {}
+            campos["chave"] = chave
+            if agrupar_por in PERIODOS:
+                desde = inicio_retencao(agrupar_por)
+                campo = eventos.model._meta.get_field(self.campo_data)
+                if isinstance(campo, DateTimeField):
+                    desde = timezone.make_aware(datetime.datetime.combine(desde, datetime.time.min))
+                eventos = eventos.filter(**{f"{self.campo_data}__gte": desde})
+
+        resultado = {}
+        for linha in eventos.values(**campos).annotate(total=Count("pk")):
+            chave = (linha["uid"], linha["chave"]) if agrupar_por else linha["uid"]
+            resultado[chave] = resultado.get(chave, 0) + linha["total"] * self.valor(linha)
+        return resultado
+
+
+class PontosPorMeta(RegraPontuacao):
+    """`pontos` por meta de comunidade cumprida."""
+
+    campo_data = "cumprida_em"
+    agrupamentos = {
+        "esporte": F("metacomunidade__comunidade__esporte"),
+        "comunidade": F("metacomunidade__comunidade_id"),
+    }
+
+    def __init__(self, pontos=PONTOS_POR_META):
+        super().__init__(pontos)
+
+    def fonte(self):
+        return MetaCumprida.objects.all()
+
+
+class PontosPorConclusao(RegraPontuacao):
+    """`pontos` por Desafio concluído (Conclusao). Não entra em placar de comunidade/esporte."""
+
+    campo_usuario = "id_usuario_id"
+    campo_data = "data_conclusao"
+
+    def fonte(self):
+        return Conclusao.objects.all()
+
+
+class PontosPorEsporte(PontosPorMeta):
+    """
+    Bônus por meta cumprida em comunidades de certos esportes.
+    `pontos` é um dicionário {esporte: bônus por meta}, ex.: {"corrida": 5}.
+    """
+
+    def fonte(self):
+        return MetaCumprida.objects.filter(
+            metacomunidade__comunidade__esporte__in=list(self.pontos)
+        )
+
+    def campos_extras(self):
+        return {"esporte": F("metacomunidade__comunidade__esporte")}
+
+    def valor(self, linha):
+        return self.pontos[linha["esporte"]]
+
+
+def carregar_regras():
+    """
+    Monta as regras a partir de settings.RANKING_REGRAS, uma lista de
+    (caminho da classe, kwargs). Sem a configuração, vale só PontosPorMeta.
+    """
+    config = getattr(settings, "RANKING_REGRAS", None)
+    if not config:
+        return [PontosPorMeta()]
+    return [import_string(caminho)(**kwargs) for caminho, kwargs in config]
+
+
+def calcular_pontuacoes(usuario_ids, agrupar_por=None):
+    """
+    Soma as regras. Sem agrupar_por retorna {id_usuario: pontos} para
+    todos os usuários informados, incluindo quem tem 0 pontos.
+    """
+    usuario_ids = list(usuario_ids)
+    pontos = {} if agrupar_por else {uid: 0 for uid in usuario_ids}
+
+    for regra in carregar_regras():
+        for chave, valor in regra.pontuar(usuario_ids, agrupar_por).items():
+            pontos[chave] = pontos.get(chave, 0) + valor
+
+    return pontos
+
+
+# ======== Gravação dos placares ========
+# Cada linha de placar é identificada por (tipo, chave, id_usuario):
+#   ("global", "", id), ("esporte", "corrida", id), ("comunidade", 7, id)
+
+def calcular_quadros(usuario_ids):
+    """Todas as linhas de placar calculadas para os usuários informados."""
+    usuario_ids = list(usuario_ids)
+    quadros = {
+        ("global", "", uid): pontos
+        for uid, pontos in calcular_pontuacoes(usuario_ids).items()
+    }
+    for tipo in ("esporte", "comunidade", *PERIODOS):
+        for (uid, chave), pontos in calcular_pontuacoes(usuario_ids, tipo).items():
+            # Comunidades sem esporte não entram em placar de esporte,
+            # e os outros placares só guardam quem pontuou
+            if chave not in ("", None) and pontos:
+                quadros[(tipo, chave, uid)] = pontos
+    return quadros
+
+
+def quadros_gravados(usuario_ids):
+    """Todas as linhas de placar gravadas para os usuários informados."""
+    gravados = {}
+    linhas = (
+        Ranking.objects
+        .filter(usuario_id__in=usuario_ids)
+        .values_list("usuario_id", "esporte_prat", "pontuacao_total")
+    )
+    for uid, esporte, pontos in linhas:
+        gravados[("esporte" if esporte else "global", esporte, uid)] = pontos
+
+    linhas = (
+        RankingComunidade.objects
+        .filter(usuario_id__in=usuario_ids)
+        .values_list("usuario_id", "comunidade_id", "pontuacao_total")
+    )
+    for uid, comunidade_id, pontos in linhas:
+        gravados[("comunidade", comunidade_id, uid)] = pontos
+
+    linhas = (
+        RankingPeriodo.objects
+        .filter(usuario_id__in=usuario_ids)
+        .values_list("usuario_id", "periodo", "inicio", "pontuacao_total")
+    )
+    for uid, periodo, inicio, pontos in linhas:
+        gravados[(periodo, inicio, uid)] = pontos
+    return gravados
+
+
+def diferencas(usuario_ids):
+    """
+    Compara o que está gravado com o valor recalculado.
+    Retorna {(tipo, chave, id_usuario): (gravado, calculado)} só para as
+    linhas diferentes; None significa "linha não existe".
+    """
+    usuario_ids = list(usuario_ids)
+    calculados = calcular_quadros(usuario_ids)
+    gravados = quadros_gravados(usuario_ids)
+    return {
+        linha: (gravados.get(linha), calculados.get(linha))
+        for linha in calculados.keys() | gravados.keys()
+        if gravados.get(linha) != calculados.get(linha)
+    }
+
+
+def gravar(mudancas):
+    """
+    Aplica o resultado de diferencas(): upsert em lote do que tem valor
+    novo e delete do que deixou de existir.
+    """
+    if not mudancas:
+        return
+
+    linhas_ranking, linhas_comunidade, linhas_periodo = [], [], []
+    remover_ranking, remover_comunidade, remover_periodo = (
+        Q(pk__in=[]), Q(pk__in=[]), Q(pk__in=[])
+    )
+    for (tipo, chave, uid), (_, novo) in mudancas.items():
+        if tipo in PERIODOS:
+            if novo is None:
+                remover_periodo |= Q(periodo=tipo, inicio=chave, usuario_id=uid)
+            else:
+                linhas_periodo.append(
+                    RankingPeriodo(periodo=tipo, inicio=chave, usuario_id=uid, pontuacao_total=novo)
+                )
+        elif tipo == "comunidade":
+            if novo is None:
+                remover_comunidade |= Q(comunidade_id=chave, usuario_id=uid)
+            else:
+                linhas_comunidade.append(
+                    RankingComunidade(comunidade_id=chave, usuario_id=uid, pontuacao_total=novo)
+                )
+        elif novo is None:
+            remover_ranking |= Q(esporte_prat=chave, usuario_id=uid)
+        else:
+            linhas_ranking.append(
+                Ranking(esporte_prat=chave, usuario_id=uid, pontuacao_total=novo)
+            )
+
+    Ranking.objects.bulk_create(
+        linhas_ranking,
+        update_conflicts=True,
+        unique_fields=["usuario", "esporte_prat"],
+        update_fields=["pontuacao_total"],
+    )
+    RankingComunidade.objects.bulk_create(
+        linhas_comunidade,
+        update_conflicts=True,
+        unique_fields=["comunidade", "usuario"],
+        update_fields=["pontuacao_total"],
+    )
+    RankingPeriodo.objects.bulk_create(
+        linhas_periodo,
+        update_conflicts=True,
+        unique_fields=["periodo", "inicio", "usuario"],
+        update_fields=["pontuacao_total"],
+    )
+    Ranking.objects.filter(remover_ranking).delete()
+    RankingComunidade.objects.filter(remover_comunidade).delete()
+    RankingPeriodo.objects.filter(remover_periodo).delete()
+    invalidar_cache()
+
+    if linhas_periodo:
+        compactar_se_virou_periodo()
+
+
+def compactar_periodos():
+    """Apaga os contadores de períodos que saíram da retenção."""
+    apagados = 0
+    for periodo in PERIODOS:
+        apagados += RankingPeriodo.objects.filter(
+            periodo=periodo, inicio__lt=inicio_retencao(periodo)
+        ).delete()[0]
+    return apagados
+
+
+def compactar_se_virou_periodo():
+    """
+    Compacta automaticamente na primeira gravação de cada nova semana/mês.
+    O cache.add() garante que só a primeira gravação do período faz isso;
+    todos os períodos são marcados, mesmo quando semana e mês viram juntos.
+    """
+    viraram = [
+        cache.add(f"ranking:compactado:{periodo}:{inicio_periodo(periodo)}", True, 60 * 60 * 24 * 32)
+        for periodo in PERIODOS
+    ]
+    if any(viraram):
+        compactar_periodos()
+
+
+def atualizar_pontuacao(usuario_ids):
+    """Recalcula e grava os placares apenas dos usuários informados."""
+    gravar(diferencas(usuario_ids))
+
+
+def lotes_de_usuarios(tamanho_lote=1000):
+    """
+    Percorre os ids de usuário em lotes ordenados por chave (keyset),
+    sem OFFSET e sem carregar a tabela inteira na memória.
+    """
+    ultimo_id = 0
+    while True:
+        ids = list(
+            Usuario.objects
+            .filter(id_usuario__gt=ultimo_id)
+            .order_by("id_usuario")
+            .values_list("id_usuario", flat=True)[:tamanho_lote]
+        )
+        if not ids:
+            return
+        yield ids
+        ultimo_id = ids[-1]
+
+
+def recalcular_ranking_completo(tamanho_lote=1000):
+    """Reconstrói os placares de todos os usuários (job em lote)."""
+    for ids in lotes_de_usuarios(tamanho_lote):
+        atualizar_pontuacao(ids)
+    compactar_periodos()
+
+
+# ======== Cache das telas ========
+# A chave inclui uma versão que muda a cada gravação de pontos. A versão
+# mora no cache padrão: só os processos que enxergam o mesmo cache de quem
+# gravou (todos, se ele for compartilhado) deixam de usar a página antiga na
+# hora. Num cache local de outro processo a página antiga vale até expirar,
+# então RANKING_CACHE_TIMEOUT é o atraso máximo nesse caso.
+
+CACHE_VERSAO = "ranking:versao"
+CACHE_TIMEOUT = 300
+
+
+def invalidar_cache():
+    try:
+        cache.incr(CACHE_VERSAO)
+    except ValueError:
+        cache.set(CACHE_VERSAO, 1, None)
+
+
+def em_cache(nome, calcular):
+    versao = cache.get_or_set(CACHE_VERSAO, 1, None)
+    timeout = getattr(settings, "RANKING_CACHE_TIMEOUT", CACHE_TIMEOUT)
+    return cache.get_or_set(f"ranking:{nome}:{versao}", calcular, timeout)
+
+
+# ======== Leitura dos placares ========
+
+def codificar_cursor(item):
+    """Cursor de paginação de um item numerado: "pontos_usuarioid"."""
+    return f"{item['pontuacao_total']}_{item['usuario'].id_usuario}"
+
+
+def decodificar_cursor(texto):
+    """Inverso de codificar_cursor(); None se vazio, ValueError se inválido."""
+    if not texto:
+        return None
+    pontos, _, usuario_id = texto.partition("_")
+    return int(pontos), int(usuario_id)
+
+
+def _modo_empate(modo):
+    modo = modo or getattr(settings, "RANKING_MODO_EMPATE", "competicao")
+    if modo not in MODOS_EMPATE:
+        raise ValueError(f"Modo de empate inválido: {modo!r}")
+    return modo
+
+
+class Quadro:
+    """
+    Um placar materializado: Quadro() é o global, Quadro(esporte="corrida")
+    o de um esporte, Quadro(comunidade_id=7) o de uma comunidade e
+    Quadro(periodo="semana") o da semana atual (ou da semana de `inicio`).
+
+    A ordem é sempre (-pontuacao_total, usuario_id) e os índices
+    ranking_placar_idx / ranking_comunidade_placar_idx /
+    ranking_periodo_placar_idx cobrem esse filtro e ordenação, então top-N, páginas e posição são leituras de
+    faixa ou contagens no índice.
+    """
+
+    def __init__(self, esporte="", comunidade_id=None, periodo=None, inicio=None):
+        self.esporte = esporte
+        self.comunidade_id = comunidade_id
+        self.periodo = periodo
+        if periodo is not None:
+            if periodo not in PERIODOS:
+                raise ValueError(f"Período inválido: {periodo!r}")
+            self.inicio = inicio_periodo(periodo, inicio)
+
+    @property
+    def nome(self):
+        if self.periodo is not None:
+            return f"{self.periodo}:{self.inicio.isoformat()}"
+        if self.comunidade_id is not None:
+            return f"comunidade:{self.comunidade_id}"
+        return f"esporte:{self.esporte}" if self.esporte else "global"
+
+    def base(self):
+        if self.periodo is not None:
+            return RankingPeriodo.objects.filter(periodo=self.periodo, inicio=self.inicio)
+        if self.comunidade_id is not None:
+            return RankingComunidade.objects.filter(comunidade_id=self.comunidade_id)
+        return Ranking.objects.filter(esporte_prat=self.esporte)
+
+    def placar(self):
+        """Queryset do placar na ordem de exibição."""
+        return (
+            self.base()
+            .select_related("usuario")
+            .order_by("-pontuacao_total", "usuario_id")
+        )
+
+    def pagina(self, cursor=None, tamanho=20, anterior=False):
+        """
+        Uma página do placar por keyset: os `tamanho` registros logo depois
+        do `cursor` (ou logo antes, com anterior=True), já numerados.
+        Custa o mesmo em qualquer página, sem OFFSET.
+
+        Retorna {"itens": [...], "proximo": cursor|None, "anterior": cursor|None};
+        os cursores vêm de codificar_cursor() e voltam em `cursor`.
+        """
+        placar = self.placar().filter(pontuacao_total__gt=0)
+        if cursor is not None:
+            pontos, usuario_id = cursor
+            if anterior:
+                placar = placar.filter(
+                    Q(pontuacao_total__gt=pontos)
+                    | Q(pontuacao_total=pontos, usuario_id__lt=usuario_id)
+                )
+            else:
+                placar = placar.filter(
+                    Q(pontuacao_total__lt=pontos)
+                    | Q(pontuacao_total=pontos, usuario_id__gt=usuario_id)
+                )
+
+        if anterior:
+            # Lê de trás para frente no mesmo índice e desvira
+            registros = list(placar.order_by("pontuacao_total", "-usuario_id")[:tamanho + 1])
+            tem_mais_antes = len(registros) > tamanho
+            if not tem_mais_antes:
+                # Voltou até o começo: mostra a primeira página cheia
+                return self.pagina(None, tamanho)
+            registros = registros[:tamanho]
+            registros.reverse()
+            tem_mais_depois = cursor is not None
+        else:
+            registros = list(placar[:tamanho + 1])
+            tem_mais_depois = len(registros) > tamanho
+            registros = registros[:tamanho]
+            tem_mais_antes = cursor is not None
+
+        itens = self.numerar(registros)
+        return {
+            "itens": itens,
+            "proximo": codificar_cursor(itens[-1]) if itens and tem_mais_depois else None,
+            "anterior": codificar_cursor(itens[0]) if itens and tem_mais_antes else None,
+        }
+
+    def posicao_por_pontos(self, pontos, modo=None):
+        """Posição de quem tem `pontos`, com uma única contagem no índice."""
+        acima = self.base().filter(pontuacao_total__gt=pontos)
+        if _modo_empate(modo) == "denso":
+            acima = acima.values("pontuacao_total").distinct()
+        return acima.count() + 1
+
+    def pontos_do_usuario(self, usuario_id):
+        pontos = (
+            self.base()
+            .filter(usuario_id=usuario_id)
+            .values_list("pontuacao_total", flat=True)
+            .first()
+        )
+        return pontos or 0
+
+    def posicao_no_ranking(self, usuario_id, modo=None):
+        return self.posicao_por_pontos(self.pontos_do_usuario(usuario_id), modo)
+
+    def numerar(self, registros, modo=None):
+        """
+        Acrescenta a posição a registros já na ordem do placar (uma página
+        qualquer). Custa no máximo duas contagens, feitas a partir do
+        primeiro registro.
+        """
+        modo = _modo_empate(modo)
+        lista = []
+        indice = 0  # índice absoluto (a partir de 0) do registro no placar
+        for reg in registros:
+            pontos = reg.pontuacao_total
+            if not lista:
+                posicao = self.posicao_por_pontos(pontos, modo)
+                if modo == "competicao":
+                    # Quantos empatados com o primeiro ficaram em páginas anteriores
+                    indice = posicao - 1 + self.base().filter(
+                        pontuacao_total=pontos, usuario_id__lt=reg.usuario_id
+                    ).count()
+            elif pontos == lista[-1]["pontuacao_total"]:
+                posicao = lista[-1]["posicao"]
+            elif modo == "denso":
+                posicao = lista[-1]["posicao"] + 1
+            else:
+                posicao = indice + 1
+            lista.append({
+                "usuario": reg.usuario,
+                "pontuacao_total": pontos,
+                "posicao": posicao,
+            })
+            indice += 1
+        return lista
+
+    def ao_redor(self, usuario_id, quantidade=1, modo=None):
+        """
+        Posição do usuário e os `quantidade` vizinhos logo acima e logo abaixo.
+        Retorna {"acima": [...], "usuario": {...}, "abaixo": [...]}.
+        """
+        pontos = self.pontos_do_usuario(usuario_id)
+        base = self.placar()
+
+        acima = list(
+            base.filter(
+                Q(pontuacao_total__gt=pontos)
+                | Q(pontuacao_total=pontos, usuario_id__lt=usuario_id)
+            ).order_by("pontuacao_total", "-usuario_id")[:quantidade]
+        )
+        acima.reverse()
+        abaixo = list(
+            base.filter(
+                Q(pontuacao_total__lt=pontos)
+                | Q(pontuacao_total=pontos, usuario_id__gt=usuario_id)
+            )[:quantidade]
+        )
+
+        eu = base.model(usuario_id=usuario_id, pontuacao_total=pontos)
+        eu.usuario = Usuario.objects.get(id_usuario=usuario_id)
+        janela = self.numerar(acima + [eu] + abaixo, modo)
+        meio = len(acima)
+        return {
+            "acima": janela[:meio],
+            "usuario": janela[meio],
+            "abaixo": janela[meio + 1:],
+        }
+
+
+# ======== Histórico diário ========
+# Uma linha por usuário com as listas de posição/pontos por dia, em vez de
+# uma linha por usuário por dia. Ler a série inteira de alguém é buscar uma
+# linha pela chave primária.
+
+HISTORICO_DIAS_PADRAO = 90
+
+
+def _dias_retidos():
+    return getattr(settings, "RANKING_HISTORICO_DIAS", HISTORICO_DIAS_PADRAO)
+
+
+def _posicoes_do_placar(placar, modo):
+    """
+    Gera (usuario_id, pontos, posicao) percorrendo uma vez o placar, que
+    precisa vir na ordem (-pontuacao_total, usuario_id).
+    """
+    anterior = None
+    posicao = 0
+    for indice, (usuario_id, pontos) in enumerate(placar):
+        if pontos != anterior:
+            posicao = posicao + 1 if modo == "denso" else indice + 1
+            anterior = pontos
+        yield usuario_id, pontos, posicao
+
+
+def _anotar_dia(historico, dia, posicao, pontos, dias_retidos):
+    """Grava a foto de `dia` nas listas do histórico e corta o que saiu da retenção."""
+    if not historico.posicoes:
+        historico.inicio = dia
+    indice = (dia - historico.inicio).days
+    if indice < 0:
+        # Foto de um dia anterior ao início da série: abre espaço no começo
+        historico.posicoes[:0] = [None] * -indice
+        historico.pontos[:0] = [None] * -indice
+        historico.inicio = dia
+        indice = 0
+    faltam = indice + 1 - len(historico.posicoes)
+    if faltam > 0:
+        historico.posicoes.extend([None] * faltam)
+        historico.pontos.extend([None] * faltam)
+    historico.posicoes[indice] = posicao
+    historico.pontos[indice] = pontos
+
+    excesso = len(historico.posicoes) - dias_retidos
+    if excesso > 0:
+        del historico.posicoes[:excesso]
+        del historico.pontos[:excesso]
+        historico.inicio += datetime.timedelta(days=excesso)
+
+
+def registrar_historico(dia=None, tamanho_lote=1000, modo=None):
+    """
+    Tira a foto do placar global no `dia` (hoje por padrão) e grava no
+    histórico de cada usuário, em lotes com upsert. Rodar de novo no mesmo
+    dia só sobrescreve a foto daquele dia. Retorna quantos usuários.
+    """
+    dia = dia or timezone.localdate()
+    modo = _modo_empate(modo)
+    dias_retidos = _dias_retidos()
+    placar = (
+        Ranking.objects
+        .filter(esporte_prat="")
+        .order_by("-pontuacao_total", "usuario_id")
+        .values_list("usuario_id", "pontuacao_total")
+        .iterator(chunk_size=tamanho_lote)
+    )
+
+    total = 0
+    lote = []
+    for linha in _posicoes_do_placar(placar, modo):
+        lote.append(linha)
+        if len(lote) >= tamanho_lote:
+            total += _gravar_historico(lote, dia, dias_retidos)
+            lote = []
+    if lote:
+        total += _gravar_historico(lote, dia, dias_retidos)
+    compactar_historico(dia)
+    return total
+
+
+def _gravar_historico(lote, dia, dias_retidos):
+    existentes = HistoricoRanking.objects.in_bulk([uid for uid, _, _ in lote])
+    historicos = []
+    for usuario_id, pontos, posicao in lote:
+        historico = existentes.get(usuario_id) or HistoricoRanking(
+            usuario_id=usuario_id, inicio=dia, posicoes=[], pontos=[]
+        )
+        _anotar_dia(historico, dia, posicao, pontos, dias_retidos)
+        historicos.append(historico)
+    HistoricoRanking.objects.bulk_create(
+        historicos,
+        update_conflicts=True,
+        unique_fields=["usuario"],
+        update_fields=["inicio", "posicoes", "pontos"],
+    )
+    return len(historicos)
+
+
+def serie_do_usuario(usuario_id, dias=None):
+    """
+    Série diária do usuário, do dia mais antigo ao mais recente, numa
+    única consulta: [(data, posicao, pontos), ...]. Dias sem foto ficam de fora.
+    """
+    historico = HistoricoRanking.objects.filter(usuario_id=usuario_id).first()
+    if historico is None:
+        return []
+    serie = [
+        (historico.inicio + datetime.timedelta(days=i), posicao, pontos)
+        for i, (posicao, pontos) in enumerate(zip(historico.posicoes, historico.pontos))
+        if posicao is not None
+    ]
+    return serie[-dias:] if dias else serie
+
+
+def _variacao(historico, dias):
+    """
+    Quantas posições o usuário subiu (positivo) ou caiu (negativo) entre a
+    foto mais recente e a de `dias` antes dela (ou a mais antiga depois
+    disso). None se não houver duas fotos para comparar.
+    """
+    fotos = [(i, p) for i, p in enumerate(historico.posicoes) if p is not None]
+    if len(fotos) < 2:
+        return None
+    ultimo, atual = fotos[-1]
+    for i, posicao in fotos:
+        if i >= ultimo - dias:
+            return None if i == ultimo else posicao - atual
+    return None
+
+
+def variacoes_de_posicao(usuario_ids, dias=7):
+    """{usuario_id: variacao} de vários usuários numa única consulta."""
+    historicos = HistoricoRanking.objects.filter(usuario_id__in=usuario_ids).only(
+        "usuario_id", "posicoes"
+    )
+    return {h.usuario_id: _variacao(h, dias) for h in historicos}
+
+
+def compactar_historico(dia=None):
+    """
+    Apaga as séries que não receberam a foto de `dia`: toda série
+    atualizada já foi cortada para começar dentro da retenção, então
+    sobra só quem saiu do placar.
+    """
+    dia = dia or timezone.localdate()
+    limite = dia - datetime.timedelta(days=_dias_retidos() - 1)
+    return HistoricoRanking.objects.filter(inicio__lt=limite).delete()[0]
@@ -0,0 +1,238 @@
+"""
+Parceiros sugeridos pré-calculados (a lista padrão de buscar_parceiros).
+
+Para cada usuário ficam gravados em Recomendacao os
+RECOMENDACOES_QUANTIDADE parceiros mais compatíveis
+(app/compatibilidade.py), em ordem. Abrir a busca sem filtros é uma
+leitura pelo índice (usuario, posicao), sem pontuar ninguém.
+
+Quando uma Preferencia ou um Parceiro é gravado ou apagado, os signals
+marcam (EstadoRecomendacoes.marcada_em, depois do commit) o dono e quem
+tem o dono na lista: só essas recomendações podem ter mudado por causa
+dele. A busca sempre mostra a lista gravada, mesmo marcada; a visita só
+agenda o recálculo para depois da resposta, numa thread de fundo
+(AtualizadorRecomendacoes), e a próxima visita já vê a lista nova. O
+`manage.py atualizar_recomendacoes` refaz as marcadas e as listas com mais
+de RECOMENDACOES_VALIDADE_HORAS (parceiros novos que passariam a entrar
+nelas) usando um pool de processos. Quem ainda não tem lista nenhuma vê as
+notas calculadas na hora (só leitura) enquanto a dele é gravada.
+
+O recálculo usa a matriz do processo, que pode estar até
+COMPATIBILIDADE_MATRIZ_TTL segundos atrasada; por isso atualizada_em é o
+instante em que a matriz foi lida, e uma marca posterior continua valendo
+até a matriz ser remontada.
+"""
+import datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import compatibilidade
+from .models import EstadoRecomendacoes, Recomendacao, Usuario
+
+logger = logging.getLogger(__name__)
+
+
+def marcar(usuario_ids):
+    """Marca como desatualizadas as listas de `usuario_ids` e as listas em que eles aparecem."""
+    afetados = set(usuario_ids)
+    if not afetados:
+        return
+    afetados.update(
+        Recomendacao.objects.filter(parceiro_id__in=afetados).values_list("usuario_id", flat=True)
+    )
+    agora = timezone.now()
+    # Só quem ainda existe (a preferência pode ter sumido junto com o usuário)
+    EstadoRecomendacoes.objects.bulk_create(
+        [
+            EstadoRecomendacoes(usuario_id=usuario_id, marcada_em=agora)
+            for usuario_id in Usuario.objects.filter(pk__in=afetados).values_list("pk", flat=True)
+        ],
+        update_conflicts=True,
+        unique_fields=["usuario"],
+        update_fields=["marcada_em"],
+    )
+
+
+def atualizar(usuario_ids):
+    """Recalcula e grava as recomendações dos usuários. Retorna quantos."""
+    quantos = getattr(settings, "RECOMENDACOES_QUANTIDADE", 50)
+    lida_em = compatibilidade.matriz().lida_em
+    usuarios = list(Usuario.objects.filter(pk__in=usuario_ids).order_by("pk"))
+    listas = {usuario.pk: compatibilidade.melhores(usuario, quantos) for usuario in usuarios}
+    # A matriz pode ter usuários que já foram apagados
+    existentes = set(
+        Usuario.objects.filter(
+            pk__in={pk for lista in listas.values() for pk, _ in lista}
+        ).values_list("pk", flat=True)
+    )
+    linhas = [
+        Recomendacao(usuario_id=usuario_id, parceiro_id=pk, posicao=posicao, nota=nota)
+        for usuario_id, lista in listas.items()
+        for posicao, (pk, nota) in enumerate((par for par in lista if par[0] in existentes), 1)
+    ]
+    with transaction.atomic():
+        Recomendacao.objects.filter(usuario_id__in=listas).delete()
+        Recomendacao.objects.bulk_create(linhas)
+        EstadoRecomendacoes.objects.bulk_create(
+            [EstadoRecomendacoes(usuario_id=usuario_id, atualizada_em=lida_em) for usuario_id in listas],
+            update_conflicts=True,
+            unique_fields=["usuario"],
+            update_fields=["atualizada_em"],
+        )
+    return len(usuarios)
+
+
+def _desatualizada(estado):
+    return estado is None or estado.atualizada_em is None or (
+        estado.marcada_em is not None and estado.marcada_em > estado.atualizada_em
+    )
+
+
+def sugeridos(usuario, limite):
+    """
+    Até `limite` parceiros sugeridos para `usuario`, em ordem, cada um com
+    `compatibilidade` (a nota). Lê a lista gravada; se ela estiver marcada
+    ou nunca foi calculada, agenda o recálculo (agendar_atualizacao).
+    """
+    estado = EstadoRecomendacoes.objects.filter(usuario=usuario).first()
+    if _desatualizada(estado):
+        agendar_atualizacao([usuario.pk])
+    if estado is None or estado.atualizada_em is None:
+        # Primeira visita: as notas na hora, sem gravar nada
+        notas = compatibilidade.melhores(usuario, limite)
+        encontrados = Usuario.objects.in_bulk([pk for pk, _ in notas])
+        resultado = []
+        for pk, nota in notas:
+            if pk in encontrados:  # apagado depois da matriz montada
+                encontrados[pk].compatibilidade = nota
+                resultado.append(encontrados[pk])
+        return resultado
+    recomendacoes = (
+        Recomendacao.objects.filter(usuario=usuario)
+        .select_related("parceiro")
+        .order_by("posicao")[:limite]
+    )
+    resultado = []
+    for recomendacao in recomendacoes:
+        recomendacao.parceiro.compatibilidade = recomendacao.nota
+        resultado.append(recomendacao.parceiro)
+    return resultado
+
+
+class AtualizadorRecomendacoes:
+    """
+    Thread de fundo que recalcula as listas pedidas pelas visitas à busca.
+    Visitas do mesmo usuário antes do recálculo viram um só.
+    """
+
+    def __init__(self, tamanho_lote=100):
+        self.tamanho_lote = tamanho_lote
+        self._pendentes = set()
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def marcar(self, usuario_ids):
+        with self._condicao:
+            self._pendentes.update(usuario_ids)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._executar, name="atualizador-recomendacoes", daemon=True
+                )
+                self._thread.start()
+            self._condicao.notify()
+
+    def processar(self):
+        """Recalcula o que está pendente agora. Retorna quantos usuários."""
+        with self._condicao:
+            ids, self._pendentes = sorted(self._pendentes), set()
+        try:
+            for i in range(0, len(ids), self.tamanho_lote):
+                atualizar(ids[i:i + self.tamanho_lote])
+        except Exception:
+            # Continuam marcadas: a próxima visita ou o comando refaz
+            logger.exception("Falha ao atualizar recomendações")
+        finally:
+            close_old_connections()
+        return len(ids)
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes:
+                    self._condicao.wait()
+            self.processar()
+
+
+_atualizador = None
+_atualizador_lock = threading.Lock()
+
+
+def get_atualizador():
+    global _atualizador
+    with _atualizador_lock:
+        if _atualizador is None:
+            _atualizador = AtualizadorRecomendacoes()
+    return _atualizador
+
+
+def agendar_atualizacao(usuario_ids):
+    """
+    Recalcula as listas de `usuario_ids` depois do commit, fora da
+    requisição. Com RECOMENDACOES_ATUALIZACAO = "sincrono" recalcula logo
+    após o commit, na mesma thread (testes e scripts); com "comando" deixa
+    tudo para o `manage.py atualizar_recomendacoes`.
+    """
+    usuario_ids = set(usuario_ids)
+    modo = getattr(settings, "RECOMENDACOES_ATUALIZACAO", "thread")
+    if modo == "sincrono":
+        transaction.on_commit(lambda: atualizar(usuario_ids))
+    elif modo != "comando":
+        transaction.on_commit(lambda: get_atualizador().marcar(usuario_ids))
+
+
+def desatualizados(tamanho_lote=1000, todos=False, inicio=0, fim=None):
+    """
+    Ids dos usuários com recomendações marcadas, nunca calculadas ou com
+    mais de RECOMENDACOES_VALIDADE_HORAS, em lotes (keyset por pk), só
+    entre os pks (inicio, fim]. Com `todos`, todos os usuários.
+    """
+    validade = datetime.timedelta(hours=getattr(settings, "RECOMENDACOES_VALIDADE_HORAS", 24))
+    usuarios = Usuario.objects.all() if fim is None else Usuario.objects.filter(pk__lte=fim)
+    ultimo = inicio
+    while True:
+        ids = list(
+            usuarios.filter(pk__gt=ultimo)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:tamanho_lote]
+        )
+        if not ids:
+            return
+        ultimo = ids[-1]
+        if not todos:
+            em_dia = set(
+                EstadoRecomendacoes.objects.filter(
+                    usuario_id__in=ids, atualizada_em__gte=timezone.now() - validade
+                )
+                .exclude(marcada_em__gt=F("atualizada_em"))
+                .values_list("usuario_id", flat=True)
+            )
+            ids = [usuario_id for usuario_id in ids if usuario_id not in em_dia]
+        if ids:
+            yield ids
+
+
+def atualizar_faixa(inicio, fim, todos=False):
+    """
+    Recalcula as recomendações desatualizadas (ou todas, com `todos`) dos
+    usuários com pk em (inicio, fim]. Tarefa do pool de
+    `atualizar_recomendacoes`: quem roda descobre os próprios ids, então o
+    processo pai não precisa do banco. Retorna quantos.
+    """
+    return sum(
+        atualizar(ids) for ids in desatualizados(max(fim - inicio, 1), todos, inicio, fim)
+    )
@@ -0,0 +1,174 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import conversas, esportes, geo, recomendacoes, tempo_real
+from .agendador import agendar_recalculo
+from .models import (
+    Comunidade,
+    Conclusao,
+    Grupo,
+    LeituraGrupo,
+    Mensagem,
+    MensagemGrupo,
+    MetaComunidade,
+    MetaCumprida,
+    Parceiro,
+    Preferencia,
+)
+
+
+# ======== Ranking incremental ========
+
+@receiver(m2m_changed, sender=MetaCumprida)
+def ranking_meta_cumprida(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Agenda o recálculo só de quem ganhou ou perdeu uma meta.
+
+    Sem reverse, `instance` é a meta e `pk_set` são usuários;
+    com reverse (usuario.metacomunidade_set), `instance` é o próprio usuário.
+    """
+    if action == "pre_clear" and not reverse:
+        # Depois do clear não dá mais para saber quem estava na meta
+        instance._usuarios_afetados = set(
+            instance.usuarios_cumpriram.values_list("pk", flat=True)
+        )
+        return
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        afetados = {instance.pk}
+    elif action == "post_clear":
+        afetados = getattr(instance, "_usuarios_afetados", set())
+    else:
+        afetados = pk_set or set()
+
+    agendar_recalculo(afetados)
+
+
+@receiver(pre_delete, sender=MetaComunidade)
+def guardar_usuarios_da_meta(sender, instance, **kwargs):
+    # O delete em cascata das linhas do M2M não dispara m2m_changed
+    instance._usuarios_afetados = set(
+        instance.usuarios_cumpriram.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=MetaComunidade)
+def ranking_meta_removida(sender, instance, **kwargs):
+    afetados = getattr(instance, "_usuarios_afetados", set())
+    agendar_recalculo(afetados)
+
+
+@receiver(post_save, sender=Conclusao)
+@receiver(post_delete, sender=Conclusao)
+def ranking_conclusao(sender, instance, **kwargs):
+    agendar_recalculo([instance.id_usuario_id])
+
+
+@receiver(pre_save, sender=Comunidade)
+def guardar_esporte_anterior(sender, instance, **kwargs):
+    instance._esporte_anterior = (
+        Comunidade.objects.filter(pk=instance.pk).values_list("esporte", flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Comunidade)
+def ranking_esporte_da_comunidade(sender, instance, created, **kwargs):
+    # Mudar o esporte muda o bônus de PontosPorEsporte de quem já cumpriu metas
+    if created or instance._esporte_anterior == instance.esporte:
+        return
+    afetados = (
+        MetaCumprida.objects
+        .filter(metacomunidade__comunidade=instance)
+        .values_list("usuario_id", flat=True)
+        .distinct()
+    )
+    agendar_recalculo(afetados)
+
+
+# ======== Resumos das conversas ========
+
+@receiver(post_save, sender=Mensagem)
+def resumo_conversa_nova_mensagem(sender, instance, created, **kwargs):
+    # Mesma transação do envio (ingestao.enviar grava dentro de atomic()):
+    # resumo e mensagem nunca ficam desencontrados
+    if created:
+        conversas.registrar_envios([instance])
+
+
+@receiver(post_save, sender=MensagemGrupo)
+def resumo_grupo_nova_mensagem(sender, instance, created, **kwargs):
+    if created:
+        conversas.registrar_envios_grupo([instance])
+
+
+@receiver(m2m_changed, sender=Grupo.membros.through)
+def leituras_membros_grupo(sender, instance, action, reverse, pk_set, **kwargs):
+    """Cria/apaga o marcador de leitura de quem entra/sai do grupo."""
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    if reverse:
+        # usuario.grupos.add(...): instance é o usuário, pk_set são grupos
+        por_grupo = {grupo_id: [instance.pk] for grupo_id in pk_set}
+    else:
+        por_grupo = {instance.pk: list(pk_set)}
+
+    for grupo_id, usuario_ids in por_grupo.items():
+        if action == "post_add":
+            conversas.iniciar_leituras(grupo_id, usuario_ids)
+        else:
+            LeituraGrupo.objects.filter(grupo_id=grupo_id, usuario_id__in=usuario_ids).delete()
+
+
+@receiver(m2m_changed, sender=Grupo.membros.through)
+def tempo_real_membros_grupo(sender, instance, action, reverse, pk_set, **kwargs):
+    """Avisa as conexões de WebSocket de quem entrou ou saiu de um grupo."""
+    if action == "pre_clear" and not reverse:
+        # Depois do clear não dá mais para saber quem era membro
+        instance._membros_removidos = list(instance.membros.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        usuario_ids = [instance.pk]
+    elif action == "post_clear":
+        usuario_ids = getattr(instance, "_membros_removidos", [])
+    else:
+        usuario_ids = list(pk_set or ())
+    if usuario_ids:
+        tempo_real.avisar_grupos_mudaram(usuario_ids)
+
+
+# ======== Catálogo de esportes ========
+
+@receiver(post_save, sender=Preferencia)
+@receiver(post_delete, sender=Preferencia)
+def esportes_da_preferencia(sender, instance, **kwargs):
+    # O texto livre das preferências vira EsporteUsuario (ver app/esportes.py)
+    esportes.sincronizar([instance.usuario_id])
+
+
+# ======== Coordenadas ========
+
+@receiver(pre_save, sender=Parceiro)
+@receiver(pre_save, sender=Grupo)
+def coordenadas_da_localizacao(sender, instance, **kwargs):
+    # Busca no gazetteer em memória (app/geo.py): sem consulta nem rede
+    geo.localizar(instance)
+
+
+# ======== Recomendações de parceiros ========
+
+@receiver(post_save, sender=Preferencia)
+@receiver(post_delete, sender=Preferencia)
+@receiver(post_save, sender=Parceiro)
+@receiver(post_delete, sender=Parceiro)
+def recomendacoes_desatualizadas(sender, instance, **kwargs):
+    # Depois do commit: um recálculo que leia antes dele não apaga a marca
+    usuario_id = instance.usuario_id
+    transaction.on_commit(lambda: recomendacoes.marcar([usuario_id]))
@@ -229,6 +229,197 @@ document.addEventListener('DOMContentLoaded', function () {
       }
     });
   
+    // === MENSAGENS ANTERIORES (rolagem infinita) ===
+    const chatBox = document.getElementById('chat-box');
+    const loadOlderBtn = document.getElementById('load-older-btn');
+
+    function buildMessage(m, myId) {
+      const div = document.createElement('div');
+      div.className = 'message ' + (String(m.remetente_id) === myId ? 'from-me' : 'from-you');
+      div.dataset.id = m.id;
+      if(m.remetente_nome) {
+        const nome = document.createElement('small');
+        const strong = document.createElement('strong');
+        strong.textContent = m.remetente_nome + ':';
+        nome.appendChild(strong);
+        div.appendChild(nome);
+        div.appendChild(document.createElement('br'));
+      }
+      div.appendChild(document.createTextNode(m.mensagem));
+      return div;
+    }
+
+    function appendNewMessages(mensagens) {
+      const myId = chatBox.dataset.usuarioId;
+      const noFim = chatBox.scrollHeight - chatBox.scrollTop - chatBox.clientHeight < 40;
+      mensagens.forEach(m => {
+        if(chatBox.querySelector(`.message[data-id="${m.id}"]`)) return;
+        chatBox.appendChild(buildMessage(m, myId));
+      });
+      if(noFim) chatBox.scrollTop = chatBox.scrollHeight;
+    }
+
+    async function loadOlderMessages() {
+      if(!loadOlderBtn || loadOlderBtn.disabled) return;
+      loadOlderBtn.disabled = true;
+      try {
+        const url = loadOlderBtn.dataset.url + '?antes=' + encodeURIComponent(loadOlderBtn.dataset.cursor);
+        const resp = await fetch(url);
+        if(!resp.ok) throw new Error(await resp.text());
+        const data = await resp.json();
+        const myId = chatBox.dataset.usuarioId;
+        const alturaAntes = chatBox.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.mensagens.forEach(m => fragment.appendChild(buildMessage(m, myId)));
+        loadOlderBtn.after(fragment);
+        // Mantém na tela a mesma mensagem que o usuário estava vendo
+        chatBox.scrollTop += chatBox.scrollHeight - alturaAntes;
+        if(data.anteriores && !data.mensagens.length) {
+          // Mês arquivado voltando para o banco: pede de novo daqui a pouco
+          setTimeout(() => {
+            loadOlderBtn.disabled = false;
+            loadOlderMessages();
+          }, 2000);
+        } else if(data.anteriores) {
+          loadOlderBtn.dataset.cursor = data.anteriores;
+          loadOlderBtn.disabled = false;
+        } else {
+          loadOlderBtn.remove();
+        }
+      } catch (err) {
+        loadOlderBtn.disabled = false;
+        console.error(err);
+      }
+    }
+
+    if(chatBox && loadOlderBtn) {
+      loadOlderBtn.addEventListener('click', loadOlderMessages);
+      chatBox.addEventListener('scroll', () => {
+        if(chatBox.scrollTop < 40) loadOlderMessages();
+      });
+    }
+
+    // === MENSAGENS NOVAS (WebSocket, com long-polling de reserva) ===
+    // O WebSocket recebe cada mensagem assim que ela é gravada. Se ele não
+    // abrir (ou cair), uma requisição de long-polling por aba faz o papel:
+    // o servidor segura até chegar mensagem ou o tempo de espera acabar.
+    const sleep = ms => new Promise(r => setTimeout(r, ms));
+    let lastCursor = chatBox ? chatBox.dataset.cursorNovas : null;
+    let wantPolling = false;
+    let pollRunning = false;
+
+    function receiveMessages(mensagens) {
+      if(!mensagens.length) return;
+      appendNewMessages(mensagens);
+      lastCursor = mensagens[mensagens.length - 1].cursor;
+      const myId = chatBox.dataset.usuarioId;
+      if(mensagens.some(m => String(m.remetente_id) !== myId)) {
+        markRead(mensagens[mensagens.length - 1].id);
+      }
+    }
+
+    // === LIDAS ===
+    // Com a conversa aberta na tela, o que chega já conta como lido.
+    // Só avisa o servidor com a aba visível e no máximo uma vez por segundo.
+    let pendingReadId = null;
+    let readTimer = null;
+
+    function markRead(messageId) {
+      pendingReadId = Math.max(pendingReadId || 0, messageId);
+      if(readTimer || document.visibilityState !== 'visible') return;
+      readTimer = setTimeout(sendRead, 1000);
+    }
+
+    async function sendRead() {
+      readTimer = null;
+      if(!pendingReadId) return;
+      const body = new URLSearchParams({ ate: pendingReadId });
+      pendingReadId = null;
+      try {
+        await fetch(chatBox.dataset.lidaUrl, {
+          method: 'POST',
+          headers: { 'X-CSRFToken': getCSRF() },
+          body
+        });
+      } catch (err) {
+        console.error(err);
+      }
+    }
+
+    document.addEventListener('visibilitychange', () => {
+      if(document.visibilityState === 'visible' && pendingReadId && !readTimer) sendRead();
+    });
+
+    // Mensagem de outra conversa: atualiza prévia e contador na lista lateral
+    function updateSidebar(conversa, mensagem) {
+      const item = document.querySelector(`.conversation-item[data-conversa="${conversa}"]`);
+      if(!item) return;
+      const preview = item.querySelector('.last-message');
+      if(preview) preview.textContent = mensagem.mensagem;
+      if(String(mensagem.remetente_id) !== chatBox.dataset.usuarioId) {
+        let badge = item.querySelector('.unread-badge');
+        if(!badge) {
+          badge = document.createElement('span');
+          badge.className = 'unread-badge';
+          badge.textContent = '0';
+          item.querySelector('.conversation-info').after(badge);
+        }
+        badge.textContent = String(parseInt(badge.textContent, 10) + 1);
+      }
+      // Mais recente vai para o topo, como na ordem do servidor
+      item.parentNode.prepend(item);
+    }
+
+    async function pollNewMessages() {
+      wantPolling = true;
+      if(pollRunning) return;
+      pollRunning = true;
+      while(wantPolling) {
+        try {
+          const url = chatBox.dataset.novasUrl + '?espera=25&depois=' + encodeURIComponent(lastCursor);
+          const resp = await fetch(url);
+          if(!resp.ok) { await sleep(5000); continue; }
+          const data = await resp.json();
+          receiveMessages(data.mensagens);
+        } catch (err) {
+          console.error(err);
+          await sleep(5000);
+        }
+      }
+      pollRunning = false;
+    }
+
+    function connectWebSocket() {
+      const protocolo = location.protocol === 'https:' ? 'wss://' : 'ws://';
+      let socket;
+      try {
+        socket = new WebSocket(protocolo + location.host + '/ws/chat/');
+      } catch (err) {
+        pollNewMessages();
+        return;
+      }
+      socket.addEventListener('open', () => {
+        // Com o WebSocket aberto o long-polling para depois da requisição atual
+        wantPolling = false;
+      });
+      socket.addEventListener('message', ev => {
+        const data = JSON.parse(ev.data);
+        if(data.conversa === chatBox.dataset.conversa) receiveMessages([data.mensagem]);
+        else updateSidebar(data.conversa, data.mensagem);
+      });
+      socket.addEventListener('close', () => {
+        // Caiu ou nunca abriu: long-polling cobre o intervalo e tentamos de novo
+        pollNewMessages();
+        setTimeout(connectWebSocket, 15000);
+      });
+    }
+
+    if(chatBox && chatBox.dataset.novasUrl) {
+      chatBox.scrollTop = chatBox.scrollHeight;
+      if('WebSocket' in window) connectWebSocket();
+      else pollNewMessages();
+    }
+
     const textarea = document.getElementById('message-textarea');
     if(textarea){
       const adjust = () => {
@@ -240,6 +431,82 @@ document.addEventListener('DOMContentLoaded', function () {
       adjust();
     }
 
+    // === BUSCA (conversas pelo nome e mensagens pelo texto) ===
+    const searchInput = document.getElementById('chat-search');
+    const searchResults = document.getElementById('search-results');
+    let searchTimer = null;
+    let searchSeq = 0;
+
+    function buildSearchResult(r) {
+      const a = document.createElement('a');
+      a.className = 'search-result';
+      a.href = r.url;
+      const titulo = document.createElement('span');
+      titulo.className = 'name';
+      titulo.textContent = r.conversa;
+      const trecho = document.createElement('span');
+      trecho.className = 'last-message';
+      // O trecho vem escapado do servidor; só os <mark> são HTML
+      trecho.innerHTML = r.trecho;
+      const quem = document.createElement('small');
+      quem.textContent = r.remetente_nome + ' · ' + new Date(r.hora).toLocaleString();
+      a.append(titulo, trecho, quem);
+      return a;
+    }
+
+    async function searchMessages(termo, pagina) {
+      const seq = ++searchSeq;
+      const url = searchResults.dataset.url + '?q=' + encodeURIComponent(termo) + '&pagina=' + pagina;
+      try {
+        const resp = await fetch(url);
+        if(!resp.ok) throw new Error(await resp.text());
+        const data = await resp.json();
+        if(seq !== searchSeq) return; // chegou depois de uma busca mais nova
+        if(pagina === 1) searchResults.innerHTML = '';
+        const mais = searchResults.querySelector('.load-older');
+        if(mais) mais.remove();
+        if(pagina === 1 && !data.resultados.length) {
+          const vazio = document.createElement('p');
+          vazio.className = 'no-conversations';
+          vazio.textContent = 'Nenhuma mensagem encontrada.';
+          searchResults.appendChild(vazio);
+        }
+        data.resultados.forEach(r => searchResults.appendChild(buildSearchResult(r)));
+        if(data.proxima) {
+          const btn = document.createElement('button');
+          btn.type = 'button';
+          btn.className = 'load-older';
+          btn.textContent = 'Mais resultados';
+          btn.addEventListener('click', () => { btn.disabled = true; searchMessages(termo, data.proxima); });
+          searchResults.appendChild(btn);
+        }
+        show(searchResults);
+      } catch (err) {
+        console.error(err);
+      }
+    }
+
+    if(searchInput && convList) {
+      searchInput.addEventListener('input', () => {
+        const termo = searchInput.value.trim();
+        const filtro = termo.toLowerCase();
+        convList.querySelectorAll('.conversation-item').forEach(item => {
+          const nome = item.querySelector('.name').textContent.toLowerCase();
+          item.classList.toggle('hidden', !!filtro && !nome.includes(filtro));
+        });
+
+        if(!searchResults) return;
+        clearTimeout(searchTimer);
+        if(termo.length < 2) {
+          searchSeq++;
+          searchResults.innerHTML = '';
+          hide(searchResults);
+          return;
+        }
+        searchTimer = setTimeout(() => searchMessages(termo, 1), 300);
+      });
+    }
+
     // ==========================================
     // PARTE 2: LÓGICA DA NAVBAR (CORRIGIDA)
     // ==========================================
@@ -156,6 +156,8 @@ document.addEventListener("DOMContentLoaded", () => {
             const corEl = document.getElementById("novaCor");
             const nome = nomeEl ? nomeEl.value.trim() : "";
             const cor = corEl ? corEl.value : "#ffffff";
+            const esporteEl = document.getElementById("novoEsporte");
+            const esporte = esporteEl ? esporteEl.value.trim() : "";
 
             if (!nome) { alert("Dê um nome à comunidade!"); return; }
 
@@ -171,7 +173,7 @@ document.addEventListener("DOMContentLoaded", () => {
                         "Content-Type": "application/json",
                         "X-CSRFToken": csrftoken
                     },
-                    body: JSON.stringify({ nome, cor })
+                    body: JSON.stringify({ nome, cor, esporte })
                 });
                 const data = await response.json();
                 if (data.status === "ok") location.reload();
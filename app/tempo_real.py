@@ -0,0 +1,240 @@
+"""
+Entrega do chat em tempo real por WebSocket, servida pelo config/asgi.py.
+
+Quem conecta em /ws/chat/ (com a sessão do site) assina o próprio canal
+("u<id>", mensagens diretas) e o de cada grupo de que participa
+("g<id>"). Cada mensagem gravada é publicada depois do commit
+(app/conversas.py) e chega como um JSON:
+    {"conversa": "u3-7" | "g5", "mensagem": {...}}
+
+O pub/sub é plugável por CHAT_PUBSUB (settings): a classe só precisa de
+publicar(canal, dados) e assinar(canais). PubSubMemoria entrega dentro do
+próprio processo, o que serve para um único nó e para testes; com vários
+processos troque por um backend compartilhado (Redis etc.). Sem WebSocket o
+chat continua funcionando pelo long-polling (chat/u/<id>/novas/).
+
+Quem entra ou sai de um grupo recebe no próprio canal o aviso GRUPOS_MUDARAM
+(app/signals.py); a conexão então relê os grupos e troca a assinatura, sem
+repassar o aviso ao navegador.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.db import transaction
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from .models import Grupo
+
+ROTA_CHAT = "/ws/chat/"
+GRUPOS_MUDARAM = {"controle": "grupos"}
+
+
+# ======== Pub/sub ========
+
+class PubSub:
+    """Interface do pub/sub do chat."""
+
+    def publicar(self, canal, dados):
+        """Entrega `dados` (serializável em JSON) a quem assina `canal`. Pode ser chamado de qualquer thread."""
+        raise NotImplementedError
+
+    def assinar(self, canais):
+        """Retorna uma Assinatura: iterável assíncrono dos dados publicados, com fechar()."""
+        raise NotImplementedError
+
+
+class Assinatura:
+    """Fila de entrega de uma conexão, presa ao event loop de quem assinou."""
+
+    def __init__(self, canais, tamanho_maximo=1000):
+        self.canais = tuple(canais)
+        self._loop = asyncio.get_running_loop()
+        self._fila = asyncio.Queue(maxsize=tamanho_maximo)
+        self._ao_fechar = None
+
+    def entregar(self, dados):
+        # Chamado da thread de quem publicou
+        self._loop.call_soon_threadsafe(self._colocar, dados)
+
+    def _colocar(self, dados):
+        if self._fila.full():
+            # Cliente lento: descarta a mais antiga (o long-polling recupera)
+            self._fila.get_nowait()
+        self._fila.put_nowait(dados)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._fila.get()
+
+    def pendentes(self):
+        """Tira da fila, sem esperar, o que já foi entregue e não foi lido."""
+        dados = []
+        while not self._fila.empty():
+            dados.append(self._fila.get_nowait())
+        return dados
+
+    def fechar(self):
+        if self._ao_fechar is not None:
+            self._ao_fechar(self)
+            self._ao_fechar = None
+
+
+class PubSubMemoria(PubSub):
+    """Pub/sub dentro do processo (um nó só, testes)."""
+
+    def __init__(self):
+        self._assinaturas = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publicar(self, canal, dados):
+        with self._lock:
+            alvos = list(self._assinaturas.get(canal, ()))
+        for assinatura in alvos:
+            assinatura.entregar(dados)
+
+    def assinar(self, canais):
+        assinatura = Assinatura(canais)
+        with self._lock:
+            for canal in assinatura.canais:
+                self._assinaturas[canal].add(assinatura)
+        assinatura._ao_fechar = self._cancelar
+        return assinatura
+
+    def _cancelar(self, assinatura):
+        with self._lock:
+            for canal in assinatura.canais:
+                inscritos = self._assinaturas.get(canal)
+                if inscritos is not None:
+                    inscritos.discard(assinatura)
+                    if not inscritos:
+                        del self._assinaturas[canal]
+
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+def get_pubsub():
+    global _pubsub
+    with _pubsub_lock:
+        if _pubsub is None:
+            caminho = getattr(settings, "CHAT_PUBSUB", "app.tempo_real.PubSubMemoria")
+            _pubsub = import_string(caminho)()
+    return _pubsub
+
+
+def canal_usuario(usuario_id):
+    return f"u{usuario_id}"
+
+
+def canal_grupo(grupo_id):
+    return f"g{grupo_id}"
+
+
+def avisar_grupos_mudaram(usuario_ids):
+    """Depois do commit, avisa as conexões destes usuários para reler os grupos."""
+    def publicar():
+        pubsub = get_pubsub()
+        for usuario_id in usuario_ids:
+            pubsub.publicar(canal_usuario(usuario_id), GRUPOS_MUDARAM)
+
+    transaction.on_commit(publicar)
+
+
+# ======== WebSocket (ASGI) ========
+
+def _cabecalhos(scope):
+    return {nome.decode("latin-1"): valor.decode("latin-1") for nome, valor in scope.get("headers", [])}
+
+
+def _origem_permitida(cabecalhos):
+    """Bloqueia conexões abertas por outros sites com o cookie do usuário."""
+    origem = cabecalhos.get("origin")
+    if not origem:
+        return True
+    # Mesma regra do CSRF: o próprio host ou uma origem de CSRF_TRUSTED_ORIGINS
+    if urlsplit(origem).netloc == cabecalhos.get("host"):
+        return True
+    return origem in getattr(settings, "CSRF_TRUSTED_ORIGINS", [])
+
+
+async def usuario_da_conexao(scope):
+    """Usuário logado da sessão enviada no cookie, ou None."""
+    cookies = SimpleCookie(_cabecalhos(scope).get("cookie", ""))
+    chave = cookies.get(settings.SESSION_COOKIE_NAME)
+    if chave is None:
+        return None
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(chave.value)
+    usuario = await aget_user(request)
+    return usuario if usuario.is_authenticated else None
+
+
+async def _assinar(usuario):
+    """Assina o canal do usuário e o de cada grupo de que ele participa agora."""
+    grupos = [
+        grupo_id async for grupo_id in
+        Grupo.objects.filter(membros=usuario).values_list("id_grupo", flat=True)
+    ]
+    return get_pubsub().assinar(
+        [canal_usuario(usuario.id_usuario)] + [canal_grupo(g) for g in grupos]
+    )
+
+
+async def chat_websocket(scope, receive, send):
+    """Aplicação ASGI de /ws/chat/."""
+    evento = await receive()
+    if evento["type"] != "websocket.connect":
+        return
+
+    usuario = None
+    if _origem_permitida(_cabecalhos(scope)):
+        usuario = await usuario_da_conexao(scope)
+    if usuario is None:
+        await send({"type": "websocket.close", "code": 4403})
+        return
+
+    assinatura = await _assinar(usuario)
+    await send({"type": "websocket.accept"})
+
+    async def entregar():
+        nonlocal assinatura
+        while True:
+            async for dados in assinatura:
+                if dados == GRUPOS_MUDARAM:
+                    break
+                await send({"type": "websocket.send", "text": json.dumps(dados)})
+            # Entrou ou saiu de um grupo. A nova assinatura vem antes de fechar
+            # a antiga: no intervalo uma mensagem pode chegar pelas duas (o
+            # navegador ignora ids repetidos), mas nenhuma se perde.
+            nova = await _assinar(usuario)
+            assinatura.fechar()
+            restantes, assinatura = assinatura.pendentes(), nova
+            for dados in restantes:
+                if dados != GRUPOS_MUDARAM:
+                    await send({"type": "websocket.send", "text": json.dumps(dados)})
+
+    async def ouvir():
+        # O cliente não manda nada além do handshake; só esperamos ele sair
+        while (await receive())["type"] != "websocket.disconnect":
+            pass
+
+    tarefas = [asyncio.ensure_future(entregar()), asyncio.ensure_future(ouvir())]
+    try:
+        await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        assinatura.fechar()
+        for tarefa in tarefas:
+            tarefa.cancel()
+        # Conexão caiu no meio de um send: não há o que fazer além de sair
+        await asyncio.gather(*tarefas, return_exceptions=True)
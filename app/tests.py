@@ -1,3 +1,1449 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import math
+import shutil
+import tempfile
+import threading
+import time
+from asgiref.sync import sync_to_async
+from concurrent.futures import TimeoutError as FuturoTimeoutError
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from app import (
+    agendador,
+    compatibilidade,
+    conversas,
+    esportes,
+    geo,
+    ingestao,
+    parceiros,
+    particoes,
+    ranking,
+    recomendacoes,
+    tempo_real,
+    views,
+)
+from app.agendador import AgendadorRanking
+from app.ingestao import IngestaoMensagens
+from app.models import (
+    ArquivoMensagens,
+    Comunidade,
+    Conclusao,
+    Desafio,
+    Esporte,
+    EsporteUsuario,
+    EstadoRecomendacoes,
+    Grupo,
+    HistoricoRanking,
+    LeituraGrupo,
+    Mensagem,
+    MensagemGrupo,
+    MetaComunidade,
+    MetaCumprida,
+    Parceiro,
+    Preferencia,
+    Ranking,
+    RankingPeriodo,
+    Recomendacao,
+    ResumoConversa,
+    SinonimoEsporte,
+    Usuario,
+    chave_conversa,
+)
+
+
+@override_settings(
+    RANKING_RECALCULO="sincrono",
+    RANKING_REGRAS=[("app.ranking.PontosPorMeta", {"pontos": 10})],
+)
+class RankingIncrementalTests(TestCase):
+    """O caminho incremental (signals + agendador) chega no mesmo placar que a reconstrução completa."""
+
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.caio = Usuario.objects.create_user(nome="caio")
+        self.ids = [self.ana.pk, self.bia.pk, self.caio.pk]
+        comunidade = Comunidade.objects.create(nome="Corredores", esporte="corrida", admin=self.ana)
+        self.meta1 = MetaComunidade.objects.create(comunidade=comunidade, titulo="5 km")
+        self.meta2 = MetaComunidade.objects.create(comunidade=comunidade, titulo="10 km")
+
+    def mudar(self, acao):
+        # O recálculo roda no on_commit, como numa requisição de verdade
+        with self.captureOnCommitCallbacks(execute=True):
+            acao()
+
+    def placar(self):
+        # Sem linha e linha com 0 pontos dão no mesmo (a reconstrução grava o 0 no global)
+        return {linha: pontos for linha, pontos in ranking.quadros_gravados(self.ids).items() if pontos}
+
+    def conferir_com_reconstrucao(self):
+        incremental = self.placar()
+        ranking.recalcular_ranking_completo()
+        self.assertEqual(incremental, self.placar())
+        return incremental
+
+    def test_add_e_remove(self):
+        self.mudar(lambda: self.meta1.usuarios_cumpriram.add(self.ana, self.bia))
+        self.mudar(lambda: self.meta2.usuarios_cumpriram.add(self.ana))
+        placar = self.conferir_com_reconstrucao()
+        self.assertEqual(placar[("global", "", self.ana.pk)], 20)
+        self.assertEqual(placar[("esporte", "corrida", self.bia.pk)], 10)
+
+        self.mudar(lambda: self.meta1.usuarios_cumpriram.remove(self.ana))
+        placar = self.conferir_com_reconstrucao()
+        self.assertEqual(placar[("global", "", self.ana.pk)], 10)
+
+    def test_clear_usa_quem_estava_na_meta(self):
+        self.mudar(lambda: self.meta1.usuarios_cumpriram.add(self.ana, self.bia))
+        # Depois do clear só o pre_clear sabe quem perdeu a meta
+        self.mudar(self.meta1.usuarios_cumpriram.clear)
+        placar = self.conferir_com_reconstrucao()
+        self.assertEqual(placar, {})
+
+    def test_lado_reverso(self):
+        self.mudar(lambda: self.caio.metacomunidade_set.add(self.meta1, self.meta2))
+        placar = self.conferir_com_reconstrucao()
+        self.assertEqual(placar[("global", "", self.caio.pk)], 20)
+
+        self.mudar(lambda: self.caio.metacomunidade_set.remove(self.meta1))
+        self.assertEqual(self.conferir_com_reconstrucao()[("global", "", self.caio.pk)], 10)
+
+        self.mudar(self.caio.metacomunidade_set.clear)
+        self.assertEqual(self.conferir_com_reconstrucao(), {})
+
+    def test_meta_apagada(self):
+        self.mudar(lambda: self.meta1.usuarios_cumpriram.add(self.ana, self.bia))
+        self.mudar(lambda: self.meta2.usuarios_cumpriram.add(self.bia))
+        # O delete em cascata do M2M não dispara m2m_changed
+        self.mudar(self.meta1.delete)
+        placar = self.conferir_com_reconstrucao()
+        self.assertNotIn(("global", "", self.ana.pk), placar)
+        self.assertEqual(placar[("global", "", self.bia.pk)], 10)
+
+
+@override_settings(
+    RANKING_RECALCULO="sincrono",
+    RANKING_REGRAS=[("app.ranking.PontosPorMeta", {"pontos": 10})],
+)
+class ReconstruirRankingTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.ids = [self.ana.pk, self.bia.pk]
+        comunidade = Comunidade.objects.create(nome="Corredores", esporte="corrida", admin=self.ana)
+        meta = MetaComunidade.objects.create(comunidade=comunidade, titulo="5 km")
+        # Sem executar o on_commit: o placar gravado fica para trás
+        meta.usuarios_cumpriram.add(self.ana)
+
+    def reconstruir(self, *args):
+        saida = StringIO()
+        call_command("reconstruir_ranking", *args, stdout=saida)
+        return saida.getvalue()
+
+    def test_dry_run_mostra_sem_gravar(self):
+        saida = self.reconstruir("--dry-run")
+        self.assertIn(f"[global] usuario {self.ana.pk}: - -> 10", saida)
+        self.assertIn(f"[esporte corrida] usuario {self.ana.pk}: - -> 10", saida)
+        self.assertIn("linhas de placar a alterar", saida)
+        self.assertEqual(ranking.quadros_gravados(self.ids), {})
+
+    def test_upsert_insere_corrige_e_apaga(self):
+        self.reconstruir()
+        self.assertEqual(ranking.diferencas(self.ids), {})
+        self.assertEqual(Ranking.objects.get(usuario=self.ana, esporte_prat="").pontuacao_total, 10)
+
+        # Linha existente com valor errado e linha que não deveria existir
+        Ranking.objects.filter(usuario=self.ana, esporte_prat="").update(pontuacao_total=99)
+        Ranking.objects.create(usuario=self.bia, esporte_prat="natação", pontuacao_total=5)
+        saida = self.reconstruir("--lote", "1")
+        self.assertIn("2 usuários processados, 2 linhas de placar alteradas", saida)
+        self.assertEqual(Ranking.objects.get(usuario=self.ana, esporte_prat="").pontuacao_total, 10)
+        self.assertFalse(Ranking.objects.filter(usuario=self.bia, esporte_prat="natação").exists())
+        self.assertEqual(ranking.diferencas(self.ids), {})
+
+
+class PosicaoNoRankingTests(TestCase):
+    def setUp(self):
+        self.usuarios = [Usuario.objects.create_user(nome=f"u{i}") for i in range(5)]
+        for usuario, pontos in zip(self.usuarios, [30, 20, 20, 10]):
+            Ranking.objects.create(usuario=usuario, esporte_prat="", pontuacao_total=pontos)
+
+    def posicoes(self, modo):
+        quadro = ranking.Quadro()
+        return [quadro.posicao_no_ranking(usuario.pk, modo) for usuario in self.usuarios]
+
+    def test_empates_competicao(self):
+        # O último não tem linha: 0 pontos, depois de todo mundo
+        self.assertEqual(self.posicoes("competicao"), [1, 2, 2, 4, 5])
+
+    def test_empates_denso(self):
+        self.assertEqual(self.posicoes("denso"), [1, 2, 2, 3, 4])
+
+    def test_modo_invalido(self):
+        with self.assertRaises(ValueError):
+            ranking.Quadro().posicao_no_ranking(self.usuarios[0].pk, "olimpico")
+
+
+@override_settings(
+    RANKING_RECALCULO="sincrono",
+    RANKING_REGRAS=[
+        ("app.ranking.PontosPorMeta", {"pontos": 10}),
+        ("app.ranking.PontosPorConclusao", {"pontos": 20}),
+        ("app.ranking.PontosPorEsporte", {"pontos": {"corrida": 5}}),
+    ],
+)
+class RegrasDePontuacaoTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.carla = Usuario.objects.create_user(nome="carla")
+        self.ids = [self.ana.pk, self.bia.pk, self.carla.pk]
+        self.corrida = Comunidade.objects.create(nome="Corredores", esporte="corrida", admin=self.ana)
+        natacao = Comunidade.objects.create(nome="Nadadores", esporte="natacao", admin=self.bia)
+        grupo = Grupo.objects.create(nome="Pedal")
+        hoje = datetime.date.today()
+        desafio = Desafio.objects.create(id_grupo=grupo, titulo="100 km", data_inicio=hoje, data_fim=hoje)
+        with self.captureOnCommitCallbacks(execute=True):
+            MetaComunidade.objects.create(comunidade=self.corrida, titulo="5 km").usuarios_cumpriram.add(self.ana)
+            MetaComunidade.objects.create(comunidade=natacao, titulo="1 km").usuarios_cumpriram.add(self.bia)
+            Conclusao.objects.create(id_desafio=desafio, id_usuario=self.ana)
+
+    def test_carregar_regras(self):
+        regras = ranking.carregar_regras()
+        self.assertEqual(
+            [type(regra) for regra in regras],
+            [ranking.PontosPorMeta, ranking.PontosPorConclusao, ranking.PontosPorEsporte],
+        )
+        self.assertEqual(regras[2].pontos, {"corrida": 5})
+        with self.settings(RANKING_REGRAS=None):
+            regras = ranking.carregar_regras()
+        self.assertEqual([type(regra) for regra in regras], [ranking.PontosPorMeta])
+        self.assertEqual(regras[0].pontos, ranking.PONTOS_POR_META)
+
+    def test_regras_somadas(self):
+        # ana: meta (10) + bônus de corrida (5) + conclusão (20); carla: 0
+        self.assertEqual(
+            ranking.calcular_pontuacoes(self.ids),
+            {self.ana.pk: 35, self.bia.pk: 10, self.carla.pk: 0},
+        )
+        self.assertEqual(ranking.Quadro().pontos_do_usuario(self.ana.pk), 35)
+
+    def test_conclusao_nao_entra_no_placar_de_esporte_e_comunidade(self):
+        self.assertEqual(
+            ranking.calcular_pontuacoes(self.ids, "esporte"),
+            {(self.ana.pk, "corrida"): 15, (self.bia.pk, "natacao"): 10},
+        )
+        self.assertEqual(ranking.Quadro(esporte="corrida").pontos_do_usuario(self.ana.pk), 15)
+        self.assertEqual(
+            ranking.Quadro(comunidade_id=self.corrida.pk).pontos_do_usuario(self.ana.pk), 15
+        )
+        # Nos períodos a conclusão conta, pela data_conclusao
+        semana = ranking.inicio_periodo("semana")
+        self.assertEqual(ranking.calcular_pontuacoes(self.ids, "semana")[(self.ana.pk, semana)], 35)
+
+
+@override_settings(
+    RANKING_RECALCULO="sincrono",
+    RANKING_REGRAS=[("app.ranking.PontosPorMeta", {"pontos": 10})],
+)
+class PlacaresPorComunidadeEEsporteTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.corrida = Comunidade.objects.create(nome="Corredores", esporte="corrida", admin=self.ana)
+        self.natacao = Comunidade.objects.create(nome="Nadadores", esporte="natacao", admin=self.bia)
+        self.trilha = Comunidade.objects.create(nome="Trilheiros", esporte="corrida", admin=self.ana)
+        with self.captureOnCommitCallbacks(execute=True):
+            MetaComunidade.objects.create(comunidade=self.corrida, titulo="5 km").usuarios_cumpriram.add(self.ana)
+            MetaComunidade.objects.create(comunidade=self.natacao, titulo="1 km").usuarios_cumpriram.add(self.bia)
+            MetaComunidade.objects.create(comunidade=self.trilha, titulo="Serra").usuarios_cumpriram.add(self.ana)
+
+    def linhas(self, quadro):
+        return [(linha.usuario_id, linha.pontuacao_total) for linha in quadro.placar()]
+
+    def test_placares_separados(self):
+        self.assertEqual(self.linhas(ranking.Quadro()), [(self.ana.pk, 20), (self.bia.pk, 10)])
+        self.assertEqual(self.linhas(ranking.Quadro(esporte="corrida")), [(self.ana.pk, 20)])
+        self.assertEqual(self.linhas(ranking.Quadro(esporte="natacao")), [(self.bia.pk, 10)])
+        self.assertEqual(self.linhas(ranking.Quadro(comunidade_id=self.corrida.pk)), [(self.ana.pk, 10)])
+        self.assertEqual(self.linhas(ranking.Quadro(comunidade_id=self.natacao.pk)), [(self.bia.pk, 10)])
+
+    def test_mudar_esporte_da_comunidade_move_os_pontos(self):
+        self.natacao.esporte = "corrida"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.natacao.save()
+        self.assertEqual(
+            self.linhas(ranking.Quadro(esporte="corrida")), [(self.ana.pk, 20), (self.bia.pk, 10)]
+        )
+        self.assertEqual(self.linhas(ranking.Quadro(esporte="natacao")), [])
+        self.assertEqual(self.linhas(ranking.Quadro(comunidade_id=self.natacao.pk)), [(self.bia.pk, 10)])
+
+
+@override_settings(
+    RANKING_RECALCULO="sincrono",
+    RANKING_REGRAS=[("app.ranking.PontosPorMeta", {"pontos": 10})],
+    RANKING_PERIODOS_RETIDOS={"semana": 2, "mes": 2},
+)
+class PlacaresPorPeriodoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.comunidade = Comunidade.objects.create(nome="Corredores", esporte="corrida", admin=self.ana)
+        self.agora = timezone.now()
+
+    def cumprir(self, dias_atras):
+        meta = MetaComunidade.objects.create(comunidade=self.comunidade, titulo=f"meta {dias_atras}")
+        cumprida_em = None if dias_atras is None else self.agora - datetime.timedelta(days=dias_atras)
+        MetaCumprida.objects.create(metacomunidade=meta, usuario=self.ana, cumprida_em=cumprida_em)
+        return cumprida_em
+
+    def inicio(self, periodo, cumprida_em):
+        return ranking.inicio_periodo(periodo, timezone.localdate(cumprida_em))
+
+    def contadores(self, periodo):
+        return dict(
+            RankingPeriodo.objects
+            .filter(periodo=periodo, usuario=self.ana)
+            .values_list("inicio", "pontuacao_total")
+        )
+
+    def test_inicio_periodo_e_retencao(self):
+        quarta = datetime.date(2024, 5, 15)
+        self.assertEqual(ranking.inicio_periodo("semana", quarta), datetime.date(2024, 5, 13))
+        self.assertEqual(ranking.inicio_periodo("mes", quarta), datetime.date(2024, 5, 1))
+        hoje = timezone.localdate()
+        semana = ranking.inicio_periodo("semana", hoje)
+        self.assertEqual(ranking.inicio_retencao("semana"), semana - datetime.timedelta(weeks=1))
+        mes_passado = ranking.inicio_periodo("mes", ranking.inicio_periodo("mes", hoje) - datetime.timedelta(days=1))
+        self.assertEqual(ranking.inicio_retencao("mes"), mes_passado)
+
+    def test_um_contador_por_periodo_retido(self):
+        datas = [self.cumprir(dias) for dias in (0, 7, 21)]
+        self.cumprir(100)   # fora da retenção de semanas e de meses
+        self.cumprir(None)  # sem horário: só no placar geral
+        ranking.atualizar_pontuacao([self.ana.pk])
+
+        self.assertEqual(ranking.Quadro().pontos_do_usuario(self.ana.pk), 50)
+        self.assertEqual(
+            self.contadores("semana"),
+            {self.inicio("semana", datas[0]): 10, self.inicio("semana", datas[1]): 10},
+        )
+        meses = {}
+        for data in datas:
+            inicio = self.inicio("mes", data)
+            meses[inicio] = meses.get(inicio, 0) + 10
+        self.assertEqual(self.contadores("mes"), meses)
+        self.assertEqual(ranking.Quadro(periodo="semana").pontos_do_usuario(self.ana.pk), 10)
+
+    def test_compactar_apaga_periodos_fora_da_retencao(self):
+        antiga = ranking.inicio_retencao("semana") - datetime.timedelta(weeks=1)
+        RankingPeriodo.objects.create(periodo="semana", inicio=antiga, usuario=self.ana, pontuacao_total=30)
+        RankingPeriodo.objects.create(
+            periodo="mes", inicio=datetime.date(2000, 1, 1), usuario=self.ana, pontuacao_total=30
+        )
+        self.assertEqual(ranking.compactar_periodos(), 2)
+        self.assertEqual(self.contadores("semana"), {})
+        self.assertEqual(self.contadores("mes"), {})
+
+    def test_primeira_gravacao_do_periodo_compacta(self):
+        # O contador antigo é de outro usuário, que não entra no recálculo
+        bia = Usuario.objects.create_user(nome="bia")
+        antiga = ranking.inicio_retencao("semana") - datetime.timedelta(weeks=1)
+        antigas = RankingPeriodo.objects.filter(usuario=bia)
+        RankingPeriodo.objects.create(periodo="semana", inicio=antiga, usuario=bia, pontuacao_total=30)
+        self.cumprir(0)
+        ranking.atualizar_pontuacao([self.ana.pk])
+        self.assertFalse(antigas.exists())
+
+        # Nas gravações seguintes do mesmo período a compactação não roda de novo
+        RankingPeriodo.objects.create(periodo="semana", inicio=antiga, usuario=bia, pontuacao_total=30)
+        self.cumprir(1)
+        ranking.atualizar_pontuacao([self.ana.pk])
+        self.assertTrue(antigas.exists())
+
+
+class AgendadorRankingTests(SimpleTestCase):
+    def setUp(self):
+        self.chamadas = []
+        self.recalculou = threading.Event()
+
+        def atualizar(ids):
+            self.chamadas.append(list(ids))
+            self.recalculou.set()
+
+        patcher = mock.patch("app.ranking.atualizar_pontuacao", side_effect=atualizar)
+        self.atualizar = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marcacoes_na_mesma_janela_viram_um_recalculo(self):
+        agendador_ = AgendadorRanking(intervalo=0.2)
+        agendador_.marcar({3, 1})
+        agendador_.marcar({1})
+        agendador_.marcar({2, 3})
+        self.assertTrue(self.recalculou.wait(5))
+        self.assertEqual(self.chamadas, [[1, 2, 3]])
+        self.assertEqual(agendador_.processar(), 0)
+
+    def test_processa_em_lotes(self):
+        agendador_ = AgendadorRanking(tamanho_lote=2)
+        agendador_._pendentes.update({5, 4, 3, 2, 1})
+        self.assertEqual(agendador_.processar(), 5)
+        self.assertEqual(self.chamadas, [[1, 2], [3, 4], [5]])
+
+    def test_falha_devolve_os_pendentes(self):
+        agendador_ = AgendadorRanking()
+        agendador_._pendentes.update({1, 2})
+        self.atualizar.side_effect = RuntimeError("banco fora do ar")
+        with self.assertLogs("app.agendador", "ERROR"), self.assertRaises(RuntimeError):
+            agendador_.processar()
+        self.assertEqual(agendador_._pendentes, {1, 2})
+
+        self.atualizar.side_effect = lambda ids: self.chamadas.append(list(ids))
+        self.assertEqual(agendador_.processar(), 2)
+        self.assertEqual(self.chamadas, [[1, 2]])
+
+
+class AgendarRecalculoTests(TestCase):
+    @override_settings(RANKING_RECALCULO="thread")
+    def test_marca_no_agendador_depois_do_commit(self):
+        with mock.patch("app.agendador.get_agendador") as get_agendador:
+            with self.captureOnCommitCallbacks(execute=True):
+                agendador.agendar_recalculo([1, 2, 2])
+                get_agendador.return_value.marcar.assert_not_called()
+            get_agendador.return_value.marcar.assert_called_once_with({1, 2})
+
+            with self.captureOnCommitCallbacks() as callbacks:
+                agendador.agendar_recalculo([])
+            self.assertEqual(callbacks, [])
+
+    @override_settings(RANKING_RECALCULO="sincrono")
+    def test_sincrono_recalcula_no_commit(self):
+        with mock.patch("app.ranking.atualizar_pontuacao") as atualizar:
+            with self.captureOnCommitCallbacks(execute=True):
+                agendador.agendar_recalculo([1])
+            atualizar.assert_called_once_with({1})
+
+
+@override_settings(RANKING_HISTORICO_DIAS=3)
+class HistoricoRankingTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.caio = Usuario.objects.create_user(nome="caio")
+        self.dia = datetime.date(2024, 5, 1)
+        self.pontuar(ana=30, bia=20, caio=20)
+
+    def pontuar(self, **pontos):
+        for nome, total in pontos.items():
+            Ranking.objects.update_or_create(
+                usuario=getattr(self, nome), esporte_prat="", defaults={"pontuacao_total": total}
+            )
+
+    def foto(self, dias_depois, lote=1000):
+        return ranking.registrar_historico(self.dia + datetime.timedelta(days=dias_depois), lote)
+
+    def dias(self, *deslocamentos):
+        return [self.dia + datetime.timedelta(days=d) for d in deslocamentos]
+
+    def test_uma_linha_por_usuario_com_as_listas_do_dia(self):
+        self.assertEqual(self.foto(0, lote=2), 3)
+        self.pontuar(bia=40)
+        self.foto(2)  # sem foto no dia 1
+
+        self.assertEqual(HistoricoRanking.objects.count(), 3)
+        historico = HistoricoRanking.objects.get(usuario=self.bia)
+        self.assertEqual(historico.inicio, self.dia)
+        self.assertEqual(historico.posicoes, [2, None, 1])
+        self.assertEqual(historico.pontos, [20, None, 40])
+        d0, _, d2 = self.dias(0, 1, 2)
+        self.assertEqual(ranking.serie_do_usuario(self.bia.pk), [(d0, 2, 20), (d2, 1, 40)])
+        self.assertEqual(ranking.serie_do_usuario(self.bia.pk, dias=1), [(d2, 1, 40)])
+        self.assertEqual(
+            ranking.variacoes_de_posicao([self.ana.pk, self.bia.pk, self.caio.pk]),
+            {self.ana.pk: -1, self.bia.pk: 1, self.caio.pk: -1},
+        )
+
+    def test_mesmo_dia_sobrescreve_a_foto(self):
+        self.foto(0)
+        self.pontuar(caio=50)
+        self.foto(0)
+        historico = HistoricoRanking.objects.get(usuario=self.caio)
+        self.assertEqual((historico.posicoes, historico.pontos), ([1], [50]))
+        self.assertIsNone(ranking.variacoes_de_posicao([self.caio.pk])[self.caio.pk])
+
+    def test_foto_de_dia_anterior_abre_espaco_no_comeco(self):
+        self.foto(1)
+        self.foto(0)
+        historico = HistoricoRanking.objects.get(usuario=self.ana)
+        self.assertEqual((historico.inicio, historico.posicoes), (self.dia, [1, 1]))
+
+    def test_retencao_corta_as_listas_e_apaga_quem_saiu(self):
+        for dia in range(3):
+            self.foto(dia)
+        Ranking.objects.filter(usuario=self.caio).delete()
+        self.foto(4)
+
+        historico = HistoricoRanking.objects.get(usuario=self.ana)
+        self.assertEqual(historico.inicio, self.dias(2)[0])
+        self.assertEqual(historico.posicoes, [1, None, 1])
+        # A série do caio parou no dia 2 e começa antes da retenção
+        self.assertFalse(HistoricoRanking.objects.filter(usuario=self.caio).exists())
+
+    def test_comando(self):
+        saida = StringIO()
+        call_command("registrar_historico_ranking", "--dia", "2024-05-01", stdout=saida)
+        self.assertIn("Histórico de 3 usuários registrado", saida.getvalue())
+        self.assertEqual(ranking.serie_do_usuario(self.ana.pk), [(self.dia, 1, 30)])
+
+
+class PaginaDoRankingTests(TestCase):
+    PONTOS = [50, 40, 40, 40, 30, 20, 10]
+
+    def setUp(self):
+        self.usuarios = [Usuario.objects.create_user(nome=f"u{i}") for i in range(len(self.PONTOS))]
+        for usuario, pontos in zip(self.usuarios, self.PONTOS):
+            Ranking.objects.create(usuario=usuario, esporte_prat="", pontuacao_total=pontos)
+        self.quadro = ranking.Quadro()
+
+    def resumo(self, itens):
+        return [(item["usuario"].pk, item["posicao"]) for item in itens]
+
+    def test_paginas_por_cursor(self):
+        u = [usuario.pk for usuario in self.usuarios]
+        primeira = self.quadro.pagina(tamanho=3)
+        self.assertEqual(self.resumo(primeira["itens"]), [(u[0], 1), (u[1], 2), (u[2], 2)])
+        self.assertIsNone(primeira["anterior"])
+
+        # Os empatados com 40 continuam na posição 2 na página seguinte
+        segunda = self.quadro.pagina(ranking.decodificar_cursor(primeira["proximo"]), tamanho=3)
+        self.assertEqual(self.resumo(segunda["itens"]), [(u[3], 2), (u[4], 5), (u[5], 6)])
+
+        terceira = self.quadro.pagina(ranking.decodificar_cursor(segunda["proximo"]), tamanho=3)
+        self.assertEqual(self.resumo(terceira["itens"]), [(u[6], 7)])
+        self.assertIsNone(terceira["proximo"])
+
+        volta = self.quadro.pagina(
+            ranking.decodificar_cursor(terceira["anterior"]), tamanho=3, anterior=True
+        )
+        self.assertEqual(volta["itens"], segunda["itens"])
+
+    def test_ao_redor(self):
+        u = [usuario.pk for usuario in self.usuarios]
+        janela = self.quadro.ao_redor(u[3], quantidade=2)
+        self.assertEqual(self.resumo(janela["acima"]), [(u[1], 2), (u[2], 2)])
+        self.assertEqual(self.resumo([janela["usuario"]]), [(u[3], 2)])
+        self.assertEqual(self.resumo(janela["abaixo"]), [(u[4], 5), (u[5], 6)])
+
+    def test_cursor_invalido(self):
+        with self.assertRaises(ValueError):
+            ranking.decodificar_cursor("abc_1")
+
+
+class ResumosDaConversaTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.caio = Usuario.objects.create_user(nome="caio")
+
+    def enviar(self, de, para, texto):
+        return Mensagem.objects.create(id_remetente=de, id_destinatario=para, mensagem=texto)
+
+    def resumos(self):
+        return {
+            (r.usuario_id, r.contato_id): (r.ultima_mensagem, r.id_ultima_mensagem, r.nao_lidas)
+            for r in ResumoConversa.objects.all()
+        }
+
+    def test_envio_atualiza_os_dois_lados(self):
+        self.enviar(self.ana, self.bia, "oi")
+        ultima = self.enviar(self.ana, self.bia, "x" * 300)
+        self.enviar(self.caio, self.ana, "bora correr?")
+
+        resumo = ResumoConversa.objects.get(usuario=self.bia, contato=self.ana)
+        self.assertEqual(resumo.ultima_mensagem, "x" * conversas.TAMANHO_PREVIA)
+        self.assertEqual((resumo.id_ultima_mensagem, resumo.nao_lidas), (ultima.pk, 2))
+        self.assertEqual(ResumoConversa.objects.get(usuario=self.ana, contato=self.bia).nao_lidas, 0)
+        # Lateral da ana: a conversa mais recente primeiro
+        self.assertEqual(
+            [c["nome"] for c in conversas.conversas_da_lateral(self.ana)], ["caio", "bia"]
+        )
+
+    def test_reconstruir_resumos(self):
+        self.enviar(self.ana, self.bia, "oi")
+        self.enviar(self.bia, self.ana, "oi, tudo bem?")
+        self.enviar(self.caio, self.caio, "nota para mim")
+        esperado = self.resumos()
+
+        # Um resumo apagado e outro com a prévia errada
+        ResumoConversa.objects.filter(usuario=self.ana).delete()
+        ResumoConversa.objects.filter(usuario=self.bia).update(ultima_mensagem="?", id_ultima_mensagem=None)
+        saida = StringIO()
+        call_command("reconstruir_resumos_conversa", "--lote", "1", stdout=saida)
+        self.assertIn("3 resumos de conversa gravados", saida.getvalue())
+
+        # O histórico não diz o que foi lido: o resumo recriado começa sem
+        # não lidas e os que existiam mantêm o contador
+        esperado[(self.ana.pk, self.bia.pk)] = esperado[(self.ana.pk, self.bia.pk)][:2] + (0,)
+        self.assertEqual(self.resumos(), esperado)
+        self.assertEqual(ResumoConversa.objects.get(usuario=self.bia, contato=self.ana).nao_lidas, 1)
+        self.assertEqual(ResumoConversa.objects.filter(usuario=self.caio).count(), 1)
+
+
+class HistoricoDaConversaTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        outro = Usuario.objects.create_user(nome="caio")
+        self.mensagens = []
+        for i in range(5):
+            # Os dois sentidos são a mesma conversa
+            de, para = (self.ana, self.bia) if i % 2 == 0 else (self.bia, self.ana)
+            self.mensagens.append(Mensagem.objects.create(id_remetente=de, id_destinatario=para, mensagem=f"m{i}"))
+        Mensagem.objects.create(id_remetente=self.ana, id_destinatario=outro, mensagem="outra conversa")
+
+    def textos(self, mensagens):
+        return [mensagem.mensagem for mensagem in mensagens]
+
+    def test_paginas_para_tras(self):
+        pagina, cursor = conversas.pagina_de_mensagens(self.ana.pk, self.bia.pk, tamanho=2)
+        self.assertEqual(self.textos(pagina), ["m3", "m4"])
+
+        pagina, cursor = conversas.pagina_de_mensagens(
+            self.bia.pk, self.ana.pk, conversas.decodificar_cursor(cursor), tamanho=2
+        )
+        self.assertEqual(self.textos(pagina), ["m1", "m2"])
+
+        pagina, cursor = conversas.pagina_de_mensagens(
+            self.ana.pk, self.bia.pk, conversas.decodificar_cursor(cursor), tamanho=2
+        )
+        self.assertEqual(self.textos(pagina), ["m0"])
+        self.assertIsNone(cursor)
+
+    def test_mensagens_depois_do_cursor(self):
+        depois = conversas.decodificar_cursor(conversas.codificar_cursor(self.mensagens[2]))
+        novas = conversas.mensagens_depois(self.ana.pk, self.bia.pk, depois)
+        self.assertEqual(self.textos(novas), ["m3", "m4"])
+
+    def test_cursor_invalido(self):
+        with self.assertRaises(ValueError):
+            conversas.decodificar_cursor("ontem_3")
+
+
+@override_settings(CHAT_ESPERA_INTERVALO=0.05)
+class EsperaPorMensagensTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        primeira = Mensagem.objects.create(id_remetente=self.ana, id_destinatario=self.bia, mensagem="oi")
+        self.cursor = conversas.codificar_cursor(primeira)
+        self.url = reverse("mensagens_novas", args=[self.ana.pk])
+
+    async def esperar(self, espera):
+        await self.async_client.aforce_login(self.bia)
+        return await self.async_client.get(self.url, {"depois": self.cursor, "espera": espera})
+
+    async def test_responde_vazio_quando_o_prazo_acaba(self):
+        inicio = time.monotonic()
+        resposta = await self.esperar("0.2")
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.2)
+        self.assertEqual(resposta.json(), {"mensagens": [], "cursor": self.cursor})
+
+    async def test_espera_nao_finita_nao_espera(self):
+        for espera in ("nan", "inf"):
+            inicio = time.monotonic()
+            resposta = await self.esperar(espera)
+            self.assertLess(time.monotonic() - inicio, 1)
+            self.assertEqual(resposta.json()["mensagens"], [])
+
+    async def test_mensagem_que_chega_durante_a_espera(self):
+        async def responder():
+            await asyncio.sleep(0.2)
+            await sync_to_async(Mensagem.objects.create)(
+                id_remetente=self.ana, id_destinatario=self.bia, mensagem="tudo bem?"
+            )
+
+        inicio = time.monotonic()
+        resposta, _ = await asyncio.gather(self.esperar("5"), responder())
+        self.assertLess(time.monotonic() - inicio, 5)
+        self.assertEqual([m["mensagem"] for m in resposta.json()["mensagens"]], ["tudo bem?"])
+
+
+class ChatWebSocketTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.grupo = Grupo.objects.create(nome="corrida")
+        self.grupo.membros.add(self.ana, self.bia)
+        self.outro_grupo = Grupo.objects.create(nome="natação")
+        self.outro_grupo.membros.add(self.bia)
+        self.client.force_login(self.ana)
+        self.sessao = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    async def conectar(self, cookie=None):
+        entrada, saida = asyncio.Queue(), asyncio.Queue()
+        await entrada.put({"type": "websocket.connect"})
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.sessao}" if cookie is None else cookie
+        scope = {
+            "type": "websocket",
+            "path": tempo_real.ROTA_CHAT,
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        }
+        tarefa = asyncio.ensure_future(tempo_real.chat_websocket(scope, entrada.get, saida.put))
+        self.conexao = entrada, tarefa
+        return saida, await asyncio.wait_for(saida.get(), 5)
+
+    async def desconectar(self):
+        entrada, tarefa = self.conexao
+        await entrada.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(tarefa, 5)
+
+    async def proxima(self, saida):
+        return json.loads((await asyncio.wait_for(saida.get(), 5))["text"])
+
+    async def esperar_assinatura(self, canal, assinado=True):
+        # A troca de assinatura acontece na conexão, depois do aviso
+        for _ in range(100):
+            if (canal in tempo_real.get_pubsub()._assinaturas) == assinado:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"assinatura de {canal} não mudou")
+
+    def enviar(self, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            if "id_grupo" in campos:
+                MensagemGrupo.objects.create(id_remetente=self.bia, **campos)
+            else:
+                Mensagem.objects.create(id_remetente=self.bia, id_destinatario=self.ana, **campos)
+
+    def mudar_membros(self, acao, grupo):
+        with self.captureOnCommitCallbacks(execute=True):
+            getattr(grupo.membros, acao)(self.ana)
+
+    async def test_sem_sessao_fecha(self):
+        _, evento = await self.conectar(cookie="")
+        self.assertEqual(evento, {"type": "websocket.close", "code": 4403})
+
+    async def test_entrega_mensagens_diretas_e_dos_grupos(self):
+        saida, evento = await self.conectar()
+        self.assertEqual(evento["type"], "websocket.accept")
+
+        await sync_to_async(self.enviar)(mensagem="oi")
+        direta = await self.proxima(saida)
+        self.assertEqual(direta["conversa"], f"u{self.ana.pk}-{self.bia.pk}")
+        self.assertEqual(direta["mensagem"]["mensagem"], "oi")
+
+        await sync_to_async(self.enviar)(id_grupo=self.outro_grupo, mensagem="não é para a ana")
+        await sync_to_async(self.enviar)(id_grupo=self.grupo, mensagem="treino amanhã")
+        do_grupo = await self.proxima(saida)
+        self.assertEqual(do_grupo["conversa"], f"g{self.grupo.pk}")
+        self.assertEqual(do_grupo["mensagem"]["mensagem"], "treino amanhã")
+        await self.desconectar()
+
+    async def test_acompanha_entrada_e_saida_de_grupos(self):
+        saida, _ = await self.conectar()
+
+        await sync_to_async(self.mudar_membros)("add", self.outro_grupo)
+        await self.esperar_assinatura(tempo_real.canal_grupo(self.outro_grupo.pk))
+        await sync_to_async(self.enviar)(id_grupo=self.outro_grupo, mensagem="bem-vinda")
+        self.assertEqual((await self.proxima(saida))["mensagem"]["mensagem"], "bem-vinda")
+
+        await sync_to_async(self.mudar_membros)("remove", self.grupo)
+        await self.esperar_assinatura(tempo_real.canal_grupo(self.grupo.pk), assinado=False)
+        await sync_to_async(self.enviar)(id_grupo=self.grupo, mensagem="ana saiu")
+        await sync_to_async(self.enviar)(mensagem="direta")
+        # O aviso de controle não chega ao navegador, nem o grupo de que ela saiu
+        self.assertEqual((await self.proxima(saida))["mensagem"]["mensagem"], "direta")
+        await self.desconectar()
+
+
+class NaoLidasDoGrupoTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.grupo = Grupo.objects.create(nome="corrida")
+        self.grupo.membros.add(self.ana, self.bia)
+
+    def nao_lidas(self, usuario):
+        item, = [c for c in conversas.conversas_da_lateral(usuario) if c["is_group"]]
+        return item["nao_lidas"]
+
+    def enviar(self, remetente, texto):
+        return MensagemGrupo.objects.create(id_grupo=self.grupo, id_remetente=remetente, mensagem=texto)
+
+    def test_quem_manda_nao_ve_a_propria_mensagem_como_nao_lida(self):
+        self.enviar(self.bia, "treino amanhã")
+        self.enviar(self.bia, "às 7h")
+        self.assertEqual(self.nao_lidas(self.ana), 2)
+        self.assertEqual(self.nao_lidas(self.bia), 0)
+
+        conversas.marcar_grupo_como_lido(self.ana.pk, self.grupo.pk)
+        self.assertEqual(self.nao_lidas(self.ana), 0)
+
+    def test_migracao_preenche_resumo_e_leituras(self):
+        self.enviar(self.ana, "oi")
+        ultima = self.enviar(self.bia, "tudo bem?")
+        # Como estava antes da 0014: sem resumo e sem marcadores
+        Grupo.objects.update(total_mensagens=0, ultima_mensagem="", ultima_hora=None)
+        LeituraGrupo.objects.all().delete()
+
+        migracao = import_module("app.migrations.0014_chat_grupo")
+        with connection.schema_editor() as editor:
+            migracao.preencher_resumos_e_leituras(apps, editor)
+
+        self.grupo.refresh_from_db()
+        self.assertEqual(self.grupo.total_mensagens, 2)
+        self.assertEqual(self.grupo.ultima_mensagem, "tudo bem?")
+        self.assertEqual(self.grupo.ultima_hora, ultima.hora)
+        # O histórico conta como lido; o que chega depois, não
+        self.assertEqual(self.nao_lidas(self.ana), 0)
+        self.enviar(self.bia, "bora?")
+        self.assertEqual(self.nao_lidas(self.ana), 1)
+        self.assertEqual(self.nao_lidas(self.bia), 0)
+
+
+class MarcadoresDeLeituraTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.recebidas = [
+            Mensagem.objects.create(id_remetente=self.bia, id_destinatario=self.ana, mensagem=f"m{i}")
+            for i in range(4)
+        ]
+        # Mensagem da própria ana não conta como não lida
+        Mensagem.objects.create(id_remetente=self.ana, id_destinatario=self.bia, mensagem="oi")
+
+    def resumo(self):
+        return ResumoConversa.objects.get(usuario=self.ana, contato=self.bia)
+
+    def test_contador_soma_a_cada_envio_e_zera_ao_ler(self):
+        self.assertEqual(self.resumo().nao_lidas, 4)
+        conversas.marcar_como_lida(self.ana.pk, self.bia.pk)
+        resumo = self.resumo()
+        self.assertEqual((resumo.nao_lidas, resumo.lida_ate), (0, resumo.id_ultima_mensagem))
+
+    def test_marcar_ate_uma_mensagem(self):
+        ate = self.recebidas[1].pk
+        conversas.marcar_como_lida(self.ana.pk, self.bia.pk, ate=ate)
+        self.assertEqual((self.resumo().nao_lidas, self.resumo().lida_ate), (2, ate))
+
+        # Nunca volta o marcador para trás
+        conversas.marcar_como_lida(self.ana.pk, self.bia.pk, ate=self.recebidas[0].pk)
+        self.assertEqual((self.resumo().nao_lidas, self.resumo().lida_ate), (2, ate))
+
+        conversas.marcar_como_lida(self.ana.pk, self.bia.pk, ate=self.recebidas[3].pk)
+        self.assertEqual(self.resumo().nao_lidas, 0)
+
+    def test_views(self):
+        self.client.force_login(self.ana)
+        url = reverse("marcar_lida", kwargs={"usuario_id": self.bia.pk})
+        resposta = self.client.post(url, {"ate": self.recebidas[2].pk})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.resumo().nao_lidas, 1)
+        self.assertEqual(self.client.post(url, {"ate": "ontem"}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        grupo = Grupo.objects.create(nome="natação")
+        url = reverse("marcar_grupo_lido", kwargs={"grupo_id": grupo.pk})
+        self.assertEqual(self.client.post(url).status_code, 403)
+
+    def test_grupo(self):
+        grupo = Grupo.objects.create(nome="corrida")
+        grupo.membros.add(self.ana, self.bia)
+        enviadas = [
+            MensagemGrupo.objects.create(id_grupo=grupo, id_remetente=self.bia, mensagem=f"g{i}")
+            for i in range(3)
+        ]
+        leitura = LeituraGrupo.objects.filter(grupo=grupo, usuario=self.ana)
+
+        conversas.marcar_grupo_como_lido(self.ana.pk, grupo.pk, ate=enviadas[0].pk)
+        self.assertEqual(leitura.values_list("mensagens_lidas", "lida_ate").get(), (1, enviadas[0].pk))
+        conversas.marcar_grupo_como_lido(self.ana.pk, grupo.pk)
+        self.assertEqual(leitura.values_list("mensagens_lidas", "lida_ate").get(), (3, enviadas[2].pk))
+
+        # Quem entra depois começa com o histórico já lido
+        caio = Usuario.objects.create_user(nome="caio")
+        grupo.membros.add(caio)
+        self.assertEqual(
+            LeituraGrupo.objects.filter(grupo=grupo, usuario=caio).values_list("mensagens_lidas", flat=True).get(),
+            3,
+        )
+
+
+class ChaveDaConversaTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.caio = Usuario.objects.create_user(nome="caio")
+
+    def enviar(self, de, para):
+        return Mensagem.objects.create(id_remetente=de, id_destinatario=para, mensagem="oi")
+
+    def test_mesma_chave_nos_dois_sentidos(self):
+        ida, volta = self.enviar(self.ana, self.bia), self.enviar(self.bia, self.ana)
+        self.assertEqual(ida.conversa, f"u{self.ana.pk}-{self.bia.pk}")
+        self.assertEqual(volta.conversa, ida.conversa)
+        self.assertEqual(chave_conversa(self.bia.pk, self.ana.pk), ida.conversa)
+
+    def test_migracao_preenche_em_lotes(self):
+        mensagens = [
+            self.enviar(de, para)
+            for de, para in [(self.ana, self.bia), (self.bia, self.ana), (self.caio, self.ana),
+                             (self.bia, self.caio), (self.caio, self.caio)]
+        ]
+        # Volta ao estado de antes da migração (desfeito no fim do teste)
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("ALTER TABLE mensagens ALTER COLUMN conversa DROP NOT NULL")
+            cursor.execute("UPDATE mensagens SET conversa = NULL")
+
+        migracao = import_module("app.migrations.0016_mensagem_conversa")
+        with mock.patch.object(migracao, "TAMANHO_LOTE", 2), connection.schema_editor() as editor:
+            migracao.preencher_conversa(apps, editor)
+
+        self.assertEqual(
+            dict(Mensagem.objects.values_list("pk", "conversa")),
+            {m.pk: chave_conversa(m.id_remetente_id, m.id_destinatario_id) for m in mensagens},
+        )
+
+
+class BuscaNoHistoricoTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        caio = Usuario.objects.create_user(nome="caio")
+        parque = Grupo.objects.create(nome="Parque")
+        parque.membros.add(self.ana, self.bia)
+        fechado = Grupo.objects.create(nome="Fechado")
+        fechado.membros.add(self.bia, caio)
+
+        self.direta = Mensagem.objects.create(
+            id_remetente=self.bia, id_destinatario=self.ana, mensagem="Treino de corrida & pizza amanhã"
+        )
+        self.do_grupo = MensagemGrupo.objects.create(
+            id_grupo=parque, id_remetente=self.bia, mensagem="Corridas no parque às 7h"
+        )
+        # Conversas de que a ana não participa
+        Mensagem.objects.create(id_remetente=self.bia, id_destinatario=caio, mensagem="corrida secreta")
+        MensagemGrupo.objects.create(id_grupo=fechado, id_remetente=caio, mensagem="corrida fechada")
+
+    def buscar(self, termo, **kwargs):
+        resultados, tem_proxima = conversas.buscar_mensagens(self.ana, termo, **kwargs)
+        return [(r["tipo"], r["mensagem"].pk) for r in resultados], tem_proxima
+
+    def test_so_as_conversas_de_quem_busca(self):
+        encontrados, tem_proxima = self.buscar("corrida")
+        self.assertCountEqual(encontrados, [("u", self.direta.pk), ("g", self.do_grupo.pk)])
+        self.assertFalse(tem_proxima)
+        self.assertEqual(self.buscar("corrida -parque")[0], [("u", self.direta.pk)])
+
+    def test_paginas(self):
+        primeira, tem_proxima = self.buscar("corrida", tamanho=1)
+        self.assertTrue(tem_proxima)
+        segunda, tem_proxima = self.buscar("corrida", pagina=2, tamanho=1)
+        self.assertFalse(tem_proxima)
+        self.assertCountEqual(primeira + segunda, [("u", self.direta.pk), ("g", self.do_grupo.pk)])
+
+    def test_trecho_escapado_com_destaque(self):
+        resultados, _ = conversas.buscar_mensagens(self.ana, "corrida -parque")
+        self.assertIn("<mark>corrida</mark> &amp; pizza", resultados[0]["trecho"])
+
+    def test_view(self):
+        self.client.force_login(self.ana)
+        url = reverse("buscar_mensagens")
+        dados = self.client.get(url, {"q": "corrida"}).json()
+        self.assertEqual(len(dados["resultados"]), 2)
+        self.assertEqual({r["conversa"] for r in dados["resultados"]}, {"bia", "Parque"})
+        self.assertEqual(self.client.get(url, {"q": "c"}).json(), {"resultados": [], "proxima": None})
+        self.assertEqual(self.client.get(url, {"q": "corrida", "pagina": "0"}).status_code, 400)
+
+
+@override_settings(MENSAGENS_RESTAURACAO="sincrono")
+class ParticoesMensagensTests(TestCase):
+    MES = datetime.date(2024, 1, 1)
+
+    def setUp(self):
+        cache.clear()
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio)
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.chave = conversas.chave_conversa(self.ana.pk, self.bia.pk)
+
+    def mensagem(self, texto, hora=None):
+        mensagem = Mensagem.objects.create(id_remetente=self.ana, id_destinatario=self.bia, mensagem=texto)
+        if hora is not None:
+            # Mudar a hora move a linha para a partição do outro mês
+            Mensagem.objects.filter(pk=mensagem.pk).update(hora=hora)
+        return mensagem
+
+    def particao(self, mensagem):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM mensagens WHERE id_mensagem = %s", [mensagem.pk])
+            return cursor.fetchone()[0]
+
+    def arquivar_janeiro(self):
+        particoes.criar_particao("mensagens", self.MES)
+        for dia in (10, 11):
+            self.mensagem(f"dia {dia}", datetime.datetime(2024, 1, dia, tzinfo=datetime.timezone.utc))
+        self.mensagem("hoje")
+        with connection.cursor() as cursor:
+            # Checa já as FKs adiadas das linhas criadas no teste: o PostgreSQL
+            # não solta a partição com verificações pendentes na transação
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(particoes.arquivar("mensagens", self.MES, self.diretorio), 2)
+
+    def textos(self, mensagens):
+        return [mensagem.mensagem for mensagem in mensagens]
+
+    def test_cada_mensagem_cai_na_particao_do_mes(self):
+        particoes.criar_particao("mensagens", self.MES)
+        janeiro = self.mensagem("janeiro", datetime.datetime(2024, 1, 15, tzinfo=datetime.timezone.utc))
+        hoje = self.mensagem("hoje")
+        sem_particao = self.mensagem("maio", datetime.datetime(2023, 5, 2, tzinfo=datetime.timezone.utc))
+
+        self.assertEqual(self.particao(janeiro), "mensagens_2024_01")
+        mes_atual = particoes.inicio_do_mes(timezone.now().date())
+        self.assertEqual(self.particao(hoje), particoes.nome_particao("mensagens", mes_atual))
+        self.assertEqual(self.particao(sem_particao), "mensagens_padrao")
+
+        # A partição nova traz as linhas do mês que estavam na padrão
+        self.assertTrue(particoes.criar_particao("mensagens", datetime.date(2023, 5, 1)))
+        self.assertEqual(self.particao(sem_particao), "mensagens_2023_05")
+
+    def test_arquivar_e_restaurar_pela_rolagem(self):
+        self.arquivar_janeiro()
+        self.assertNotIn(self.MES, particoes.meses_no_banco("mensagens"))
+        self.assertEqual(Mensagem.objects.filter(conversa=self.chave).count(), 1)
+        self.assertEqual(particoes.meses_arquivados("mensagens", self.chave), [self.MES])
+
+        # A abertura do chat não restaura, mas deixa o cursor para a rolagem
+        pagina, cursor = conversas.pagina_de_mensagens(self.ana.pk, self.bia.pk)
+        self.assertEqual(self.textos(pagina), ["hoje"])
+        self.assertIsNotNone(cursor)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pagina, cursor = conversas.pagina_de_mensagens(
+                self.ana.pk, self.bia.pk, conversas.decodificar_cursor(cursor)
+            )
+        self.assertEqual(self.textos(pagina), ["dia 10", "dia 11"])
+        self.assertIsNotNone(ArquivoMensagens.objects.get(tabela="mensagens", mes=self.MES).restaurado_em)
+        # Depois do commit o manifesto já não tem o mês: a rolagem termina
+        self.assertEqual(particoes.meses_arquivados("mensagens", self.chave), [])
+        pagina, cursor = conversas.pagina_de_mensagens(
+            self.ana.pk, self.bia.pk, conversas.decodificar_cursor(cursor)
+        )
+        self.assertEqual((pagina, cursor), ([], None))
+
+    @override_settings(MENSAGENS_RESTAURACAO="thread")
+    def test_restauracao_fica_fora_da_requisicao(self):
+        self.arquivar_janeiro()
+        _, cursor = conversas.pagina_de_mensagens(self.ana.pk, self.bia.pk)
+
+        with mock.patch.object(particoes.RestauradorMensagens, "marcar") as marcar:
+            pagina, mesmo_cursor = conversas.pagina_de_mensagens(
+                self.ana.pk, self.bia.pk, conversas.decodificar_cursor(cursor)
+            )
+        # Página vazia com o mesmo cursor: o chat pede de novo
+        self.assertEqual(pagina, [])
+        self.assertEqual(mesmo_cursor, cursor)
+        marcar.assert_called_once_with({("mensagens", self.MES)})
+        self.assertEqual(Mensagem.objects.filter(conversa=self.chave).count(), 1)
+
+
+class Queda(BaseException):
+    """O processo morreu: nem o `except Exception` da ingestão pega."""
+
+
+class IngestaoQueCai(IngestaoMensagens):
+    """Fecha a conexão da thread a cada lote, para o teste não deixar sessões abertas."""
+
+    def gravar(self, lote):
+        try:
+            super().gravar(lote)
+        finally:
+            connection.close()
+
+
+class IngestaoQuedaTests(TransactionTestCase):
+    ENVIOS = 40
+    REMETENTES = 4
+
+    def setUp(self):
+        self.remetente = Usuario.objects.create_user(nome="remetente")
+        self.destinatarios = [
+            Usuario.objects.create_user(nome=f"destinatario{i}") for i in range(self.REMETENTES)
+        ]
+
+    def test_queda_no_meio_do_lote_nao_perde_confirmadas(self):
+        gravar_em_lote = ingestao._gravar_em_lote
+        lotes = 0
+
+        def cair_no_terceiro_lote(mensagens):
+            nonlocal lotes
+            lotes += 1
+            if lotes != 3:
+                return gravar_em_lote(mensagens)
+            # Metade do lote já foi inserida quando a conexão cai no meio da transação
+            Mensagem.objects.bulk_create(mensagens[:len(mensagens) // 2])
+            connection.close()
+            raise Queda()
+
+        fila = IngestaoQueCai(tamanho_lote=self.REMETENTES, espera=0.02)
+        confirmadas = {destinatario.pk: [] for destinatario in self.destinatarios}
+
+        def enviar(destinatario):
+            # Como um cliente: só manda a próxima depois da confirmação da anterior
+            for n in range(self.ENVIOS):
+                futuro = fila.colocar(Mensagem(
+                    id_remetente=self.remetente, id_destinatario=destinatario, mensagem=f"n{n:03d}"
+                ))
+                try:
+                    mensagem = futuro.result(timeout=2)
+                except FuturoTimeoutError:
+                    return
+                confirmadas[destinatario.pk].append((mensagem.pk, mensagem.mensagem))
+
+        with mock.patch("app.ingestao._gravar_em_lote", cair_no_terceiro_lote), \
+                mock.patch("threading.excepthook"):
+            remetentes = [threading.Thread(target=enviar, args=(d,)) for d in self.destinatarios]
+            for remetente in remetentes:
+                remetente.start()
+            for remetente in remetentes:
+                remetente.join()
+
+        self.assertGreaterEqual(lotes, 3)
+        total = sum(len(lista) for lista in confirmadas.values())
+        self.assertLess(total, self.ENVIOS * self.REMETENTES)  # o lote derrubado não foi confirmado
+        for destinatario in self.destinatarios:
+            gravadas = list(
+                Mensagem.objects.filter(id_destinatario=destinatario)
+                .order_by("hora", "id_mensagem")
+                .values_list("id_mensagem", "mensagem")
+            )
+            textos = [texto for _, texto in gravadas]
+            # Sem duplicadas e na ordem em que foram enviadas
+            self.assertEqual(textos, sorted(set(textos)))
+            self.assertEqual([pk for pk, _ in gravadas], sorted(pk for pk, _ in gravadas))
+            # Toda confirmada está gravada, com o mesmo id
+            self.assertLessEqual(set(confirmadas[destinatario.pk]), set(gravadas))
+
+
+@override_settings(LIMITES_REQUISICOES={"conversa": ("1/m", 2), "enviar_mensagem": ("1/m", 2)})
+class LimiteDeRequisicoesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = Usuario.objects.create_user(nome="ana")
+        self.bia = Usuario.objects.create_user(nome="bia")
+        self.client.force_login(self.ana)
+
+    def enviar(self, nome_url, texto, **cabecalhos):
+        return self.client.post(
+            reverse(nome_url, args=[self.bia.pk]), {"mensagem": texto}, headers=cabecalhos
+        )
+
+    def test_sem_fichas_responde_429_com_retry_after(self):
+        for texto in ("um", "dois"):
+            self.assertEqual(self.enviar("conversa", texto).status_code, 302)
+        resposta = self.enviar("conversa", "três", accept="application/json")
+        self.assertEqual(resposta.status_code, 429)
+        self.assertEqual(resposta["Retry-After"], "60")
+        self.assertEqual(resposta.json()["tente_em"], 60)
+        # A view nem rodou
+        self.assertFalse(Mensagem.objects.filter(mensagem="três").exists())
+
+    def test_cada_view_tem_o_proprio_balde(self):
+        for texto in ("um", "dois", "três"):
+            self.enviar("conversa", texto)
+        self.assertEqual(self.enviar("enviar_mensagem", "por outra view").status_code, 302)
+        self.assertTrue(Mensagem.objects.filter(mensagem="por outra view").exists())
+
+
+class BuscaPorTrigramasTests(TestCase):
+    def setUp(self):
+        self.eu = Usuario.objects.create_user(nome="Eu")
+        for nome, cidade in [
+            ("Mariana Souza", "Recife"),
+            ("Mario Lima", "Olinda"),
+            ("Joana Alves", "Recife"),
+            ("Pedro Rocha", "Caruaru"),
+        ]:
+            usuario = Usuario.objects.create_user(nome=nome)
+            Parceiro.objects.create(usuario=usuario, localizacao=cidade)
+        self.pedro = Usuario.objects.get(nome="Pedro Rocha")
+        Preferencia.objects.create(usuario=self.pedro, esportes="corrida")
+        esportes.sincronizar([self.pedro.pk])
+
+    def nomes(self, **filtros):
+        return [usuario.nome for usuario in parceiros.buscar(self.eu, **filtros)]
+
+    def test_erros_de_digitacao_em_ordem_de_semelhanca(self):
+        self.assertEqual(self.nomes(termo="Mario"), ["Mario Lima", "Mariana Souza"])
+        encontrados = self.nomes(termo="Marianna")
+        self.assertEqual(encontrados[0], "Mariana Souza")
+        self.assertNotIn("Joana Alves", encontrados)
+        self.assertEqual(self.nomes(localizacao="Recfe"), ["Joana Alves", "Mariana Souza"])
+        # Nome e localização juntos: tem que bater com os dois
+        self.assertEqual(self.nomes(termo="Mario", localizacao="Olinda"), ["Mario Lima"])
+        self.assertEqual(self.nomes(termo="Joana", localizacao="Olinda"), [])
+
+    def test_termo_que_e_esporte_acha_quem_pratica(self):
+        self.assertEqual(self.nomes(termo="corridas"), ["Pedro Rocha"])
+
+    def test_quem_busca_fica_de_fora(self):
+        self.assertEqual(self.nomes(termo="Eu"), [])
+
+    def test_sem_postgres_cai_no_icontains(self):
+        with mock.patch.object(parceiros, "connection", vendor="sqlite"):
+            self.assertEqual(self.nomes(termo="mari"), ["Mariana Souza", "Mario Lima"])
+            self.assertEqual(self.nomes(localizacao="recife"), ["Joana Alves", "Mariana Souza"])
+            # Sem trigramas não há tolerância a erros de digitação
+            self.assertEqual(self.nomes(localizacao="Recfe"), [])
+            self.assertEqual(self.nomes(termo="corrida"), ["Pedro Rocha"])
+
+
+class SepararEsportesTests(SimpleTestCase):
+    def test_separar(self):
+        self.assertEqual(
+            esportes.separar("Futebol, corridas de rua e vôlei"), ["Futebol", "corridas de rua", "vôlei"]
+        )
+        self.assertEqual(esportes.separar("surf/skate - yoga; "), ["surf", "skate", "yoga"])
+        # "e" só separa como palavra inteira
+        self.assertEqual(esportes.separar("beach tennis e esgrima"), ["beach tennis", "esgrima"])
+        self.assertEqual(esportes.separar(None), [])
+
+    def test_normalizar(self):
+        self.assertEqual(esportes.normalizar("  Vôlei  de Praia!"), "volei de praia")
+
+
+class CatalogoTests(TestCase):
+    # O catálogo já vem com os esportes da migração 0020
+    def id_de(self, nome):
+        return Esporte.objects.get(nome=nome).pk
+
+    def test_corrida_de_rua_nao_e_corrida(self):
+        catalogo = esportes.Catalogo()
+        self.assertEqual(catalogo.resolver("corridas de rua"), {self.id_de("Corrida de rua")})
+        self.assertEqual(catalogo.resolver("Corrida"), {self.id_de("Corrida")})
+        self.assertEqual(
+            catalogo.resolver("corrida, corrida de rua"), {self.id_de("Corrida"), self.id_de("Corrida de rua")}
+        )
+
+    def test_acentos_plurais_sinonimos_e_erros_de_digitacao(self):
+        catalogo = esportes.Catalogo()
+        natacao = {self.id_de("Natação")}
+        for texto in ("Natação", "natacao", "NATAÇÃO", "nadar"):
+            self.assertEqual(catalogo.resolver(texto), natacao, texto)
+        self.assertEqual(catalogo.resolver("caminhadas"), {self.id_de("Caminhada")})
+        self.assertEqual(catalogo.resolver("basquetebl"), {self.id_de("Basquete")})
+
+    def test_esporte_desconhecido(self):
+        catalogo = esportes.Catalogo()
+        self.assertEqual(catalogo.resolver("curling"), set())
+        self.assertFalse(Esporte.objects.filter(nome="Curling").exists())
+
+        novo = catalogo.resolver("curling", criar=True)
+        self.assertEqual(novo, {self.id_de("Curling")})
+        self.assertTrue(SinonimoEsporte.objects.filter(termo="curling").exists())
+        # Outro catálogo (outra requisição) já acha o esporte criado
+        self.assertEqual(esportes.Catalogo().resolver("Curling"), novo)
+
+    def test_sincronizar_grava_os_esportes_do_usuario(self):
+        ana = Usuario.objects.create_user(nome="ana")
+        Preferencia.objects.create(usuario=ana, esportes="corridas de rua e natação")
+        esportes.sincronizar([ana.pk])
+        self.assertEqual(
+            set(ana.esportes_praticados.values_list("esporte__nome", flat=True)),
+            {"Corrida de rua", "Natação"},
+        )
+        self.assertFalse(
+            esportes.usuarios_que_praticam({self.id_de("Corrida")}).filter(usuario_id=ana.pk).exists()
+        )
+
+
+class GeohashTests(SimpleTestCase):
+    RECIFE = (-8.0476, -34.8770)
+
+    def test_geohash(self):
+        self.assertEqual(geo.geohash(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_celulas_cobrem_o_circulo(self):
+        for raio in (0.5, 5, 40):
+            celulas = geo.celulas_do_raio(*self.RECIFE, raio)
+            self.assertLessEqual(len(celulas), 9)
+            altura, largura = geo.tamanho_celula(len(celulas[0]))
+            self.assertGreaterEqual(altura * 110.57, raio)
+            # Pontos na borda do círculo, em 16 direções
+            for i in range(16):
+                angulo = 2 * math.pi * i / 16
+                km_por_grau_lon = 111.32 * math.cos(math.radians(self.RECIFE[0]))
+                latitude = self.RECIFE[0] + 0.99 * raio / 110.57 * math.sin(angulo)
+                longitude = self.RECIFE[1] + 0.99 * raio / km_por_grau_lon * math.cos(angulo)
+                self.assertLessEqual(geo.distancia_km(*self.RECIFE, latitude, longitude), raio)
+                self.assertTrue(
+                    geo.geohash(latitude, longitude).startswith(tuple(celulas)), (raio, i)
+                )
+
+    def test_raio_grande_demais_nao_filtra(self):
+        self.assertEqual(geo.celulas_do_raio(*self.RECIFE, 20000), [])
+
+    def test_raio_invalido_e_ignorado(self):
+        fabrica = RequestFactory()
+        for raio in ("nan", "inf", "-inf", "-3", "dez"):
+            request = fabrica.get("/parceiros/", {"raio": raio})
+            self.assertEqual(views._origem_e_raio(request, "Recife"), (None, None, None), raio)
+        request = fabrica.get("/parceiros/", {"raio": "10"})
+        self.assertEqual(views._origem_e_raio(request, "Recife"), (self.RECIFE, 10.0, None))
+
+
+class RaioParaTests(TestCase):
+    def setUp(self):
+        # Do centro do Recife: 0, ~11 km, ~124 km e ~2.100 km
+        for cidade in ("Recife", "Camaragibe", "Caruaru", "São Paulo"):
+            usuario = Usuario.objects.create_user(nome=cidade)
+            Parceiro.objects.create(usuario=usuario, localizacao=cidade)
+        self.origem = geo.geocodificar("Recife")
+
+    def test_menor_raio_com_parceiros_suficientes(self):
+        parceiros = Parceiro.objects.all()
+        self.assertEqual(geo.raio_para(parceiros, self.origem, 1), 5)
+        self.assertEqual(geo.raio_para(parceiros, self.origem, 2), 20)
+        self.assertEqual(geo.raio_para(parceiros, self.origem, 3), 320)
+        self.assertEqual(geo.raio_para(parceiros, self.origem, 5), 5000)
+
+    def test_mais_proximos_em_ordem_de_distancia(self):
+        perto = geo.mais_proximos(Parceiro.objects.select_related("usuario"), self.origem, 3)
+        self.assertEqual([parceiro.usuario.nome for parceiro in perto], ["Recife", "Camaragibe", "Caruaru"])
+
+
+@override_settings(COMPATIBILIDADE_MATRIZ_TTL=0)
+class CompatibilidadeTests(TestCase):
+    def setUp(self):
+        # O catálogo já vem com os esportes da migração 0020
+        corrida = Esporte.objects.get_or_create(nome="Corrida")[0]
+        natacao = Esporte.objects.get_or_create(nome="Natação")[0]
+        self.ana = self.usuario("ana", "I", "M", corrida)
+        self.ideal = self.usuario("ideal", "I", "M", corrida)
+        self.outro_nivel = self.usuario("outro_nivel", "A", "N", corrida)
+        self.outro_esporte = self.usuario("outro_esporte", "I", "M", natacao)
+        self.sem_preferencia = Usuario.objects.create_user(nome="sem_preferencia")
+
+    def usuario(self, nome, nivel, turno, esporte):
+        usuario = Usuario.objects.create_user(nome=nome)
+        Preferencia.objects.create(usuario=usuario, nivel=nivel, turno=turno)
+        EsporteUsuario.objects.create(usuario=usuario, esporte=esporte)
+        return usuario
+
+    def test_ordem_e_nota(self):
+        melhores = compatibilidade.melhores(self.ana, 10)
+        ids = [pk for pk, _ in melhores]
+        self.assertNotIn(self.ana.pk, ids)
+        self.assertEqual(ids[0], self.ideal.pk)
+        self.assertEqual(len(ids), 4)
+        # idade sem dado dos dois lados (0,5) + turno, nível e esporte iguais: (0,5 + 1 + 1 + 2) / 5
+        self.assertAlmostEqual(melhores[0][1], 0.9, places=5)
+        notas = dict(melhores)
+        self.assertGreater(notas[self.outro_esporte.pk], notas[self.sem_preferencia.pk])
+        self.assertGreater(notas[self.outro_nivel.pk], notas[self.sem_preferencia.pk])
+
+    def test_entre_e_quantos(self):
+        entre = [self.outro_nivel.pk, self.sem_preferencia.pk, self.ana.pk]
+        ids = [pk for pk, _ in compatibilidade.melhores(self.ana, 10, entre=entre)]
+        self.assertEqual(ids, [self.outro_nivel.pk, self.sem_preferencia.pk])
+        self.assertEqual(len(compatibilidade.melhores(self.ana, 2)), 2)
+
+
+@override_settings(COMPATIBILIDADE_MATRIZ_TTL=0, RECOMENDACOES_ATUALIZACAO="sincrono")
+class RecomendacoesTests(TestCase):
+    def setUp(self):
+        self.ana, self.bia, self.caio, self.dani = (
+            Usuario.objects.create_user(nome=nome) for nome in ("ana", "bia", "caio", "dani")
+        )
+
+    def estado(self, usuario, atualizada_em=None, marcada_em=None):
+        EstadoRecomendacoes.objects.update_or_create(
+            usuario=usuario, defaults={"atualizada_em": atualizada_em, "marcada_em": marcada_em}
+        )
+
+    def test_marcar_pega_o_dono_e_quem_tem_ele_na_lista(self):
+        Recomendacao.objects.create(usuario=self.ana, parceiro=self.bia, posicao=1, nota=0.5)
+        Recomendacao.objects.create(usuario=self.caio, parceiro=self.dani, posicao=1, nota=0.5)
+        recomendacoes.marcar([self.bia.pk])
+        marcados = set(
+            EstadoRecomendacoes.objects.filter(marcada_em__isnull=False).values_list("usuario_id", flat=True)
+        )
+        self.assertEqual(marcados, {self.ana.pk, self.bia.pk})
+
+    def test_desatualizados(self):
+        agora = timezone.now()
+        self.estado(self.ana, atualizada_em=agora)
+        self.estado(self.bia, atualizada_em=agora - datetime.timedelta(minutes=1), marcada_em=agora)
+        self.estado(self.dani, atualizada_em=agora - datetime.timedelta(days=2))
+        # caio nunca foi calculado
+
+        def ids(*args, **kwargs):
+            return [pk for lote in recomendacoes.desatualizados(2, *args, **kwargs) for pk in lote]
+
+        self.assertEqual(ids(), [self.bia.pk, self.caio.pk, self.dani.pk])
+        self.assertEqual(ids(todos=True), [self.ana.pk, self.bia.pk, self.caio.pk, self.dani.pk])
+        self.assertEqual(ids(inicio=self.ana.pk, fim=self.caio.pk), [self.bia.pk, self.caio.pk])
+
+    def test_busca_mostra_a_lista_gravada_e_recalcula_depois(self):
+        Recomendacao.objects.create(usuario=self.ana, parceiro=self.bia, posicao=1, nota=0.5)
+        self.estado(self.ana, atualizada_em=timezone.now(), marcada_em=timezone.now())
+
+        with mock.patch.object(recomendacoes, "atualizar", wraps=recomendacoes.atualizar) as atualizar:
+            with self.captureOnCommitCallbacks() as depois_do_commit:
+                sugeridos = recomendacoes.sugeridos(self.ana, 10)
+            atualizar.assert_not_called()
+            self.assertEqual(sugeridos, [self.bia])
+
+            for callback in depois_do_commit:
+                callback()
+            atualizar.assert_called_once_with({self.ana.pk})
+        self.assertEqual(
+            set(Recomendacao.objects.filter(usuario=self.ana).values_list("parceiro_id", flat=True)),
+            {self.bia.pk, self.caio.pk, self.dani.pk},
+        )
+
+    def test_primeira_visita_usa_as_notas_na_hora(self):
+        with self.captureOnCommitCallbacks() as depois_do_commit:
+            sugeridos = recomendacoes.sugeridos(self.ana, 10)
+        self.assertEqual({usuario.pk for usuario in sugeridos}, {self.bia.pk, self.caio.pk, self.dani.pk})
+        self.assertFalse(Recomendacao.objects.exists())
+        self.assertEqual(len(depois_do_commit), 1)
+
+
+@override_settings(COMPATIBILIDADE_MATRIZ_TTL=0)
+class AtualizarRecomendacoesTests(TransactionTestCase):
+    def test_pool_de_processos_refaz_so_as_desatualizadas(self):
+        usuarios = [Usuario.objects.create_user(nome=f"u{i}") for i in range(5)]
+        EstadoRecomendacoes.objects.create(usuario=usuarios[0], atualizada_em=timezone.now())
+
+        saida = StringIO()
+        call_command("atualizar_recomendacoes", processos=2, lote=2, stdout=saida)
+        self.assertIn("Recomendações de 4 usuários atualizadas", saida.getvalue())
+        self.assertEqual(
+            set(Recomendacao.objects.values_list("usuario_id", flat=True)),
+            {usuario.pk for usuario in usuarios[1:]},
+        )
+        self.assertEqual(Recomendacao.objects.filter(usuario=usuarios[1]).count(), 4)
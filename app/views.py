@@ -10,6 +10,7 @@ from .models import (
     Parceiro,
     Ranking,
     Mensagem,
+    MensagemGrupo,
     Grupo,
     GrupoAdmin,
     Desafio,
@@ -18,9 +19,16 @@ from .models import (
 from django.db.models import Q
 from django.utils import timezone
 from .models import Comunidade, MetaComunidade, Usuario
+from . import conversas, geo, ingestao, parceiros, ranking
+from .limites import limitar
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+import asyncio
 import json
+import math
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.db import ProgrammingError
 from datetime import datetime
 
@@ -233,6 +241,36 @@ def montar_descricao(parceiro):
     local = parceiro.localizacao if parceiro.localizacao else "Não informada"
     return f"Esporte: {esporte} | Idade: {idade_txt} | Nível: {nivel} | Localização: {local}"
 
+# Opções de distância das buscas (km)
+RAIOS_BUSCA = [5, 10, 25, 50, 100]
+
+
+def _origem_e_raio(request, local):
+    """
+    Lê ?raio= ("" = qualquer distância, km ou "proximos") e acha o ponto de
+    partida: a cidade `local` ou, sem ela, a do usuário logado.
+    Retorna (origem, raio, aviso); origem None = busca sem distância.
+    """
+    pedido = request.GET.get("raio", "")
+    if not pedido:
+        return None, None, None
+    raio = None
+    if pedido != "proximos":
+        try:
+            raio = float(pedido)
+        except ValueError:
+            return None, None, None
+        if not math.isfinite(raio) or raio <= 0:
+            return None, None, None
+    if local:
+        origem = geo.geocodificar(local)
+        aviso = None if origem else f"Não encontramos a cidade \"{local}\"; a distância foi ignorada."
+    else:
+        origem = geo.origem_do_usuario(request.user) if request.user.is_authenticated else None
+        aviso = None if origem else "Informe uma cidade ou cadastre a sua localização para buscar por distância."
+    return origem, raio, aviso
+
+
 @login_required
 def buscar_parceiros(request):
     # 1. Captura os dados direto da URL (barra de pesquisa)
@@ -240,49 +278,23 @@ def buscar_parceiros(request):
     esporte = request.GET.get('esporte')
     localizacao = request.GET.get('localizacao')
 
-    # 2. Começa pegando TODOS os usuários, menos o próprio usuário logado
-    # O prefetch_related deixa o carregamento mais rápido (otimização)
-    users = Usuario.objects.exclude(id_usuario=request.user.id_usuario).prefetch_related('preferencias', 'parceiros')
-
-    # 3. Aplica o filtro de pesquisa (Nome OU Esporte)
-    if termo:
-        users = users.filter(
-            Q(nome__icontains=termo) | 
-            Q(preferencias__esportes__icontains=termo)
-        ).distinct()
+    # 2. Distância (opcional): "5", "10"... km ou "proximos", a partir da
+    # localização digitada ou, sem ela, da localização do próprio usuário
+    origem, raio, aviso = _origem_e_raio(request, localizacao)
 
-    # 4. Aplica filtro específico de Esporte (do Modal)
-    if esporte:
-        users = users.filter(preferencias__esportes__icontains=esporte).distinct()
+    # 3. Busca por semelhança (trigramas), sem o próprio usuário logado,
+    # do mais para o menos parecido (ver app/parceiros.py)
+    users = parceiros.buscar(request.user, termo, esporte, localizacao, origem=origem, raio=raio)
 
-    # 5. Aplica filtro específico de Localização (do Modal)
-    if localizacao:
-        users = users.filter(parceiros__localizacao__icontains=localizacao).distinct()
-
-    # 6. Envia para o HTML
+    # 4. Envia para o HTML
     context = {
         'parceiros': users,
+        'aviso': aviso,
+        'raios': RAIOS_BUSCA,
         'request': request # Necessário para manter o texto na barra de busca
     }
 
     return render(request, "buscar_parceiros.html", context)
-    # Monta dados de apresentação
-    parceiros = []
-    for p in qs:
-        parceiros.append({
-            "nome": p.usuario.nome,
-            "foto_url": p.usuario.foto_perfil.url if p.usuario.foto_perfil else None,
-            "cor_avatar": get_profile_color(p.usuario),
-            "descricao": montar_descricao(p),
-        })
-
-    # Exibe mensagem amigável quando não houver resultados
-    sem_resultados = (len(parceiros) == 0)
-    return render(
-        request,
-        "buscar_parceiros.html",
-        {"form": form, "parceiros": parceiros, "sem_resultados": sem_resultados}
-    )
 
 def chat_view(request):
 
@@ -293,57 +305,8 @@ def chat_view(request):
     # Lógica para usuários logados
     user = request.user
     
-    # 1. Amigos (Assumindo que 'amigos' são usuários com quem o usuário logado já trocou mensagens)
-    # Buscamos todos os usuários com quem o usuário logado já conversou
-    contatos_ids = Mensagem.objects.filter(
-        Q(id_remetente=user) | Q(id_destinatario=user)
-    ).values_list('id_remetente__id_usuario', 'id_destinatario__id_usuario').distinct()
-    
-    # Flatten the list of IDs and remove the current user's ID
-    all_ids = set()
-    for sender_id, receiver_id in contatos_ids:
-        all_ids.add(sender_id)
-        all_ids.add(receiver_id)
-    
-    all_ids.discard(user.id_usuario)
-    
-    amigos = Usuario.objects.filter(id_usuario__in=all_ids).order_by('nome')
-
-    # 2. Grupos
-    grupos = user.grupos.all().order_by('nome')
-    
-    conversations = []
-    
-    # Adicionar Amigos
-    for amigo in amigos:
-        # Buscar a última mensagem trocada com este amigo
-        last_message_obj = Mensagem.objects.filter(
-            Q(id_remetente=user, id_destinatario=amigo) | Q(id_remetente=amigo, id_destinatario=user)
-        ).order_by('-hora').first()
-        
-        last_message = last_message_obj.mensagem if last_message_obj else "Inicie a conversa"
-        
-        conversations.append({
-            'id': amigo.id_usuario,
-            'nome': amigo.nome,
-            'foto_perfil': amigo.foto_perfil,
-            'last_message': last_message,
-            'is_group': False,
-            'is_active': False, # Será definido na view de conversa específica
-        })
-
-    # Adicionar Grupos
-    for grupo in grupos:
-        # Como o modelo Mensagem não tem campo para Grupo, estou simulando a última mensagem
-        # Você precisará de um modelo de Mensagem de Grupo para ter a última mensagem real
-        conversations.append({
-            'id': grupo.id_grupo,
-            'nome': grupo.nome,
-            'foto_perfil': None, # Grupos usam ícone
-            'last_message': f"Membros: {grupo.membros.count()}", # Mensagem placeholder
-            'is_group': True,
-            'is_active': False,
-        })
+    # Lista lateral lida dos resumos de conversa (app/conversas.py)
+    conversations = conversas.conversas_da_lateral(user)
         
     context = {
         "is_authenticated": True,
@@ -353,7 +316,20 @@ def chat_view(request):
     return render(request, "chat.html", context)
 
 
+def _resposta_envio_pendente(request):
+    """202: a mensagem está na fila de gravação, mas o commit ainda não veio."""
+    mensagem = "Mensagem recebida, ainda sendo gravada. Confira a conversa antes de reenviar."
+    quer_json = (
+        request.headers.get("x-requested-with") == "XMLHttpRequest"
+        or "application/json" in request.headers.get("accept", "")
+    )
+    if quer_json:
+        return JsonResponse({"status": "pendente", "mensagem": mensagem}, status=202)
+    return HttpResponse(mensagem, status=202, content_type="text/plain; charset=utf-8")
+
+
 @login_required
+@limitar("conversa")
 def conversa(request, usuario_id):
     """
     View para exibir a conversa individual com outro usuário.
@@ -363,72 +339,35 @@ def conversa(request, usuario_id):
     
     # Verifica se o contato é o próprio usuário (evita chat consigo mesmo)
     if contato == user:
-        return redirect('chat_view') # Ou uma página de erro
+        return redirect('chat') # Ou uma página de erro
 
-    # Mensagens entre o usuário logado e o contato
-    mensagens = Mensagem.objects.filter(
-        Q(id_remetente=user, id_destinatario=contato) | Q(id_remetente=contato, id_destinatario=user)
-    ).order_by("hora")
+    # Só a página mais recente da conversa; as anteriores vêm por
+    # mensagens_anteriores conforme o usuário rola para cima
+    mensagens, cursor_anteriores = conversas.pagina_de_mensagens(
+        user.id_usuario, contato.id_usuario
+    )
     
     # Lógica de envio de mensagem
     if request.method == "POST":
         form = MensagemForm(request.POST)
         if form.is_valid():
-            Mensagem.objects.create(
-                id_remetente=user,
-                id_destinatario=contato,
-                mensagem=form.cleaned_data["mensagem"],
-            )
+            try:
+                ingestao.enviar(Mensagem(
+                    id_remetente=user,
+                    id_destinatario=contato,
+                    mensagem=form.cleaned_data["mensagem"],
+                ))
+            except ingestao.EnvioPendente:
+                return _resposta_envio_pendente(request)
             # Redireciona para evitar reenvio de formulário
             return redirect("conversa", usuario_id=contato.id_usuario)
     else:
         form = MensagemForm(initial={"destinatario_id": contato.id_usuario})
         
-    # Reutiliza a lógica de lista de conversas da chat_view para a sidebar
-    # (Isso deve ser otimizado, mas para o escopo atual, é funcional)
-    
-    contatos_ids = Mensagem.objects.filter(
-        Q(id_remetente=user) | Q(id_destinatario=user)
-    ).values_list('id_remetente__id_usuario', 'id_destinatario__id_usuario').distinct()
-    
-    all_ids = set()
-    for sender_id, receiver_id in contatos_ids:
-        all_ids.add(sender_id)
-        all_ids.add(receiver_id)
-    
-    all_ids.discard(user.id_usuario)
-    
-    amigos = Usuario.objects.filter(id_usuario__in=all_ids).order_by('nome')
-    grupos_list = user.grupos.all().order_by('nome')
-    
-    conversations = []
-    
-    for amigo in amigos:
-        last_message_obj = Mensagem.objects.filter(
-            Q(id_remetente=user, id_destinatario=amigo) | Q(id_remetente=amigo, id_destinatario=user)
-        ).order_by('-hora').first()
-        
-        last_message = last_message_obj.mensagem if last_message_obj else "Inicie a conversa"
-        
-        conversations.append({
-            'id': amigo.id_usuario,
-            'nome': amigo.nome,
-            'foto_perfil': amigo.foto_perfil,
-            'last_message': last_message,
-            'is_group': False,
-            'is_active': amigo.id_usuario == usuario_id,
-        })
-        
-    for grupo in grupos_list:
-        conversations.append({
-            'id': grupo.id_grupo,
-            'nome': grupo.nome,
-            'foto_perfil': None,
-            'last_message': f"Membros: {grupo.membros.count()}",
-            'is_group': True,
-            'is_active': False,
-        })
+    # Abriu a conversa: o que o contato mandou passa a contar como lido
+    conversas.marcar_como_lida(user.id_usuario, contato.id_usuario)
 
+    conversations = conversas.conversas_da_lateral(user, contato_ativo=contato.id_usuario)
 
     context = {
         "is_authenticated": True,
@@ -439,6 +378,9 @@ def conversa(request, usuario_id):
             'is_group': False,
         },
         "mensagens": mensagens,
+        "cursor_anteriores": cursor_anteriores,
+        "cursor_novas": conversas.codificar_cursor(mensagens[-1]) if mensagens else "0_0",
+        "chave_conversa": conversas.chave_conversa(user.id_usuario, contato.id_usuario),
         "form": form,
     }
     
@@ -446,6 +388,188 @@ def conversa(request, usuario_id):
 
 
 @login_required
+def mensagens_anteriores(request, usuario_id):
+    """JSON com a página de mensagens anterior ao cursor ?antes= (rolagem infinita)."""
+    contato = get_object_or_404(Usuario, id_usuario=usuario_id)
+    try:
+        antes = conversas.decodificar_cursor(request.GET.get("antes"))
+    except ValueError:
+        return JsonResponse({"erro": "Cursor inválido"}, status=400)
+
+    mensagens, cursor_anteriores = conversas.pagina_de_mensagens(
+        request.user.id_usuario, contato.id_usuario, antes
+    )
+    return JsonResponse({
+        "mensagens": [conversas.mensagem_json(msg) for msg in mensagens],
+        "anteriores": cursor_anteriores,
+    })
+
+
+@login_required
+def mensagens_anteriores_grupo(request, grupo_id):
+    """JSON com a página de mensagens do grupo anterior ao cursor ?antes=."""
+    grupo = get_object_or_404(Grupo, id_grupo=grupo_id)
+    if not grupo.membros.filter(pk=request.user.pk).exists():
+        return JsonResponse({"erro": "Você não é membro deste grupo."}, status=403)
+    try:
+        antes = conversas.decodificar_cursor(request.GET.get("antes"))
+    except ValueError:
+        return JsonResponse({"erro": "Cursor inválido"}, status=400)
+
+    mensagens, cursor_anteriores = conversas.pagina_de_mensagens_grupo(grupo.id_grupo, antes)
+    return JsonResponse({
+        "mensagens": [conversas.mensagem_json(msg, com_nome=True) for msg in mensagens],
+        "anteriores": cursor_anteriores,
+    })
+
+
+def _id_lida_ate(request):
+    """?ate= / POST ate=: id da última mensagem vista (None = até a última)."""
+    valor = request.POST.get("ate") or request.GET.get("ate")
+    return int(valor) if valor else None
+
+
+@login_required
+def buscar_mensagens(request):
+    """JSON com as mensagens do usuário que casam com ?q=, em páginas (?pagina=1, 2, ...)."""
+    termo = request.GET.get("q", "").strip()
+    try:
+        pagina = int(request.GET.get("pagina", 1))
+    except ValueError:
+        return JsonResponse({"erro": "Página inválida"}, status=400)
+    if pagina < 1:
+        return JsonResponse({"erro": "Página inválida"}, status=400)
+    if len(termo) < 2:
+        return JsonResponse({"resultados": [], "proxima": None})
+
+    user = request.user
+    resultados, tem_proxima = conversas.buscar_mensagens(user, termo, pagina)
+    itens = []
+    for resultado in resultados:
+        msg = resultado["mensagem"]
+        if resultado["tipo"] == "g":
+            nome = msg.id_grupo.nome
+            url = reverse("conversa_grupo", kwargs={"grupo_id": msg.id_grupo_id})
+        else:
+            contato = msg.id_destinatario if msg.id_remetente_id == user.id_usuario else msg.id_remetente
+            nome = contato.nome
+            url = reverse("conversa", kwargs={"usuario_id": contato.id_usuario})
+        itens.append({
+            "tipo": resultado["tipo"],
+            "id": msg.pk,
+            "conversa": nome,
+            "url": url,
+            "remetente_nome": msg.id_remetente.nome,
+            "hora": msg.hora.isoformat(),
+            "trecho": resultado["trecho"],
+        })
+    return JsonResponse({"resultados": itens, "proxima": pagina + 1 if tem_proxima else None})
+
+
+@login_required
+def marcar_lida(request, usuario_id):
+    """Marca a conversa direta como lida (chamado pelo chat aberto ao receber mensagens)."""
+    if request.method != "POST":
+        return JsonResponse({"erro": "Método inválido"}, status=405)
+    try:
+        ate = _id_lida_ate(request)
+    except ValueError:
+        return JsonResponse({"erro": "Mensagem inválida"}, status=400)
+    conversas.marcar_como_lida(request.user.id_usuario, usuario_id, ate)
+    return JsonResponse({"status": "ok"})
+
+
+@login_required
+def marcar_grupo_lido(request, grupo_id):
+    """Marca o chat do grupo como lido até ?ate= (ou até a última mensagem)."""
+    if request.method != "POST":
+        return JsonResponse({"erro": "Método inválido"}, status=405)
+    if not Grupo.objects.filter(id_grupo=grupo_id, membros=request.user).exists():
+        return JsonResponse({"erro": "Você não é membro deste grupo."}, status=403)
+    try:
+        ate = _id_lida_ate(request)
+    except ValueError:
+        return JsonResponse({"erro": "Mensagem inválida"}, status=400)
+    conversas.marcar_grupo_como_lido(request.user.id_usuario, grupo_id, ate)
+    return JsonResponse({"status": "ok"})
+
+
+async def _esperar_mensagens(request, chave, buscar, com_nome=False):
+    """
+    Long-polling: responde assim que houver mensagens depois do cursor
+    ?depois=, ou vazio depois de ?espera= segundos (máximo CHAT_ESPERA_MAXIMA).
+    Enquanto espera lê o aviso de novidade no cache e consulta o banco
+    quando o aviso muda, quando não há aviso ou, no máximo, a cada
+    CHAT_ESPERA_CONFERENCIA segundos: o aviso é só uma dica (com cache
+    local, envios gravados por outro processo não aparecem nele).
+    """
+    texto = request.GET.get("depois")
+    try:
+        depois = conversas.decodificar_cursor(texto)
+    except ValueError:
+        depois = None
+    if depois is None:
+        return JsonResponse({"erro": "Cursor inválido"}, status=400)
+
+    try:
+        espera = float(request.GET.get("espera", 0))
+    except ValueError:
+        espera = 0
+    if not math.isfinite(espera):  # nan passaria pelo min/max e nunca venceria o prazo
+        espera = 0
+    espera = min(max(espera, 0), getattr(settings, "CHAT_ESPERA_MAXIMA", 25))
+    intervalo = getattr(settings, "CHAT_ESPERA_INTERVALO", 1.0)
+    conferencia = getattr(settings, "CHAT_ESPERA_CONFERENCIA", 5.0)
+    prazo = time.monotonic() + espera
+
+    visto = texto
+    conferir_em = time.monotonic() + conferencia
+    while True:
+        novidade = await conversas.ultima_novidade(chave)
+        if novidade is None or novidade != visto or time.monotonic() >= conferir_em:
+            mensagens = await sync_to_async(buscar)(depois)
+            if mensagens:
+                return JsonResponse({
+                    "mensagens": [conversas.mensagem_json(msg, com_nome) for msg in mensagens],
+                    "cursor": conversas.codificar_cursor(mensagens[-1]),
+                })
+            visto = novidade
+            conferir_em = time.monotonic() + conferencia
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            return JsonResponse({"mensagens": [], "cursor": texto})
+        await asyncio.sleep(min(intervalo, restante))
+
+
+@login_required
+async def mensagens_novas(request, usuario_id):
+    """Mensagens da conversa direta depois de ?depois= (com ?espera= para long-polling)."""
+    user = await request.auser()
+    if not await Usuario.objects.filter(id_usuario=usuario_id).aexists():
+        return JsonResponse({"erro": "Usuário não encontrado"}, status=404)
+    return await _esperar_mensagens(
+        request,
+        conversas.chave_conversa(user.id_usuario, usuario_id),
+        lambda depois: conversas.mensagens_depois(user.id_usuario, usuario_id, depois),
+    )
+
+
+@login_required
+async def mensagens_novas_grupo(request, grupo_id):
+    """Mensagens do grupo depois de ?depois= (com ?espera= para long-polling)."""
+    user = await request.auser()
+    if not await Grupo.objects.filter(id_grupo=grupo_id, membros=user).aexists():
+        return JsonResponse({"erro": "Você não é membro deste grupo."}, status=403)
+    return await _esperar_mensagens(
+        request,
+        conversas.chave_grupo(grupo_id),
+        lambda depois: conversas.mensagens_grupo_depois(grupo_id, depois),
+        com_nome=True,
+    )
+
+
+@login_required
+@limitar("conversa_grupo")
 def conversa_grupo(request, grupo_id):
     """
     View para exibir a conversa em grupo.
@@ -454,71 +578,31 @@ def conversa_grupo(request, grupo_id):
     grupo = get_object_or_404(Grupo, id_grupo=grupo_id)
     
     # Verifica se o usuário é membro do grupo
-    if user not in grupo.membros.all():
+    if not grupo.membros.filter(pk=user.pk).exists():
         return HttpResponseForbidden("Você não é membro deste grupo.")
 
-    # **NOTA:** Como o modelo Mensagem original não suporta grupos, 
-    # esta parte é um placeholder. Você precisaria de um modelo como 'MensagemGrupo'.
-    # Para fins de demonstração do layout, simulamos mensagens.
-    # Se você adicionar um modelo 'MensagemGrupo', substitua o código abaixo.
-    
-    # Simulação de mensagens para demonstração do layout
-    mensagens = [] # Lista vazia ou com mensagens simuladas
-    
-    # Lógica de envio de mensagem (adaptada para grupo)
+    # Lógica de envio de mensagem (cada mensagem é gravada uma vez só, no grupo)
     if request.method == "POST":
         form = MensagemForm(request.POST)
-        if form.is_valid() and form.cleaned_data.get('grupo_id') == grupo.id_grupo:
-            # **AQUI VOCÊ DEVE SALVAR A MENSAGEM NO SEU NOVO MODELO MensagemGrupo**
-            # Exemplo: MensagemGrupo.objects.create(grupo=grupo, remetente=user, mensagem=form.cleaned_data["mensagem"])
-            # Por enquanto, apenas redireciona
+        if form.is_valid():
+            try:
+                ingestao.enviar(MensagemGrupo(
+                    id_grupo=grupo,
+                    id_remetente=user,
+                    mensagem=form.cleaned_data["mensagem"],
+                ))
+            except ingestao.EnvioPendente:
+                return _resposta_envio_pendente(request)
+            # Redireciona para evitar reenvio de formulário
             return redirect("conversa_grupo", grupo_id=grupo.id_grupo)
     else:
         form = MensagemForm(initial={"grupo_id": grupo.id_grupo})
-        
-    # Reutiliza a lógica de lista de conversas da chat_view para a sidebar
-    contatos_ids = Mensagem.objects.filter(
-        Q(id_remetente=user) | Q(id_destinatario=user)
-    ).values_list('id_remetente__id_usuario', 'id_destinatario__id_usuario').distinct()
-    
-    all_ids = set()
-    for sender_id, receiver_id in contatos_ids:
-        all_ids.add(sender_id)
-        all_ids.add(receiver_id)
-    
-    all_ids.discard(user.id_usuario)
-    
-    amigos = Usuario.objects.filter(id_usuario__in=all_ids).order_by('nome')
-    grupos_list = user.grupos.all().order_by('nome')
-    
-    conversations = []
-    
-    for amigo in amigos:
-        last_message_obj = Mensagem.objects.filter(
-            Q(id_remetente=user, id_destinatario=amigo) | Q(id_remetente=amigo, id_destinatario=user)
-        ).order_by('-hora').first()
-        
-        last_message = last_message_obj.mensagem if last_message_obj else "Inicie a conversa"
-        
-        conversations.append({
-            'id': amigo.id_usuario,
-            'nome': amigo.nome,
-            'foto_perfil': amigo.foto_perfil,
-            'last_message': last_message,
-            'is_group': False,
-            'is_active': False,
-        })
-        
-    for g in grupos_list:
-        conversations.append({
-            'id': g.id_grupo,
-            'nome': g.nome,
-            'foto_perfil': None,
-            'last_message': f"Membros: {g.membros.count()}",
-            'is_group': True,
-            'is_active': g.id_grupo == grupo_id,
-        })
 
+    # Só a página mais recente; as anteriores vêm por mensagens_anteriores_grupo
+    mensagens, cursor_anteriores = conversas.pagina_de_mensagens_grupo(grupo.id_grupo)
+    conversas.marcar_grupo_como_lido(user.id_usuario, grupo.id_grupo)
+
+    conversations = conversas.conversas_da_lateral(user, grupo_ativo=grupo.id_grupo)
 
     context = {
         "is_authenticated": True,
@@ -529,6 +613,9 @@ def conversa_grupo(request, grupo_id):
             'is_group': True,
         },
         "mensagens": mensagens,
+        "cursor_anteriores": cursor_anteriores,
+        "cursor_novas": conversas.codificar_cursor(mensagens[-1]) if mensagens else "0_0",
+        "chave_conversa": conversas.chave_grupo(grupo.id_grupo),
         "form": form,
     }
     
@@ -536,16 +623,20 @@ def conversa_grupo(request, grupo_id):
 
 
 @login_required
+@limitar("enviar_mensagem")
 def enviar_mensagem(request, destinatario_id):
     destinatario = get_object_or_404(Usuario, id_usuario=destinatario_id)
     if request.method == "POST":
         form = MensagemForm(request.POST)
         if form.is_valid():
-            Mensagem.objects.create(
-                id_remetente=request.user,
-                id_destinatario=destinatario,
-                mensagem=form.cleaned_data["mensagem"],
-            )
+            try:
+                ingestao.enviar(Mensagem(
+                    id_remetente=request.user,
+                    id_destinatario=destinatario,
+                    mensagem=form.cleaned_data["mensagem"],
+                ))
+            except ingestao.EnvioPendente:
+                return _resposta_envio_pendente(request)
             return redirect("conversa", usuario_id=destinatario.id_usuario)
     else:
         form = MensagemForm(initial={"destinatario_id": destinatario_id})
@@ -574,7 +665,14 @@ def listar_grupos(request):
     q = request.GET.get("q")
     if q:
         qs = qs.filter(Q(nome__icontains=q) | Q(localizacao__icontains=q) | Q(descricao__icontains=q))
-    return render(request, "listar_grupos.html", {"grupos": qs})
+    # Distância (?raio= e ?local=), como em buscar_parceiros (ver app/geo.py)
+    origem, raio, aviso = _origem_e_raio(request, request.GET.get("local", "").strip())
+    if origem is not None:
+        if raio is None:
+            qs = geo.mais_proximos(qs, origem, 50)
+        else:
+            qs = geo.no_raio(qs, origem, raio).order_by("distancia", "nome")
+    return render(request, "listar_grupos.html", {"grupos": qs, "aviso": aviso, "raios": RAIOS_BUSCA})
 
 
 def ver_grupo(request, grupo_id):
@@ -692,6 +790,7 @@ def criar_comunidade(request):
 
         nome = data.get("nome")
         cor = data.get("cor")
+        esporte = (data.get("esporte") or "").strip().lower()
 
         if not nome:
             return JsonResponse({"status": "erro", "msg": "Nome obrigatório"})
@@ -699,6 +798,7 @@ def criar_comunidade(request):
         Comunidade.objects.create(
             nome=nome,
             cor=cor,
+            esporte=esporte,
             admin=request.user
         )
 
@@ -736,28 +836,27 @@ from django.shortcuts import render, get_object_or_404
 from django.utils import timezone
 from app.models import Comunidade, MetaComunidade, Ranking
 
-def metas_view(request, comunidade_id):
-    # Garante que os pontos estão atualizados
-    try:
-        calcular_ranking_global()
-    except:
-        pass
+TAMANHO_PAGINA_RANKING = 10
 
+def metas_view(request, comunidade_id):
+    # Os pontos já são mantidos em dia pelos signals (app/signals.py)
     comunidade = get_object_or_404(Comunidade, id=comunidade_id)
     metas = MetaComunidade.objects.filter(comunidade=comunidade)
     
-    # Busca ranking ordenado por pontos
-    ranking_list = Ranking.objects.select_related("usuario").order_by("-pontuacao_total")
+    # Placar da própria comunidade, uma página por vez (keyset: ?depois=/?antes=)
+    quadro = ranking.Quadro(comunidade_id=comunidade.id)
+    anterior = "antes" in request.GET
+    try:
+        cursor = ranking.decodificar_cursor(request.GET.get("antes" if anterior else "depois"))
+    except ValueError:
+        cursor, anterior = None, False
+    pagina = quadro.pagina(cursor, TAMANHO_PAGINA_RANKING, anterior)
+    ranking_list = pagina["itens"]
 
     colocacao = "-"
     if request.user.is_authenticated:
-        # LÓGICA CORRIGIDA:
-        # Usa 'enumerate' simples. Se você é o segundo da lista, sua colocação é 2.
-        # Isso alinha com o visual de medalhas da página de ranking.
-        for i, reg in enumerate(ranking_list, start=1):
-            if reg.usuario == request.user:
-                colocacao = i
-                break
+        # Uma contagem no índice do placar, sem percorrer o ranking inteiro
+        colocacao = quadro.posicao_no_ranking(request.user.id_usuario)
 
     # Verifica cumprimento das metas
     for meta in metas:
@@ -774,6 +873,8 @@ def metas_view(request, comunidade_id):
         "metas": metas,
         "colocacao": colocacao,
         "ranking_list": ranking_list,
+        "proximo": pagina["proximo"],
+        "anterior": pagina["anterior"],
         "sem_metas": not metas.exists(),
         "is_admin": request.user == comunidade.admin,
         "cor_bg": cor_bg,
@@ -817,6 +918,7 @@ def sair_comunidade(request, comunidade_id):
 from django.http import JsonResponse
 
 @login_required
+@limitar("meta")
 def cumprir_meta(request, meta_id):
     if request.method != "POST":
         return JsonResponse({"erro": "Método inválido"}, status=400)
@@ -831,8 +933,8 @@ def cumprir_meta(request, meta_id):
         meta.usuarios_cumpriram.add(request.user)
         estado = True
 
-    # recalcula ranking global
-    calcular_ranking_global()
+    # O signal de m2m_changed só agenda o recálculo do ranking;
+    # a resposta volta assim que a marcação é gravada
 
     return JsonResponse({
         "success": True,
@@ -899,63 +1001,106 @@ def sair_comunidade(request, comunidade_id):
 from django.db.models import Count
 from app.models import Usuario, MetaComunidade
 
-def ranking_global(request):
-    PONTOS_POR_META = 10
-
-    # Conta metas cumpridas por usuário
-    per_user = (
-        MetaComunidade.objects
-        .values('usuarios_cumpriram')
-        .annotate(metas_cumpridas=Count('id'))
-        .filter(usuarios_cumpriram__isnull=False)
-    )
+TAMANHO_PAGINA_RANKING_GLOBAL = 20
+AO_REDOR_PADRAO = 5
+AO_REDOR_MAXIMO = 25
 
-    # transforma em dicionário {id_usuario: quantidade}
-    counts = {d['usuarios_cumpriram']: d['metas_cumpridas'] for d in per_user}
-
-    # Se ninguém tem metas, retorna lista vazia
-    if not counts:
-        return render(request, "ranking.html", {"ranking_list": []})
-
-    # pega todos usuários envolvidos
-    user_objs = Usuario.objects.filter(id_usuario__in=list(counts.keys()))
-    users_by_id = {u.id_usuario: u for u in user_objs}
-
-    # monta o ranking no formato que o HTML espera
-    ranking_list = []
-    for uid, num_metas in counts.items():
-        u = users_by_id.get(uid)
-        if not u:
-            continue
-        ranking_list.append({
-            "usuario": u,
-            "pontuacao_total": num_metas * PONTOS_POR_META,
-            "metas_cumpridas": num_metas
-        })
 
-    # ordena por pontos
-    ranking_list.sort(key=lambda x: x["pontuacao_total"], reverse=True)
+def _ranking_pagina(request):
+    """
+    Monta a página pedida do ranking global (HTML e JSON usam a mesma):
+      ?esporte=corrida  placar daquele esporte;
+      ?periodo=semana|mes  placar da semana/mês atual;
+      ?depois=<cursor> / ?antes=<cursor>  próxima/página anterior (keyset);
+      ?ao_redor=N  o usuário logado e N posições acima e abaixo.
+    """
+    esporte = request.GET.get("esporte", "").strip().lower()
+    periodo = request.GET.get("periodo")
+    if periodo not in ranking.PERIODOS:
+        periodo = None
+    quadro = ranking.Quadro(esporte=esporte, periodo=periodo)
+
+    ao_redor = None
+    if "ao_redor" in request.GET and request.user.is_authenticated:
+        try:
+            ao_redor = int(request.GET["ao_redor"] or AO_REDOR_PADRAO)
+        except ValueError:
+            ao_redor = AO_REDOR_PADRAO
+        ao_redor = min(max(ao_redor, 1), AO_REDOR_MAXIMO)
+
+    if ao_redor:
+        janela = quadro.ao_redor(request.user.id_usuario, ao_redor)
+        itens = janela["acima"] + [janela["usuario"]] + janela["abaixo"]
+        pagina = {
+            "itens": itens,
+            # Dá para continuar rolando a partir das pontas da janela
+            "proximo": ranking.codificar_cursor(itens[-1]),
+            "anterior": ranking.codificar_cursor(itens[0]) if janela["acima"] else None,
+        }
+    else:
+        anterior = "antes" in request.GET
+        try:
+            cursor = ranking.decodificar_cursor(request.GET.get("antes" if anterior else "depois"))
+        except ValueError:
+            cursor, anterior = None, False
+        # Cada página fica em cache até a próxima mudança de pontos; a chave
+        # sai do cursor já validado, não do texto da URL
+        chave = "" if cursor is None else f"{cursor[0]}_{cursor[1]}"
+        pagina = ranking.em_cache(
+            f"{quadro.nome}:{'antes' if anterior else 'depois'}:{chave}",
+            lambda: quadro.pagina(cursor, TAMANHO_PAGINA_RANKING_GLOBAL, anterior),
+        )
+
+    itens = pagina["itens"]
+    # O histórico é do placar global: mostra quantas posições cada um
+    # subiu/caiu nos últimos 7 dias (uma consulta para a página toda)
+    if not esporte and not periodo:
+        variacoes = ranking.variacoes_de_posicao([item["usuario"].id_usuario for item in itens])
+        itens = [{**item, "variacao": variacoes.get(item["usuario"].id_usuario)} for item in itens]
+
+    return {
+        "ranking_list": itens,
+        "proximo": pagina["proximo"],
+        "anterior": pagina["anterior"],
+        "ao_redor": ao_redor,
+        "esporte": esporte,
+        "periodo": periodo,
+    }
 
-    return render(request, "ranking.html", {"ranking_list": ranking_list})
 
+def ranking_global(request):
+    # Lê o placar já gravado (mantido pelos signals) uma página por vez,
+    # então o tamanho da resposta não cresce com o número de usuários.
+    return render(request, "ranking.html", _ranking_pagina(request))
 
 
-def calcular_ranking_global():
-    from django.db.models import Count
+def ranking_json(request):
+    """Mesmos parâmetros de ranking_global, em JSON."""
+    contexto = _ranking_pagina(request)
+    return JsonResponse({
+        "itens": [
+            {
+                "posicao": item["posicao"],
+                "usuario_id": item["usuario"].id_usuario,
+                "nome": item["usuario"].nome,
+                "pontuacao_total": item["pontuacao_total"],
+                "variacao": item.get("variacao"),
+            }
+            for item in contexto["ranking_list"]
+        ],
+        "proximo": contexto["proximo"],
+        "anterior": contexto["anterior"],
+    })
 
-    PONTOS_POR_META = 10
 
-    # lista todos os usuários e conta metas cumpridas em todas as comunidades
-    dados = (
-        Usuario.objects.annotate(
-            total_metas=Count("metacomunidade__usuarios_cumpriram", distinct=True)
-        )
-    )
+def calcular_ranking_global():
+    """
+    Reconstrução completa do ranking, para rodar como job em lote.
+    No dia a dia o ranking é atualizado de forma incremental (app/ranking.py).
+    """
+    from app.ranking import recalcular_ranking_completo
 
-    for usuario in dados:
-        ranking, _ = Ranking.objects.get_or_create(usuario=usuario)
-        ranking.pontuacao_total = usuario.total_metas * PONTOS_POR_META
-        ranking.save()
+    recalcular_ranking_completo()
 
 
 def perfil_publico(request, usuario_id):
@@ -967,9 +1112,17 @@ def perfil_publico(request, usuario_id):
     
     # Verifica se já são parceiros ou se há chat (opcional, para botões de ação)
     # Por enquanto vamos focar em exibir os dados
-    
+
+    # Posição atual no ranking geral e a variação da semana (do histórico diário)
+    posicao_ranking = ranking.Quadro().posicao_no_ranking(perfil_user.id_usuario)
+    variacao_ranking = ranking.variacoes_de_posicao([perfil_user.id_usuario]).get(
+        perfil_user.id_usuario
+    )
+
     context = {
         'perfil_user': perfil_user,
         'preferencia': preferencia,
+        'posicao_ranking': posicao_ranking,
+        'variacao_ranking': variacao_ranking,
     }
     return render(request, 'perfil_publico.html', context)
\ No newline at end of file
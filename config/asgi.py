@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Importado depois do get_asgi_application(), que inicializa o Django
+from app.tempo_real import ROTA_CHAT, chat_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # WebSocket do chat (app/tempo_real.py); todo o resto vai para o Django
+    if scope["type"] == "websocket":
+        if scope["path"] == ROTA_CHAT:
+            return await chat_websocket(scope, receive, send)
+        await receive()
+        return await send({"type": "websocket.close", "code": 4404})
+    return await django_application(scope, receive, send)
@@ -16,6 +16,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # lookups de trigramas (pg_trgm)
     'app',  # sua aplicação principal
 ]
 
@@ -101,4 +102,119 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Em settings.py
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Ranking: como numerar empates.
+# "competicao" = 1, 2, 2, 4 | "denso" = 1, 2, 2, 3
+RANKING_MODO_EMPATE = "competicao"
+
+# Regras de pontuação do ranking: (classe, parâmetros), somadas por usuário.
+# Ex.: ("app.ranking.PontosPorConclusao", {"pontos": 20}) ou
+#      ("app.ranking.PontosPorEsporte", {"pontos": {"corrida": 5}})
+RANKING_REGRAS = [
+    ("app.ranking.PontosPorMeta", {"pontos": 10}),
+]
+
+# Placares semanais/mensais: quantos períodos manter (os mais antigos são apagados)
+RANKING_PERIODOS_RETIDOS = {"semana": 8, "mes": 12}
+
+# Recálculo do ranking depois de cumprir/desmarcar metas:
+# "thread" junta as mudanças numa thread de fundo (no máximo um lote por
+# intervalo); "sincrono" recalcula logo após o commit.
+RANKING_RECALCULO = "thread"
+RANKING_RECALCULO_INTERVALO = 2.0  # segundos
+RANKING_RECALCULO_LOTE = 500  # usuários por lote
+
+# Histórico diário do ranking (manage.py registrar_historico_ranking): quantos dias manter
+RANKING_HISTORICO_DIAS = 90
+
+# Páginas do ranking em cache (app/ranking.py): saem do cache a cada gravação
+# de pontos, mas só nos processos que compartilham o cache de quem gravou.
+# Sem CACHES compartilhado (Redis/Memcached), cada processo usa o próprio
+# LocMem e pode mostrar um placar até este tanto de segundos atrasado.
+RANKING_CACHE_TIMEOUT = 300
+
+# Chat ao vivo (long-polling em chat/u/<id>/novas/ e chat/g/<id>/novas/).
+# Com vários processos, use um cache compartilhado (Redis/Memcached) para
+# que o aviso de mensagem nova chegue a todos. Com o LocMem padrão cada
+# processo só vê os próprios avisos, e uma mensagem gravada por outro
+# processo pode levar até CHAT_ESPERA_CONFERENCIA segundos para chegar.
+CHAT_ESPERA_MAXIMA = 25  # segundos que uma requisição pode ficar esperando
+CHAT_ESPERA_INTERVALO = 1.0  # segundos entre verificações do aviso
+CHAT_ESPERA_CONFERENCIA = 5.0  # segundos entre consultas ao banco mesmo sem aviso novo
+
+# Chat em tempo real por WebSocket (/ws/chat/, servido pelo config/asgi.py;
+# rode com um servidor ASGI, ex.: uvicorn config.asgi:application).
+# PubSubMemoria entrega só dentro do processo: com vários processos/nós,
+# aponte para um backend compartilhado com a mesma interface (app/tempo_real.py).
+CHAT_PUBSUB = "app.tempo_real.PubSubMemoria"
+
+# Mensagens particionadas por mês (app/particoes.py, manage.py arquivar_mensagens).
+# Meses mais antigos que MENSAGENS_MESES_QUENTES saem do banco para arquivos
+# .csv.gz em MENSAGENS_ARQUIVO_DIR e voltam sob demanda quando alguém rola
+# o histórico até eles; voltam para o arquivo depois de MENSAGENS_RESTAURADOS_DIAS.
+MENSAGENS_MESES_QUENTES = 12
+MENSAGENS_PARTICOES_ADIANTE = 3  # meses futuros com partição já criada
+MENSAGENS_ARQUIVO_DIR = os.path.join(BASE_DIR, "arquivo_mensagens")
+MENSAGENS_RESTAURADOS_DIAS = 30
+# Volta de um mês arquivado pedida pelo chat: "thread" restaura numa thread
+# de fundo (o chat pede de novo até ele chegar); "sincrono" restaura na
+# própria requisição (testes e scripts).
+MENSAGENS_RESTAURACAO = "thread"
+# Segundos que o manifesto do arquivo (meses de cada conversa) fica no cache
+MENSAGENS_MANIFESTO_TIMEOUT = 300
+
+# Gravação das mensagens do chat (app/ingestao.py): "direta" grava cada envio
+# na própria requisição; "lote" junta envios simultâneos do processo num
+# bulk_create por transação e só responde depois do commit.
+CHAT_INGESTAO = "direta"
+CHAT_INGESTAO_LOTE = 200  # mensagens por lote
+CHAT_INGESTAO_ESPERA = 0.005  # segundos que a mensagem mais antiga espera o lote encher
+CHAT_INGESTAO_TIMEOUT = 10  # segundos que o envio espera a confirmação
+
+# Limite por usuário nas views que gravam (app/limites.py): escopo ->
+# (taxa, rajada). "30/m" = 30 por minuto em média, com até `rajada` seguidas.
+# Acima disso a resposta é 429 com Retry-After.
+LIMITES_REQUISICOES = {
+    # Um escopo (balde) por view, com o nome dela
+    "conversa": ("30/m", 10),  # POST em chat/u/<id>/
+    "conversa_grupo": ("30/m", 10),  # POST em chat/g/<id>/
+    "enviar_mensagem": ("30/m", 10),
+    "meta": ("20/m", 5),  # cumprir_meta
+}
+
+# Busca de parceiros por trigramas (app/parceiros.py): tolera erros de
+# digitação no nome e na localização ("Recfe" acha "Recife") e ordena pela semelhança. Quanto maior
+# o limiar (0 a 1), mais parecido o texto tem que ser para entrar.
+BUSCA_PARCEIROS_LIMITE = 50  # resultados por busca
+BUSCA_PARCEIROS_CANDIDATOS = 500  # linhas mais parecidas lidas pelo índice antes de pontuar
+BUSCA_PARCEIROS_LIMIAR = 0.5
+
+# Catálogo de esportes (app/esportes.py): semelhança mínima (0 a 1, difflib)
+# para um termo com erro de digitação contar como o sinônimo mais parecido.
+ESPORTES_SEMELHANCA_MINIMA = 0.85
+
+# Busca por distância (app/geo.py): `localizacao` de parceiros e grupos é
+# procurada neste CSV offline de municípios (nome,uf,latitude,longitude).
+# Pode ser trocado pela lista completa do IBGE no mesmo formato.
+GEO_GAZETEER = os.path.join(BASE_DIR, "app", "dados", "municipios_br.csv")
+GEO_SEMELHANCA_MINIMA = 0.85  # para aceitar nome de cidade com erro de digitação
+GEO_RAIO_INICIAL = 5  # km; "mais próximos" amplia x4 até achar o bastante
+GEO_RAIO_MAXIMO = 5000  # km
+
+# Compatibilidade entre parceiros (app/compatibilidade.py), usada quando a
+# busca não tem texto nem distância. Pesos de cada componente na nota final.
+COMPATIBILIDADE_PESOS = {"idade": 1.0, "turno": 1.0, "nivel": 1.0, "esporte": 2.0}
+COMPATIBILIDADE_TOLERANCIA_IDADE = 10  # anos de diferença para a idade valer 0
+COMPATIBILIDADE_MATRIZ_TTL = 300  # segundos até remontar a matriz do processo
+
+# Parceiros sugeridos pré-calculados (app/recomendacoes.py). Mudanças de
+# preferência/parceiro marcam só as listas afetadas; `manage.py
+# atualizar_recomendacoes` (periódico) refaz as marcadas e as mais velhas
+# que a validade, para incluir parceiros novos.
+RECOMENDACOES_QUANTIDADE = 50  # parceiros gravados por usuário
+RECOMENDACOES_VALIDADE_HORAS = 24
+# Lista marcada vista na busca: "thread" recalcula numa thread de fundo
+# depois da resposta; "sincrono" logo após o commit (testes e scripts);
+# "comando" só no manage.py atualizar_recomendacoes.
+RECOMENDACOES_ATUALIZACAO = "thread"
\ No newline at end of file
@@ -17,6 +17,7 @@ urlpatterns = [
     path("comunidade/<int:comunidade_id>/adicionar_meta/", views.adicionar_meta, name="adicionar_meta"),
     path("comunidade/<int:comunidade_id>/criar_meta_ajax/", views.criar_meta_ajax, name="criar_meta_ajax"),
     path("ranking/", views.ranking_global, name="ranking_global"),
+    path("ranking/json/", views.ranking_json, name="ranking_json"),
     path("meta/<int:meta_id>/cumprir/", views.cumprir_meta, name="cumprir_meta"),
     # Rotas gerais
     path("", views.home, name="home"), 
@@ -48,8 +49,15 @@ urlpatterns = [
 
     # Chat
     path("chat/", views.chat_view, name="chat"),
+    path("chat/busca/", views.buscar_mensagens, name="buscar_mensagens"),
     path("chat/u/<int:usuario_id>/", views.conversa, name="conversa"),  # Conversa individual
+    path("chat/u/<int:usuario_id>/anteriores/", views.mensagens_anteriores, name="mensagens_anteriores"),
     path("chat/g/<int:grupo_id>/", views.conversa_grupo, name="conversa_grupo"),  # Conversa em grupo
+    path("chat/u/<int:usuario_id>/novas/", views.mensagens_novas, name="mensagens_novas"),
+    path("chat/g/<int:grupo_id>/novas/", views.mensagens_novas_grupo, name="mensagens_novas_grupo"),
+    path("chat/g/<int:grupo_id>/anteriores/", views.mensagens_anteriores_grupo, name="mensagens_anteriores_grupo"),
+    path("chat/u/<int:usuario_id>/lida/", views.marcar_lida, name="marcar_lida"),
+    path("chat/g/<int:grupo_id>/lida/", views.marcar_grupo_lido, name="marcar_grupo_lido"),
 
     path('perfil/<int:usuario_id>/', views.perfil_publico, name='perfil_publico'),
 ]